@@ -24,6 +24,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -46,6 +47,10 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
 
+# With no 'loaders' option Django wraps the template loaders in its cached
+# loader, so each process compiles a template once (DEBUG included, where
+# the cache is reset when a template changes). Keep it that way when adding
+# loaders: listing them here without cached.Loader turns that off.
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -77,6 +82,87 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
 }
 
+# Every cache here is local memory, so per process: before running several
+# workers (e.g. uvicorn --workers), point them all at a shared backend, or
+# each worker serves stale products, wishlists and rankings. See the README.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Product API responses (see store/api_cache.py). Local memory is per
+    # process; with several workers use a shared backend, e.g.
+    # {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #  'LOCATION': BASE_DIR / 'cache' / 'api'}
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'product-api',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Rendered product cards and home page grids (see store/fragments.py).
+    # Their keys use the version stamps in the 'api' cache, so share both
+    # or neither between workers.
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+API_CACHE = 'api'
+FRAGMENT_CACHE = 'fragments'
+
+# Trained recommender artifacts (see `manage.py train_recommender`)
+RECOMMENDER_MODEL_DIR = BASE_DIR / "recommender_models"
+# Threads scoring recommendations for the async views; about one per core
+RECOMMENDER_SCORING_WORKERS = 2
+
+# Buffered view/cart/purchase tracking (see store/tracking.py for defaults)
+INTERACTION_TRACKING = {
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+# Resized WebP/JPEG copies of product images (see store/images.py). Their
+# names are content-hashed, so serve media/products/variants/ with
+# far-future cache headers.
+IMAGE_VARIANTS = {
+    'WORKERS': 2,
+}
+
+# Trending products for anonymous visitors and cold-start users (see
+# store/popularity.py for defaults)
+POPULARITY = {
+    'WINDOW_DAYS': 30,
+    'HALF_LIFE_HOURS': 72,
+    'TTL': 300,
+}
+
+# Server-Timing headers, per-view percentiles at /api/performance/ and
+# query budgets (see store/instrumentation.py for defaults). A budget covers
+# a logged-in visitor's session and user lookups, and the trending products
+# being recomputed; going over it logs a warning, or fails the tests.
+PERFORMANCE = {
+    'WINDOW': 1000,
+    'QUERY_BUDGETS': {
+        'store:home': 7,
+        'store:product_detail': 7,
+        'store:cart': 4,
+        'store:search': 5,
+        'store:order_detail': 4,
+        'api:product-list': 3,
+        'api:product-detail': 3,
+        'api:product-search': 4,
+        'api:product-autocomplete': 1,
+        'api:product-recommendations': 5,
+    },
+}
+
+# Seconds a placed order holds its stock before `release_expired_orders` frees it
+ORDER_RESERVATION_TTL = 15 * 60
+
+TEST_RUNNER = 'store.test_runner.StoreTestRunner'
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',},
@@ -1,21 +1,17 @@
+# Load a small sample dataset: python manage.py shell < populate_data.py
+# For bigger datasets use the command directly, e.g.
+#   python manage.py import_catalog --synthetic --products 50000 --users 10000
 from django.contrib.auth.models import User
-from store.models import Product, UserProductInteraction
-import random
+from django.core.management import call_command
 
-# Create sample users
-for i in range(5):
-    User.objects.create_user(username=f'user{i}', password='testpassword')
+call_command(
+    'import_catalog', synthetic=True,
+    categories=3, products=10, users=5, interactions_per_user=5,
+)
 
-# Create sample products
-products = []
-for i in range(10):
-    product = Product.objects.create(name=f'Product {i}', price=random.randint(10, 100))
-    products.append(product)
-
-# Generate sample interactions
-users = User.objects.all()
-for user in users:
-    for product in random.sample(products, k=5):  # Each user interacts with 5 random products
-        UserProductInteraction.objects.create(user=user, product=product, rating=random.randint(1, 5))
+# Let the sample users log in
+for user in User.objects.filter(username__in=[f'user{i}' for i in range(5)]):
+    user.set_password('testpassword')
+    user.save(update_fields=['password'])
 
 print("Sample data populated successfully!")
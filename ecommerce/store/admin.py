@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
-from .models import Category, Product, UserProductInteraction, Review, Wishlist
+from .models import Category, Product, UserProductInteraction, Review, Wishlist, Cart, CartItem, Order, OrderLine
 
 
 # Register Category
@@ -11,9 +11,9 @@ class CategoryAdmin(admin.ModelAdmin):
 # Register Product
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'stock', 'image')
+    list_display = ('name', 'sku', 'category', 'price', 'stock', 'image')
     list_filter = ('category',)
-    search_fields = ('name', 'description')
+    search_fields = ('name', 'sku', 'description')
 
     # If you want only admins to update images but allow staff to edit other fields
     def get_readonly_fields(self, request, obj=None):
@@ -37,3 +37,25 @@ class ReviewAdmin(admin.ModelAdmin):
 @admin.register(Wishlist)
 class WishlistAdmin(admin.ModelAdmin):
     list_display = ('user',)
+
+
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    extra = 0
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'total', 'updated_at')
+    inlines = [CartItemInline]
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    raw_id_fields = ('product',)
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'total', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    inlines = [OrderLineInline]
@@ -0,0 +1,120 @@
+"""
+Response caching for the read-only product API.
+
+Serialized payloads are cached per product (detail) and per query string
+(list) in the API_CACHE cache. Keys embed a version stamp that is bumped by
+the Product/Category signals in store/signals.py, so a change makes exactly
+the affected entries unreachable instead of flushing the whole cache. The
+same stamp drives ETag/Last-Modified, so a client revalidating data it
+already has gets a 304 without touching the database or the serializer.
+
+With the default local-memory backend each worker has its own cache and
+only sees invalidations made in that process; point API_CACHE at a shared
+backend (file, memcached, redis) when running several workers.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_CACHE', 'default')]
+
+
+def product_version_key(product_id):
+    return f'product:{product_id}:version'
+
+
+def _version(key):
+    # A missing stamp (cold or evicted cache) counts as changed now.
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def catalog_version():
+    """Stamp bumped by any product change; what list pages are cached under."""
+    return _version(CATALOG_VERSION_KEY)
+
+
+def product_versions(product_ids):
+    """Return ``{product_id: version stamp}`` with one cache round trip."""
+    keys = {product_version_key(product_id): product_id for product_id in product_ids}
+    found = get_cache().get_many(keys)
+    return {
+        product_id: found[key] if key in found else _version(key)
+        for key, product_id in keys.items()
+    }
+
+
+def product_changed(product_id):
+    """Invalidate the cached detail payload of one product and every list page."""
+    now = time.time()
+    get_cache().set_many({product_version_key(product_id): now, CATALOG_VERSION_KEY: now}, timeout=None)
+
+
+def products_changed(product_ids):
+    now = time.time()
+    versions = {product_version_key(product_id): now for product_id in product_ids}
+    versions[CATALOG_VERSION_KEY] = now
+    get_cache().set_many(versions, timeout=None)
+
+
+class CachedResponseMixin:
+    """
+    Serve successful GET responses of a DRF view from the API cache, with
+    conditional-request support. Subclasses define `get_cache_scope`.
+    """
+
+    def get_cache_scope(self, request, *args, **kwargs):
+        """Return ``(key, version_key)``: what identifies this response and what invalidates it."""
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        key, version_key = self.get_cache_scope(request, *args, **kwargs)
+        version = _version(version_key)
+        etag = '"%s"' % hashlib.md5(f'{key}:{version!r}'.encode()).hexdigest()
+        last_modified = int(version)
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        cache = get_cache()
+        entry_key = f'{key}:{version!r}'
+        data = cache.get(entry_key)
+        if data is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(entry_key, response.data)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class CachedListMixin(CachedResponseMixin):
+    def get_cache_scope(self, request, *args, **kwargs):
+        # Paginated payloads contain absolute next/previous links, so the host is part of the key
+        path = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return f'products:list:{path}', CATALOG_VERSION_KEY
+
+
+class CachedDetailMixin(CachedResponseMixin):
+    def get_cache_scope(self, request, *args, **kwargs):
+        product_id = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # Image URLs are absolute, so the host is part of the key
+        return f'products:detail:{request.get_host()}:{product_id}', product_version_key(product_id)
@@ -1,10 +1,18 @@
 from django.urls import path
-from .views import ProductListView, ProductDetailView, ProductRecommendationsView
+from .views import (
+    ProductAutocompleteView, ProductDetailView, ProductListView, ProductRecommendationsBatchView, ProductSearchView,
+    export_products, performance_stats, product_recommendations,
+)
 
 app_name = 'api'
 
 urlpatterns = [
     path('products/', ProductListView.as_view(), name='product-list'),
+    path('products/search/', ProductSearchView.as_view(), name='product-search'),
+    path('products/autocomplete/', ProductAutocompleteView.as_view(), name='product-autocomplete'),
+    path('products/export/', export_products, name='product-export'),
     path('products/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
-    path('recommendations/<int:user_id>/', ProductRecommendationsView.as_view(), name='product-recommendations'),
+    path('recommendations/batch/', ProductRecommendationsBatchView.as_view(), name='product-recommendations-batch'),
+    path('recommendations/<int:user_id>/', product_recommendations, name='product-recommendations'),
+    path('performance/', performance_stats, name='performance'),
 ]
@@ -0,0 +1,234 @@
+"""
+Benchmarks of the storefront's hot paths, for ``manage.py benchmark``.
+
+`seed_dataset` loads a synthetic catalog (see catalog_import.synthetic_rows)
+plus reviews into the current database. `run_benchmarks` then times each
+scenario in SCENARIOS after one warm-up call. It reports wall time
+percentiles and the queries made per call, counted by
+store/instrumentation.py. One extra call runs under tracemalloc for the
+peak memory, since tracing slows the timed calls down. Views are called
+through the test client, so their middleware, sessions and templates are
+included.
+
+Results are plain dicts that can be saved as JSON. `compare_results`
+flags the scenarios that got slower, made more queries or used more
+memory than in a baseline run.
+"""
+import itertools
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import api_cache
+from .catalog_import import IMPORTERS, KINDS, synthetic_rows
+from .instrumentation import measure, percentile
+from .models import Cart, CartItem, Product, Review
+from .ratings import rebuild_ratings
+from .recommender import (
+    build_model, get_user_item_matrix, get_user_recommendations, save_model, train_recommendation_model,
+)
+
+# Scenarios that rebuild the recommender are run this many times fewer
+HEAVY_DIVISOR = 10
+
+
+def seed_dataset(users=200, products=2000, categories=20, interactions_per_user=20, reviews_per_product=3,
+                 seed=0):
+    """Load a synthetic dataset into the current database. Returns its sizes."""
+    datasets = synthetic_rows(
+        categories=categories, products=products, users=users,
+        interactions_per_user=interactions_per_user, seed=seed,
+    )
+    for kind in KINDS:
+        options = {'create_users': True} if kind == 'interactions' else {}
+        IMPORTERS[kind](datasets[kind], **options)
+
+    rng = np.random.default_rng(seed)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    reviews = []
+    for product_id in Product.objects.values_list('id', flat=True).iterator():
+        count = min(reviews_per_product, len(user_ids))
+        for user_index, rating in zip(rng.choice(len(user_ids), size=count, replace=False),
+                                      rng.integers(1, 6, size=count)):
+            reviews.append(Review(product_id=product_id, user_id=user_ids[user_index], rating=int(rating),
+                                  comment='Synthetic review'))
+    Review.objects.bulk_create(reviews, batch_size=1000)
+    rebuild_ratings()
+    return {
+        'users': len(user_ids),
+        'products': Product.objects.count(),
+        'categories': categories,
+        'interactions': users * interactions_per_user,
+        'reviews': len(reviews),
+    }
+
+
+# Each scenario takes the run's options and returns the function it times
+
+def _user_item_matrix(options):
+    return get_user_item_matrix
+
+
+def _train_recommender(options):
+    matrix = get_user_item_matrix()
+    return lambda: train_recommendation_model(matrix)
+
+
+def _user_recommendations(options):
+    user_ids = itertools.cycle(options['user_ids'])
+    return lambda: list(get_user_recommendations(next(user_ids)))
+
+
+def _home_anonymous(options):
+    client = Client()
+    return lambda: client.get(reverse('store:home'))
+
+
+def _home_user(options):
+    client = Client()
+    client.force_login(User.objects.get(pk=options['user_ids'][0]))
+    return lambda: client.get(reverse('store:home'))
+
+
+def _cart_client(options):
+    client = Client()
+    client.get(reverse('store:home'))  # start a session
+    cart = Cart.objects.create()
+    product_ids = Product.objects.order_by('id').values_list('id', flat=True)[:options['cart_lines']]
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_id=product_id, quantity=1, unit_price=10) for product_id in product_ids
+    ])
+    session = client.session
+    session['cart_id'] = cart.id
+    session.save()
+    return client, list(product_ids)
+
+
+def _cart(options):
+    client, _ = _cart_client(options)
+    return lambda: client.get(reverse('store:cart'))
+
+
+def _update_cart(options):
+    client, product_ids = _cart_client(options)
+    actions = itertools.cycle(['increment', 'decrement'])
+    return lambda: client.post(
+        reverse('store:update_cart'), {'product_id': product_ids[0], 'action': next(actions)},
+        content_type='application/json',
+    )
+
+
+def _product_list(options):
+    client = Client()
+    pages = -(-Product.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE'])
+    numbers = itertools.cycle(range(1, pages + 1))
+
+    def fetch():
+        api_cache.get_cache().clear()  # time the database path, not the response cache
+        return client.get(reverse('api:product-list'), {'page': next(numbers)})
+    return fetch
+
+
+SCENARIOS = {
+    'user_item_matrix': (_user_item_matrix, True),
+    'train_recommender': (_train_recommender, True),
+    'user_recommendations': (_user_recommendations, False),
+    'home_anonymous': (_home_anonymous, False),
+    'home_user': (_home_user, False),
+    'cart': (_cart, False),
+    'update_cart': (_update_cart, False),
+    'product_list_api': (_product_list, False),
+}
+
+
+def _time(fn, iterations):
+    fn()  # warm up caches and the loaded model
+    durations, queries = [], []
+    for _ in range(iterations):
+        with measure() as stats:
+            started = time.perf_counter()
+            fn()
+            durations.append((time.perf_counter() - started) * 1000)
+        queries.append(stats.queries)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(durations, 0.50), 3),
+        'p95_ms': round(percentile(durations, 0.95), 3),
+        'p99_ms': round(percentile(durations, 0.99), 3),
+        'max_ms': round(durations[-1], 3),
+        'mean_ms': round(sum(durations) / len(durations), 3),
+        'queries': max(queries),
+        'peak_mib': round(peak / 2**20, 2),
+    }
+
+
+def run_benchmarks(iterations=50, cart_lines=20, scenarios=None, seed=0, report=None):
+    """
+    Time `scenarios` (default: all of SCENARIOS) against the current
+    database and return the results. `report(name, result)` is called as
+    each scenario finishes.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    options = {
+        'cart_lines': cart_lines,
+        'user_ids': [int(user_id) for user_id in rng.permutation(user_ids)],
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as model_dir, override_settings(
+        DEBUG=False, ALLOWED_HOSTS=['testserver'], RECOMMENDER_MODEL_DIR=model_dir,
+    ):
+        artifact = build_model()
+        if artifact is not None:
+            save_model(artifact)
+        for name in scenarios or SCENARIOS:
+            factory, heavy = SCENARIOS[name]
+            results[name] = _time(factory(options), max(1, iterations // HEAVY_DIVISOR) if heavy else iterations)
+            if report is not None:
+                report(name, results[name])
+    return {
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'scenarios': results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.5, min_ms=1.0):
+    """
+    Regressions of `current` against `baseline` results, as ``(scenario,
+    metric, before, after)`` tuples. Times and peak memory regress when
+    they grow by more than `threshold` (0.5 is 50%), ignoring time changes
+    under `min_ms`; any extra query is a regression.
+    """
+    regressions = []
+    for name, after in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if after[metric] - before[metric] > max(before[metric] * threshold, min_ms):
+                regressions.append((name, metric, before[metric], after[metric]))
+        if after['queries'] > before['queries']:
+            regressions.append((name, 'queries', before['queries'], after['queries']))
+        if after['peak_mib'] > before['peak_mib'] * (1 + threshold) + 0.1:
+            regressions.append((name, 'peak_mib', before['peak_mib'], after['peak_mib']))
+    return regressions
@@ -0,0 +1,183 @@
+"""
+Server-side shopping cart.
+
+The session only remembers the id of the visitor's Cart. Line changes touch
+a single CartItem row plus the cart's maintained `total`, using the unit
+price captured when the product was first added, so no catalog reads or
+session rewrites are needed after that.
+"""
+from collections import namedtuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+SESSION_KEY = 'cart_id'
+
+# Result of a line change: the line's new quantity and total, and the cart total
+CartLine = namedtuple('CartLine', ['quantity', 'total', 'grand_total'])
+
+
+class PricedCart:
+    def __init__(self, items, grand_total):
+        # [{'product': Product, 'quantity': int, 'total': Decimal}, ...]
+        self.items = items
+        self.grand_total = grand_total
+
+
+def get_cart_id(request, create=False):
+    """
+    Return the id of the visitor's cart, creating one when `create` is set.
+    Returns None if there is no cart yet.
+    """
+    cart_id = request.session.get(SESSION_KEY)
+    if cart_id is None:
+        if request.user.is_authenticated:
+            if create:
+                cart_id = Cart.objects.get_or_create(user=request.user)[0].id
+            else:
+                cart_id = Cart.objects.filter(user=request.user).values_list('id', flat=True).first()
+        elif create:
+            cart_id = Cart.objects.create().id
+        if cart_id is not None:
+            request.session[SESSION_KEY] = cart_id
+    return cart_id
+
+
+def price_cart(request):
+    """Return the cart's lines and total with a single query."""
+    cart_id = get_cart_id(request)
+    if cart_id is None:
+        return PricedCart([], 0)
+    items = []
+    grand_total = 0
+    for item in CartItem.objects.filter(cart_id=cart_id).select_related('product').order_by('id'):
+        total = item.unit_price * item.quantity
+        grand_total += total
+        items.append({
+            'product': item.product,
+            'quantity': item.quantity,
+            'total': total,
+        })
+    return PricedCart(items, grand_total)
+
+
+def change_quantity(request, product_id, delta):
+    """
+    Add `delta` (which may be negative) units of a product to the cart; the
+    line is removed when its quantity reaches zero. Returns a CartLine, or
+    None if the product does not exist.
+    """
+    cart_id = get_cart_id(request, create=delta > 0)
+    if cart_id is None:
+        return _empty_line(product_id)
+    return _apply(cart_id, product_id, delta)
+
+
+def remove_item(request, product_id):
+    """Remove a product from the cart. Returns a CartLine, or None if the product does not exist."""
+    cart_id = get_cart_id(request)
+    if cart_id is None:
+        return _empty_line(product_id)
+    return _apply(cart_id, product_id, None)
+
+
+def _empty_line(product_id):
+    if not Product.objects.filter(pk=product_id).exists():
+        return None
+    return CartLine(0, 0, 0)
+
+
+def _apply(cart_id, product_id, delta):
+    # delta=None removes the whole line
+    with transaction.atomic():
+        item = (
+            CartItem.objects.select_for_update()
+            .filter(cart_id=cart_id, product_id=product_id)
+            .values_list('id', 'quantity', 'unit_price')
+            .first()
+        )
+        if item is None:
+            price = Product.objects.filter(pk=product_id).values_list('price', flat=True).first()
+            if price is None:
+                return None
+            if delta is None or delta <= 0:
+                return CartLine(0, 0, _total(cart_id))
+            try:
+                with transaction.atomic():
+                    CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=delta, unit_price=price)
+            except IntegrityError:
+                # A concurrent first add of the same product inserted the line
+                # first (there was no row to lock); add to that line instead
+                item = (
+                    CartItem.objects.select_for_update()
+                    .filter(cart_id=cart_id, product_id=product_id)
+                    .values_list('id', 'quantity', 'unit_price')
+                    .get()
+                )
+            else:
+                item = (None, 0, price)
+        item_id, old_quantity, unit_price = item
+
+        quantity = old_quantity + delta if delta is not None else 0
+        if item_id is not None:
+            if quantity > 0:
+                CartItem.objects.filter(pk=item_id).update(quantity=F('quantity') + delta)
+            else:
+                quantity = 0
+                CartItem.objects.filter(pk=item_id).delete()
+        Cart.objects.filter(pk=cart_id).update(
+            total=F('total') + unit_price * (quantity - old_quantity), updated_at=timezone.now()
+        )
+        return CartLine(quantity, unit_price * quantity, _total(cart_id))
+
+
+def _total(cart_id):
+    total = Cart.objects.filter(pk=cart_id).values_list('total', flat=True).first()
+    return 0 if total is None else total
+
+
+def recalculate_total(cart_id):
+    """Recompute a cart's maintained total from its items."""
+    Cart.objects.filter(pk=cart_id).update(
+        total=Coalesce(
+            Subquery(
+                CartItem.objects.filter(cart_id=OuterRef('pk'))
+                .values('cart_id')
+                .annotate(sum=Sum(F('quantity') * F('unit_price')))
+                .values('sum')
+            ),
+            Value(0),
+            output_field=DecimalField(decimal_places=2, max_digits=12),
+        )
+    )
+
+
+def merge_carts(request, user):
+    """
+    Fold the anonymous session cart into `user`'s cart at login; quantities
+    of products in both are added together.
+    """
+    anonymous_id = request.session.get(SESSION_KEY)
+    with transaction.atomic():
+        user_cart, _ = Cart.objects.get_or_create(user=user)
+        if anonymous_id is not None and anonymous_id != user_cart.id:
+            anonymous = Cart.objects.filter(pk=anonymous_id, user__isnull=True).first()
+            if anonymous is not None:
+                existing = dict(
+                    CartItem.objects.filter(cart=user_cart).values_list('product_id', 'id')
+                )
+                for item in CartItem.objects.filter(cart=anonymous):
+                    if item.product_id in existing:
+                        CartItem.objects.filter(pk=existing[item.product_id]).update(
+                            quantity=F('quantity') + item.quantity
+                        )
+                    else:
+                        item.cart = user_cart
+                        item.save(update_fields=['cart'])
+                anonymous.delete()
+                recalculate_total(user_cart.id)
+    request.session[SESSION_KEY] = user_cart.id
@@ -0,0 +1,368 @@
+"""
+Bulk import of categories, products (including stock) and interactions.
+
+Rows are read lazily from CSV or NDJSON and handled BATCH_SIZE at a time:
+each batch is validated, matched against existing rows with one query per
+model on its natural key (Category.name, Product.sku, User.username), and
+written with `bulk_create`/`bulk_update` inside its own transaction. A row
+that fails validation is reported and skipped without affecting the rest of
+its batch. Product rows only change the columns they contain, so a file of
+``sku,stock`` rows is a stock update. Used by ``manage.py import_catalog``.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import api_cache
+from .models import Category, Product, UserProductInteraction
+
+BATCH_SIZE = 1000
+KINDS = ('categories', 'products', 'interactions')
+# Errors kept for the report; the rest are only counted
+MAX_ERRORS = 100
+
+INTERACTION_TYPES = {value for value, _ in UserProductInteraction.INTERACTION_CHOICES}
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.errors = []  # [(line, message), ...], at most MAX_ERRORS
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+
+def read_rows(f, fmt):
+    """
+    Yield ``(line, row)`` from an open text file, where `row` is a dict of the
+    non-empty values on that line. `fmt` is 'csv' or 'ndjson'.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+    else:
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                yield line, None
+                continue
+            yield line, {key: value for key, value in row.items() if value not in ('', None)}
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def _text(row, key, max_length=None, required=False):
+    value = row.get(key)
+    if value is None:
+        if required:
+            raise RowError(f'{key} is required')
+        return None
+    value = str(value).strip()
+    if max_length is not None and len(value) > max_length:
+        raise RowError(f'{key} is longer than {max_length} characters')
+    return value
+
+
+def _price(value):
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f'invalid price {value!r}')
+    if not price.is_finite() or price < 0 or price >= 10 ** 8:
+        raise RowError(f'invalid price {value!r}')
+    return price.quantize(Decimal('0.01'))
+
+
+def _stock(value):
+    try:
+        stock = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'invalid stock {value!r}')
+    if stock < 0:
+        raise RowError(f'invalid stock {value!r}')
+    return stock
+
+
+def _run(rows, batch_size, import_batch):
+    result = ImportResult()
+    for batch in batched(rows, batch_size):
+        valid = []
+        for line, row in batch:
+            if row is None:
+                result.error(line, 'not a JSON object')
+            else:
+                valid.append((line, row))
+        with transaction.atomic():
+            import_batch(valid, result)
+    return result
+
+
+def _ensure_categories(names):
+    """Return {name: id} for `names`, creating the categories that don't exist yet."""
+    ids = {}
+    # Category names aren't unique in the schema; the oldest one wins
+    for category_id, name in Category.objects.filter(name__in=names).order_by('-id').values_list('id', 'name'):
+        ids[name] = category_id
+    missing = [Category(name=name) for name in names if name not in ids]
+    for category in Category.objects.bulk_create(missing):
+        ids[category.name] = category.id
+    if missing and missing[0].id is None:  # backends that don't return ids from bulk_create
+        ids.update(Category.objects.filter(name__in=[c.name for c in missing]).values_list('name', 'id'))
+    return ids
+
+
+def import_categories(rows, batch_size=BATCH_SIZE):
+    """Upsert categories by name from rows with `name` and optional `description`."""
+    def import_batch(batch, result):
+        cleaned = {}
+        for line, row in batch:
+            try:
+                name = _text(row, 'name', max_length=100, required=True)
+                cleaned[name] = _text(row, 'description')
+            except RowError as e:
+                result.error(line, str(e))
+        existing = {}
+        for category in Category.objects.filter(name__in=cleaned).order_by('-id'):
+            existing[category.name] = category
+        changed = []
+        for name, description in cleaned.items():
+            category = existing.get(name)
+            if category is None:
+                continue
+            if description is not None and category.description != description:
+                category.description = description
+                changed.append(category)
+        Category.objects.bulk_update(changed, ['description'], batch_size=batch_size)
+        created = Category.objects.bulk_create(
+            [Category(name=name, description=description or '') for name, description in cleaned.items()
+             if name not in existing],
+            batch_size=batch_size,
+        )
+        result.created += len(created)
+        result.updated += len(changed)
+        if changed:
+            api_cache.products_changed(
+                Product.objects.filter(category__in=changed).values_list('id', flat=True)
+            )
+
+    return _run(rows, batch_size, import_batch)
+
+
+def _clean_product(row):
+    product = {'sku': _text(row, 'sku', max_length=64, required=True)}
+    if 'name' in row:
+        product['name'] = _text(row, 'name', max_length=200)
+    if 'description' in row:
+        product['description'] = _text(row, 'description')
+    if 'price' in row:
+        product['price'] = _price(row['price'])
+    if 'stock' in row:
+        product['stock'] = _stock(row['stock'])
+    # A storage path; exports contain URLs instead, which are left alone
+    if 'image' in row and not str(row['image']).startswith('/') and '://' not in str(row['image']):
+        product['image'] = _text(row, 'image', max_length=100)
+    if 'category' not in row and 'category_name' in row:  # the column name used by exports
+        row = {**row, 'category': row['category_name']}
+    if 'category' in row:
+        product['category'] = _text(row, 'category', max_length=100)
+    return product
+
+
+def _current(product, key):
+    value = getattr(product, key)
+    return value.name if key == 'image' else value
+
+
+def import_products(rows, batch_size=BATCH_SIZE):
+    """
+    Upsert products by `sku`. New products need name, price and category
+    (by name; missing categories are created). Existing products only get
+    the columns present in their row.
+    """
+    def import_batch(batch, result):
+        cleaned = {}
+        for line, row in batch:
+            try:
+                product = _clean_product(row)
+            except RowError as e:
+                result.error(line, str(e))
+                continue
+            # A sku repeated within the batch is merged, later values winning
+            cleaned[product['sku']] = {**cleaned.get(product['sku'], {}), **product, 'line': line}
+
+        category_ids = _ensure_categories({p['category'] for p in cleaned.values() if 'category' in p})
+        existing = Product.objects.in_bulk(list(cleaned), field_name='sku')
+        now = timezone.now()
+        to_create, to_update, fields = [], [], set()
+        for sku, values in cleaned.items():
+            line = values.pop('line')
+            if 'category' in values:
+                values['category_id'] = category_ids[values.pop('category')]
+            product = existing.get(sku)
+            if product is None:
+                missing = [key for key in ('name', 'price', 'category_id') if key not in values]
+                if missing:
+                    result.error(line, f'new product {sku} needs {", ".join(missing).replace("_id", "")}')
+                    continue
+                to_create.append(Product(**values))
+            else:
+                # Rows that change nothing are skipped, which keeps re-imports of a full feed cheap
+                changed = [key for key, value in values.items() if key != 'sku' and _current(product, key) != value]
+                if not changed:
+                    result.unchanged += 1
+                    continue
+                for key in changed:
+                    setattr(product, key, values[key])
+                product.updated_at = now  # bulk_update skips auto_now
+                fields.update(changed)
+                to_update.append(product)
+
+        Product.objects.bulk_create(to_create, batch_size=batch_size)
+        if to_update:
+            Product.objects.bulk_update(to_update, [*fields, 'updated_at'], batch_size=batch_size)
+        result.created += len(to_create)
+        result.updated += len(to_update)
+        if to_create or to_update:
+            api_cache.products_changed([product.id for product in to_update])
+
+    return _run(rows, batch_size, import_batch)
+
+
+def import_interactions(rows, batch_size=BATCH_SIZE, create_users=False):
+    """
+    Append interactions from rows with `user` (username), `product` (sku),
+    `interaction_type` and an optional ISO 8601 `timestamp`. Unknown users
+    are an error unless `create_users` is set, in which case they are
+    created without a usable password.
+    """
+    unusable_password = make_password(None)
+
+    def import_batch(batch, result):
+        cleaned = []
+        for line, row in batch:
+            try:
+                username = _text(row, 'user', max_length=150, required=True)
+                sku = _text(row, 'product', max_length=64, required=True)
+                interaction_type = _text(row, 'interaction_type', required=True)
+                if interaction_type not in INTERACTION_TYPES:
+                    raise RowError(f'unknown interaction_type {interaction_type!r}')
+                timestamp = row.get('timestamp')
+                if timestamp is not None:
+                    try:
+                        timestamp = parse_datetime(str(timestamp))
+                    except ValueError:
+                        timestamp = None
+                    if timestamp is None:
+                        raise RowError(f'invalid timestamp {row["timestamp"]!r}')
+                    if timezone.is_naive(timestamp):
+                        timestamp = timezone.make_aware(timestamp)
+            except RowError as e:
+                result.error(line, str(e))
+                continue
+            cleaned.append((line, username, sku, interaction_type, timestamp or timezone.now()))
+
+        usernames = {username for _, username, _, _, _ in cleaned}
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        if create_users:
+            User.objects.bulk_create(
+                [User(username=name, password=unusable_password) for name in usernames if name not in user_ids],
+                batch_size=batch_size,
+            )
+            user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        product_ids = dict(
+            Product.objects.filter(sku__in={sku for _, _, sku, _, _ in cleaned}).values_list('sku', 'id')
+        )
+
+        interactions = []
+        for line, username, sku, interaction_type, timestamp in cleaned:
+            if username not in user_ids:
+                result.error(line, f'unknown user {username!r}')
+            elif sku not in product_ids:
+                result.error(line, f'unknown product {sku!r}')
+            else:
+                interactions.append(UserProductInteraction(
+                    user_id=user_ids[username], product_id=product_ids[sku],
+                    interaction_type=interaction_type, timestamp=timestamp,
+                ))
+        UserProductInteraction.objects.bulk_create(interactions, batch_size=batch_size)
+        result.created += len(interactions)
+
+    return _run(rows, batch_size, import_batch)
+
+
+IMPORTERS = {
+    'categories': import_categories,
+    'products': import_products,
+    'interactions': import_interactions,
+}
+
+
+def synthetic_rows(categories=10, products=1000, users=100, interactions_per_user=20, seed=0):
+    """
+    Return ``{kind: rows}`` for a generated dataset, in the shape `read_rows`
+    produces. Product popularity is skewed so that a few products get most
+    of the interactions, as in a real catalog.
+    """
+    rng = np.random.default_rng(seed)
+    types = ['view'] * 8 + ['cart'] * 3 + ['purchase']
+
+    def category_rows():
+        for i in range(categories):
+            yield i + 1, {'name': f'Category {i}', 'description': f'Synthetic category {i}'}
+
+    def product_rows():
+        prices = rng.uniform(1, 500, size=products).round(2)
+        stock = rng.integers(0, 200, size=products)
+        picks = rng.integers(0, max(categories, 1), size=products)
+        for i in range(products):
+            yield i + 1, {
+                'sku': f'SKU-{i:08d}',
+                'name': f'Product {i}',
+                'description': f'Synthetic product {i}',
+                'price': f'{prices[i]:.2f}',
+                'stock': int(stock[i]),
+                'category': f'Category {picks[i]}',
+            }
+
+    def interaction_rows():
+        line = 0
+        for user in range(users):
+            picks = (products * rng.random(interactions_per_user) ** 3).astype(np.int64)
+            kinds = rng.integers(0, len(types), size=interactions_per_user)
+            for product, kind in zip(picks, kinds):
+                line += 1
+                yield line, {'user': f'user{user}', 'product': f'SKU-{product:08d}', 'interaction_type': types[kind]}
+
+    return {
+        'categories': category_rows(),
+        'products': product_rows(),
+        'interactions': interaction_rows(),
+    }
@@ -0,0 +1,77 @@
+"""
+Filtering, ordering and facet counts for the product list API.
+
+Price, category and stock filters are served by the composite indexes
+declared on Product; see Product.Meta.
+"""
+import django_filters
+from django.db.models import Count, Q
+
+from .models import Product
+from .search import PRICE_RANGES
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+class StableOrderingFilter(django_filters.OrderingFilter):
+    # Break ties on id so that page boundaries don't move between requests
+    def filter(self, qs, value):
+        qs = super().filter(qs, value)
+        if value:
+            qs = qs.order_by(*qs.query.order_by, 'id')
+        return qs
+
+
+class ProductFilter(django_filters.FilterSet):
+    min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    # ?categories=1,4,7 matches any of them
+    categories = NumberInFilter(field_name='category', lookup_expr='in')
+    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
+    min_rating = django_filters.NumberFilter(field_name='rating_average', lookup_expr='gte')
+    ordering = StableOrderingFilter(fields=['price', 'rating_average', 'rating_count', 'name'])
+
+    class Meta:
+        model = Product
+        fields = ['category', 'price']
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(stock__gt=0) if value else queryset.filter(stock=0)
+
+
+def facet_counts(queryset):
+    """
+    Count the products in `queryset` per category, per price range (the
+    ranges used by search) and in stock, with a single GROUP BY query.
+    """
+    buckets = {}
+    for index, (_, low, high) in enumerate(PRICE_RANGES):
+        bounds = Q()
+        if low is not None:
+            bounds &= Q(price__gte=low)
+        if high is not None:
+            bounds &= Q(price__lt=high)
+        buckets[f'price_{index}'] = Count('id', filter=bounds)
+    rows = (
+        queryset.order_by()
+        .values('category_id', 'category__name')
+        .annotate(count=Count('id'), in_stock=Count('id', filter=Q(stock__gt=0)), **buckets)
+    )
+
+    categories, prices, in_stock = [], [0] * len(PRICE_RANGES), 0
+    for row in rows:
+        categories.append({'id': row['category_id'], 'name': row['category__name'], 'count': row['count']})
+        in_stock += row['in_stock']
+        for index in range(len(PRICE_RANGES)):
+            prices[index] += row[f'price_{index}']
+    categories.sort(key=lambda facet: (-facet['count'], facet['name']))
+    return {
+        'categories': categories,
+        'price': [
+            {'label': label, 'min': low, 'max': high, 'count': count}
+            for (label, low, high), count in zip(PRICE_RANGES, prices)
+        ],
+        'in_stock': in_stock,
+    }
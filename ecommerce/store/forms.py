@@ -5,7 +5,7 @@ class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
         # Ensure these fields exist in your Product model (including the image field)
-        fields = ['name', 'description', 'price', 'stock', 'image', 'category']
+        fields = ['name', 'sku', 'description', 'price', 'stock', 'image', 'category']
 
 
 class ReviewForm(forms.ModelForm):
@@ -0,0 +1,74 @@
+"""
+Cached HTML of the storefront's product listings.
+
+A product card is rendered once per version of its product and reused by
+every page that shows it. The version is the stamp in store/api_cache.py,
+which every change to the product, its category, reviews, stock or
+images bumps, so an edited product gets a new card and the others keep
+theirs. The cards of a listing are fetched with one `get_many`, and only
+the missing ones are rendered.
+
+The product grid of the home page (its cards and pagination) is the same
+for every anonymous visitor, so the home view caches it whole per
+category and page, under the catalog version. Only the recommendations
+block, and a logged-in visitor's wishlist buttons, are assembled per
+request. Fragments live in the FRAGMENT_CACHE cache.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import api_cache
+
+# Bump when _product_card.html or _product_grid.html change, so that a
+# shared cache doesn't keep serving fragments of the old templates.
+TEMPLATE_VERSION = 2
+
+
+def get_cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE', 'default')]
+
+
+def render_cards(products, compact=False):
+    """
+    Return the card HTML of each of `products`, in order. `compact` cards
+    (recommendations, similar products) are smaller and have no description.
+    """
+    if not products:
+        return []
+    versions = api_cache.product_versions([product.id for product in products])
+    style = 'compact' if compact else 'full'
+    keys = [
+        f'card:{TEMPLATE_VERSION}:{style}:{product.id}:{versions[product.id]!r}' for product in products
+    ]
+    cache = get_cache()
+    cards = cache.get_many(keys)
+    missing = {
+        key: render_to_string('store/_product_card.html', {'product': product, 'compact': compact})
+        for key, product in zip(keys, products) if key not in cards
+    }
+    if missing:
+        cache.set_many(missing)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def grid_key(category_id, after, before):
+    """Cache key of a home page grid; a new one whenever any product changes."""
+    return f'grid:{TEMPLATE_VERSION}:{api_cache.catalog_version()!r}:{category_id}:{after}:{before}'
+
+
+def render_grid(page, category_id, wishlisted=None):
+    """
+    The home page's product grid and pagination for a keyset `page`. Given
+    the ids of the visitor's `wishlisted` products, each card gets a
+    wishlist button.
+    """
+    return mark_safe(render_to_string('store/_product_grid.html', {
+        'products': page.object_list,
+        'items': list(zip(page.object_list, render_cards(page.object_list))),
+        'page': page,
+        'category_id': category_id,
+        'wishlisted': wishlisted,
+    }))
@@ -0,0 +1,170 @@
+"""
+Pre-generated responsive derivatives of Product.image.
+
+When a product is saved with a new image, resized copies are rendered in
+WebP and JPEG at IMAGE_WIDTHS by a small thread pool, after the saving
+transaction commits, so Pillow never runs in the request that uploaded the
+image nor in any request that displays it. Derivatives are named after a
+hash of their content, so they can be served with far-future cache headers.
+Their names are recorded in Product.image_variants:
+
+    {'source': 'products/phone.jpg',
+     'webp': {'320': 'products/variants/phone.3f2a...-320w.webp', ...},
+     'jpeg': {'320': ..., ...}}
+
+Configure it with the IMAGE_VARIANTS setting; ``manage.py
+generate_image_variants`` backfills existing products.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import api_cache
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WIDTHS = (160, 320, 640, 1024)
+# Pillow format name, file extension and encoder options
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'products/variants'
+
+DEFAULTS = {
+    # Threads rendering derivatives in the background.
+    'WORKERS': 2,
+    # Render in the pool. When False, render inline when the save commits
+    # (used by the test runner).
+    'BACKGROUND': True,
+}
+
+
+def _options():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_VARIANTS', {})}
+
+
+def render_variants(source, storage):
+    """
+    Render every derivative of the image stored as `source` and save the
+    ones not already in `storage`. Returns the image_variants dict.
+    """
+    with storage.open(source, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    # Never upscale: an image narrower than a width is rendered once, at its own width
+    widths = sorted({min(width, image.width) for width in IMAGE_WIDTHS})
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = {'source': source}
+    for key, (pil_format, extension, options) in FORMATS.items():
+        variants[key] = {}
+        for width in widths:
+            resized = image if width == image.width else image.resize(
+                (width, max(1, round(image.height * width / image.width))), Image.LANCZOS
+            )
+            if pil_format == 'JPEG' and resized.mode != 'RGB':
+                resized = resized.convert('RGB')
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            content = buffer.getvalue()
+            digest = hashlib.sha256(content).hexdigest()[:16]
+            name = f'{VARIANTS_DIR}/{stem}.{digest}-{width}w.{extension}'
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(content))
+            variants[key][str(width)] = name
+    return variants
+
+
+def refresh_variants(product_id, force=False):
+    """
+    Bring one product's image_variants up to date with its image, or
+    re-render them anyway with `force`. Returns True if they were written.
+    """
+    row = Product.objects.filter(pk=product_id).values_list('image', 'image_variants').first()
+    if row is None:
+        return False
+    source, current = row
+    if (current or {}).get('source') == (source or None) and not (force and source):
+        return False
+    if not source:
+        variants = {}
+    else:
+        try:
+            variants = render_variants(source, Product._meta.get_field('image').storage)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+            logger.exception('Could not render variants of %s for product %s.', source, product_id)
+            return False
+    # Only record them if the image wasn't replaced again in the meantime
+    same_image = Q(image=source) if source else Q(image='') | Q(image__isnull=True)
+    updated = Product.objects.filter(same_image, pk=product_id).update(image_variants=variants)
+    if updated:
+        api_cache.product_changed(product_id)
+    return bool(updated)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_options()['WORKERS'], thread_name_prefix='image-variants')
+        return _executor
+
+
+def _run(product_id):
+    close_old_connections()
+    try:
+        refresh_variants(product_id)
+    except Exception:
+        logger.exception('Rendering image variants for product %s failed.', product_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(product_id):
+    """Render a product's derivatives once the current transaction commits."""
+    if _options()['BACKGROUND']:
+        transaction.on_commit(lambda: _get_executor().submit(_run, product_id))
+    else:
+        transaction.on_commit(lambda: refresh_variants(product_id))
+
+
+def needs_variants(product):
+    return (product.image_variants or {}).get('source') != (product.image.name or None)
+
+
+def srcset(variants, key, build_url=None):
+    """Return the srcset attribute for one format of `variants`, or '' if there are none."""
+    storage = Product._meta.get_field('image').storage
+    entries = []
+    for width, name in sorted((variants or {}).get(key, {}).items(), key=lambda item: int(item[0])):
+        url = storage.url(name)
+        entries.append(f'{build_url(url) if build_url else url} {width}w')
+    return ', '.join(entries)
+
+
+@receiver(setting_changed)
+def reset_executor(setting, **kwargs):
+    global _executor
+    if setting == 'IMAGE_VARIANTS' and _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,241 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware times every request and counts its database
+queries: how many, how long they took, and how often the same SQL ran
+again, which is what an N+1 loop looks like. Time spent in functions
+decorated with `timed` (the recommender) is reported separately. The
+numbers go out in a Server-Timing header, so browser dev tools show them
+next to the request, and into a rolling window of recent requests per
+URL name, served as percentiles by `/api/performance/` to staff users.
+
+Views can be given query budgets. A request over its budget is logged,
+or raises QueryBudgetExceeded when STRICT is set, which the test runner
+does so that a new N+1 fails the test suite instead of reaching
+production. Configure it with the PERFORMANCE setting.
+
+Queries are counted through a wrapper installed on every database
+connection, and attributed to the request through a context variable, so
+queries made by async views in `sync_to_async` threads are counted too.
+For streaming responses only the work done before streaming starts is
+measured.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Requests kept per URL name for the percentiles.
+    'WINDOW': 1000,
+    # URL name -> most queries a request may make, e.g. {'store:home': 4}.
+    'QUERY_BUDGETS': {},
+    # Raise QueryBudgetExceeded instead of logging (used by the test runner).
+    'STRICT': False,
+    # Log a warning when one SQL statement runs this many times in a request.
+    'DUPLICATE_THRESHOLD': 5,
+}
+
+
+def _options():
+    return {**DEFAULTS, **getattr(settings, 'PERFORMANCE', {})}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.timers = defaultdict(float)  # name -> seconds, see `timed`
+
+    @property
+    def duplicates(self):
+        """Queries that repeated a statement already run in this request."""
+        return sum(count - 1 for count in self.statements.values())
+
+    def add(self, other):
+        self.queries += other.queries
+        self.db_time += other.db_time
+        self.statements.update(other.statements)
+        for name, seconds in other.timers.items():
+            self.timers[name] += seconds
+
+
+_current = ContextVar('request_stats', default=None)
+
+
+@contextmanager
+def measure():
+    """
+    Count the queries and timers of the code in the block into the
+    RequestStats it yields. Nested blocks count towards the outer ones too.
+    """
+    outer = _current.get()
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.add(stats)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+        stats.statements[sql] += 1
+
+
+@receiver(connection_created)
+def install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def timed(name):
+    """Decorator adding a function's run time to the current request's `name` timer."""
+    def decorator(fn):
+        if iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                stats, started = _current.get(), time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    if stats is not None:
+                        stats.timers[name] += time.perf_counter() - started
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                stats, started = _current.get(), time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    if stats is not None:
+                        stats.timers[name] += time.perf_counter() - started
+        return wrapper
+    return decorator
+
+
+_samples = {}
+_samples_lock = threading.Lock()
+
+
+def _remember(view_name, seconds, queries):
+    with _samples_lock:
+        if view_name not in _samples:
+            _samples[view_name] = deque(maxlen=_options()['WINDOW'])
+        _samples[view_name].append((seconds, queries))
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted, non-empty list; `fraction` is e.g. 0.95."""
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def snapshot():
+    """Wall time percentiles (ms) and query counts of the recent requests, per URL name."""
+    with _samples_lock:
+        samples = {view_name: list(window) for view_name, window in _samples.items()}
+    report = {}
+    for view_name, window in sorted(samples.items()):
+        durations = sorted(seconds * 1000 for seconds, _ in window)
+        queries = sorted(count for _, count in window)
+        report[view_name] = {
+            'count': len(window),
+            'p50_ms': round(percentile(durations, 0.50), 2),
+            'p95_ms': round(percentile(durations, 0.95), 2),
+            'p99_ms': round(percentile(durations, 0.99), 2),
+            'max_ms': round(durations[-1], 2),
+            'queries_p50': percentile(queries, 0.50),
+            'queries_max': queries[-1],
+        }
+    return report
+
+
+def reset():
+    with _samples_lock:
+        _samples.clear()
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _options()['ENABLED']:
+            return self.get_response(request)
+        with measure() as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if not _options()['ENABLED']:
+            return await self.get_response(request)
+        with measure() as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        elapsed = time.perf_counter() - stats.started
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else '<unresolved>'
+        _remember(view_name, elapsed, stats.queries)
+
+        metrics = [
+            f'total;dur={elapsed * 1000:.1f}',
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries, {stats.duplicates} duplicates"',
+        ]
+        metrics += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in sorted(stats.timers.items())]
+        response['Server-Timing'] = ', '.join(metrics)
+
+        options = _options()
+        if stats.statements:
+            sql, count = stats.statements.most_common(1)[0]
+            if count >= options['DUPLICATE_THRESHOLD']:
+                logger.warning('%s ran the same query %d times (N+1?): %s', view_name, count, sql)
+        budget = options['QUERY_BUDGETS'].get(view_name)
+        if budget is not None and stats.queries > budget:
+            message = f'{view_name} made {stats.queries} queries; its budget is {budget}.'
+            if options['STRICT']:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+@receiver(setting_changed)
+def reset_samples(setting, **kwargs):
+    if setting == 'PERFORMANCE':
+        reset()
@@ -0,0 +1,76 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.export import render_ndjson
+from store.recommender import BATCH_CHUNK_SIZE, active_user_ids, load_model, recommend_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Write recommendations for many users as NDJSON ({"user_id", "product_ids"} per line), '
+        'the same ones /api/recommendations/<id>/ serves. Uses the model trained by train_recommender, '
+        'or trending products until there is one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='Users to recommend for.')
+        parser.add_argument('--all-active', action='store_true', help='Recommend for every active user.')
+        parser.add_argument('--input', help='File with one user id per line ("-" for stdin).')
+        parser.add_argument('-n', type=int, default=5, help='Products per user.')
+        parser.add_argument('-o', '--output', help='File to write to (default: stdout).')
+        parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE, help='Users per matrix product.')
+        parser.add_argument('--workers', type=int, default=1, help='Processes sharing the chunks.')
+
+    def handle(self, *args, **options):
+        sources = [bool(options['user_ids']), options['all_active'], bool(options['input'])]
+        if sum(sources) != 1:
+            raise CommandError('Give user ids, --all-active or --input (exactly one of them).')
+        if load_model() is None:
+            self.stderr.write(self.style.WARNING(
+                'No trained model; everyone gets trending products. Run train_recommender for personal ones.'
+            ))
+
+        if options['all_active']:
+            user_ids = active_user_ids()
+        elif options['input']:
+            user_ids = self.read_ids(options['input'])
+        else:
+            user_ids = options['user_ids']
+
+        started = time.perf_counter()
+        rows = (
+            {'user_id': user_id, 'product_ids': product_ids}
+            for user_id, product_ids in recommend_batch(
+                user_ids, n_recommendations=options['n'], chunk_size=options['chunk_size'],
+                workers=options['workers'],
+            )
+        )
+        lines = render_ndjson(rows)
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(
+            f'Wrote recommendations for {count} users to {options["output"]} in {time.perf_counter() - started:.1f}s.'
+        ))
+
+    def read_ids(self, path):
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                if not line.isdigit():
+                    raise CommandError(f'{path}:{number}: not a user id: {line!r}')
+                yield int(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
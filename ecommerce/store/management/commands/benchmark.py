@@ -0,0 +1,94 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from store.benchmarks import SCENARIOS, compare_results, run_benchmarks, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with a synthetic dataset and time the recommender, storefront views '
+        'and product API: latency percentiles, queries per call and peak memory. Save the results with '
+        '--output and check a later run against them with --compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', metavar='BASELINE', help='Flag regressions against a saved run.')
+        parser.add_argument('--input', metavar='RESULTS',
+                            help='Compare a saved run instead of running the benchmarks.')
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help='Relative slowdown or memory growth reported as a regression (default: 0.5, '
+                                 'as timings on shared machines vary by a third between runs).')
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), help='Default: all of them.')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed calls per scenario.')
+        parser.add_argument('--cart-lines', type=int, default=20, help='Lines in the benchmarked cart.')
+
+        dataset = parser.add_argument_group('synthetic dataset')
+        dataset.add_argument('--users', type=int, default=200)
+        dataset.add_argument('--products', type=int, default=2000)
+        dataset.add_argument('--categories', type=int, default=20)
+        dataset.add_argument('--interactions-per-user', type=int, default=20)
+        dataset.add_argument('--reviews-per-product', type=int, default=3)
+        dataset.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['input']:
+            if not options['compare']:
+                raise CommandError('--input only makes sense with --compare.')
+            results = self.load(options['input'])
+        else:
+            results = self.run(options)
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8') as f:
+                    json.dump(results, f, indent=2)
+                self.stderr.write(f'Saved results to {options["output"]}.')
+
+        if options['compare']:
+            self.compare(self.load(options['compare']), results, options['threshold'])
+
+    def run(self, options):
+        # The test database is created from the migrations and destroyed
+        # afterwards, leaving the configured database alone
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stderr.write('Seeding the test database...')
+            dataset = seed_dataset(
+                users=options['users'], products=options['products'], categories=options['categories'],
+                interactions_per_user=options['interactions_per_user'],
+                reviews_per_product=options['reviews_per_product'], seed=options['seed'],
+            )
+            self.stdout.write(
+                f'{"scenario":<22} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak MiB":>9}'
+            )
+            results = run_benchmarks(
+                iterations=options['iterations'], cart_lines=options['cart_lines'],
+                scenarios=options['scenarios'], seed=options['seed'], report=self.report,
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        return {**results, 'dataset': dataset}
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<22} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+            f'{result["queries"]:>8} {result["peak_mib"]:>9.2f}'
+        )
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'{path}: {e}')
+
+    def compare(self, baseline, results, threshold):
+        if baseline.get('dataset') != results.get('dataset'):
+            self.stderr.write(self.style.WARNING('The runs used different datasets; compare with care.'))
+        regressions = compare_results(baseline, results, threshold=threshold)
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f'{name}: {metric} {before} -> {after}'))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions against the baseline.')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,52 @@
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from store.recommender import UserItemMatrix, train_recommendation_model
+
+
+class Command(BaseCommand):
+    help = 'Measure memory use and fit/query time of the recommender on a synthetic sparse dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--products', type=int, default=50_000)
+        parser.add_argument('--interactions-per-user', type=int, default=20)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        users, products = options['users'], options['products']
+        n_interactions = users * options['interactions_per_user']
+        user_ids = rng.integers(1, users + 1, size=n_interactions)
+        # Skewed product popularity, as in a real catalog
+        product_ids = (products * rng.random(n_interactions) ** 3).astype(np.int64) + 1
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        user_item_matrix = UserItemMatrix.from_pairs(user_ids, product_ids)
+        built = time.perf_counter()
+        model = train_recommendation_model(user_item_matrix)
+        fitted = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        rows = rng.integers(0, user_item_matrix.shape[0], size=options['queries'])
+        query_started = time.perf_counter()
+        for row in rows:
+            model.kneighbors(int(row), n_neighbors=5)
+        query_ms = (time.perf_counter() - query_started) / len(rows) * 1000
+
+        n_rows, n_cols = user_item_matrix.shape
+        matrix = user_item_matrix.matrix
+        sparse_mb = (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2**20
+        dense_mb = n_rows * n_cols * 8 / 2**20
+        self.stdout.write(f'matrix:        {n_rows} users x {n_cols} products, {matrix.nnz} non-zeros')
+        self.stdout.write(f'sparse size:   {sparse_mb:.1f} MiB (dense pivot would need {dense_mb:,.0f} MiB)')
+        self.stdout.write(f'peak memory:   {peak / 2**20:.1f} MiB while building and fitting')
+        self.stdout.write(f'build time:    {built - started:.2f}s')
+        self.stdout.write(f'fit time:      {fitted - built:.2f}s')
+        self.stdout.write(f'query time:    {query_ms:.2f} ms per user (mean of {len(rows)})')
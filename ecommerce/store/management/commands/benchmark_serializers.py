@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from store.models import Product
+from store.serializers import ProductRowSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare products serialized per second by ProductSerializer and the ProductRowSerializer fast path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Products serialized per round.')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        limit, rounds = options['limit'], options['rounds']
+        host = next((h for h in settings.ALLOWED_HOSTS if h not in ('*', '') and not h.startswith('.')), 'localhost')
+        context = {'request': RequestFactory().get('/api/products/', HTTP_HOST=host)}
+        if not Product.objects.exists():
+            raise CommandError('No products to serialize; load some first (see import_catalog).')
+
+        def model_serializer():
+            products = Product.objects.select_related('category').order_by('id')[:limit]
+            return ProductSerializer(products, many=True, context=context).data
+
+        row_serializer = ProductRowSerializer(context=context)
+
+        def fast_path():
+            rows = Product.objects.order_by('id').values(*row_serializer.get_value_fields())[:limit]
+            return row_serializer.to_representation(rows)
+
+        if model_serializer() != fast_path():
+            raise CommandError('Fast path output differs from ProductSerializer.')
+        for label, serialize in [('ProductSerializer', model_serializer), ('ProductRowSerializer', fast_path)]:
+            serialized = 0
+            started = time.perf_counter()
+            for _ in range(rounds):
+                serialized += len(serialize())
+            rate = serialized / (time.perf_counter() - started)
+            self.stdout.write(f'{label:<22} {rate:>12,.0f} products/s')
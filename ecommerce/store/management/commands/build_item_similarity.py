@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store.recommender import ITEM_NEIGHBORS, build_item_index, load_item_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the item-item similarity index used for "customers also viewed". '
+        'By default only products touched since the last run are recomputed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every product instead of updating.')
+        parser.add_argument('-k', type=int, default=ITEM_NEIGHBORS, help='Similar products kept per product.')
+
+    def handle(self, *args, **options):
+        previous = None if options['full'] else load_item_index()
+        index = build_item_index(previous=previous, k=options['k'])
+        if index is None:
+            self.stdout.write(self.style.WARNING('No interactions recorded yet; nothing to index.'))
+            return
+        path = index.save()
+        mode = 'updated' if previous is not None else 'built'
+        self.stdout.write(self.style.SUCCESS(
+            f'Item similarity index {mode}: {len(index.product_ids)} products, k={index.k} -> {path}'
+        ))
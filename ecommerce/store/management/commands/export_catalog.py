@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.export import CHUNK_SIZE, FORMATS, RENDERERS, export_rows, parse_updated_since
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream the whole catalog as NDJSON or CSV, in id order. Use --after with the '
+        'last id received to resume an interrupted export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('-o', '--output', help='File to write to (default: stdout).')
+        parser.add_argument('--after', type=int, help='Only export products with a larger id.')
+        parser.add_argument('--updated-since', help='Only export products changed since this ISO 8601 date/datetime.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows fetched per database round trip.')
+        parser.add_argument('--base-url', default='', help='Prefix for image URLs, e.g. https://shop.example.com')
+
+    def handle(self, *args, **options):
+        updated_since = None
+        if options['updated_since']:
+            try:
+                updated_since = parse_updated_since(options['updated_since'])
+            except ValueError as e:
+                raise CommandError(e)
+        base_url = options['base_url'].rstrip('/')
+        rows = export_rows(
+            after=options['after'],
+            updated_since=updated_since,
+            chunk_size=options['chunk_size'],
+            build_url=(lambda url: base_url + url) if base_url else None,
+        )
+        lines = RENDERERS[options['format']](rows)
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        count = -1 if options['format'] == 'csv' else 0  # the CSV header is not a product
+        with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} products to {options["output"]}.'))
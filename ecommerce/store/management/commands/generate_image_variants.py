@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.images import refresh_variants
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the resized WebP/JPEG copies of product images that are missing or out of date, '
+        'e.g. for products created before the pipeline existed or by a bulk import.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Images rendered in parallel.')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render every product with an image, e.g. after changing IMAGE_WIDTHS.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by('id').values_list('id', 'image', 'image_variants')
+        stale = [
+            product_id for product_id, image, variants in products.iterator()
+            if (options['force'] and image) or (variants or {}).get('source') != (image or None)
+        ]
+
+        def refresh(product_id):
+            try:
+                return refresh_variants(product_id, force=options['force'])
+            finally:
+                close_old_connections()
+
+        if options['workers'] > 1:
+            # Pillow releases the GIL while resizing and encoding, so threads scale
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                updated = sum(pool.map(refresh, stale))
+        else:
+            updated = sum(map(refresh_variants, stale, [options['force']] * len(stale)))
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {len(stale)} products; updated image variants of {updated}.'
+        ))
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_import import BATCH_SIZE, IMPORTERS, KINDS, read_rows, synthetic_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import categories, products (upserted by sku) or interactions from a CSV or NDJSON '
+        'file, or load a generated dataset with --synthetic.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="File to import, or '-' for stdin.")
+        parser.add_argument('--kind', choices=KINDS, help='What the file contains.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Default: from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per transaction.')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create users named in interactions that do not exist yet.')
+
+        synthetic = parser.add_argument_group('synthetic dataset')
+        synthetic.add_argument('--synthetic', action='store_true', help='Generate and import a dataset.')
+        synthetic.add_argument('--categories', type=int, default=10)
+        synthetic.add_argument('--products', type=int, default=1000)
+        synthetic.add_argument('--users', type=int, default=100)
+        synthetic.add_argument('--interactions-per-user', type=int, default=20)
+        synthetic.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            datasets = synthetic_rows(
+                categories=options['categories'], products=options['products'], users=options['users'],
+                interactions_per_user=options['interactions_per_user'], seed=options['seed'],
+            )
+            for kind in KINDS:
+                self.run(kind, datasets[kind], options['batch_size'], create_users=True)
+            return
+
+        path = options['path']
+        if not path or not options['kind']:
+            raise CommandError('Give a path and --kind, or use --synthetic.')
+        fmt = options['format']
+        if fmt is None:
+            extension = os.path.splitext(path)[1].lower()
+            fmt = 'csv' if extension == '.csv' else 'ndjson' if extension in ('.ndjson', '.jsonl') else None
+            if fmt is None:
+                raise CommandError('Cannot tell the format from the file name; pass --format.')
+        if path == '-':
+            self.run(options['kind'], read_rows(sys.stdin, fmt), options['batch_size'], options['create_users'])
+            return
+        try:
+            f = open(path, encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(e)
+        with f:
+            self.run(options['kind'], read_rows(f, fmt), options['batch_size'], options['create_users'])
+
+    def run(self, kind, rows, batch_size, create_users):
+        options = {'create_users': create_users} if kind == 'interactions' else {}
+        started = time.perf_counter()
+        result = IMPORTERS[kind](rows, batch_size=batch_size, **options)
+        elapsed = time.perf_counter() - started
+        for line, message in result.errors:
+            self.stderr.write(f'line {line}: {message}')
+        if result.skipped > len(result.errors):
+            self.stderr.write(f'... and {result.skipped - len(result.errors)} more errors')
+        style = self.style.SUCCESS if not result.skipped else self.style.WARNING
+        self.stdout.write(style(
+            f'{kind}: {result.created} created, {result.updated} updated, {result.unchanged} unchanged, '
+            f'{result.skipped} skipped in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized rating aggregates on every product from its reviews.'
+
+    def handle(self, *args, **options):
+        updated = rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt ratings; {updated} products had stale aggregates.'))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.popularity import cache_is_shared, compute_popularity, publish
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the trending products ranking and publish it to the shared cache, '
+        'so that workers pick it up without querying. Run it from cron more often than POPULARITY["TTL"].'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show', type=int, default=10, help='Print this many of the top products.')
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            self.stderr.write(self.style.WARNING(
+                'POPULARITY["CACHE"] is a per-process cache, so the web workers will not see this ranking; '
+                'point it at a shared cache backend.'
+            ))
+        started = time.perf_counter()
+        popularity = compute_popularity()
+        publish(popularity)
+        elapsed = time.perf_counter() - started
+
+        top = popularity.top(options['show'])
+        names = Product.objects.in_bulk(top)
+        for rank, product_id in enumerate(top, 1):
+            self.stdout.write(f'{rank:>3}. {names[product_id].name if product_id in names else product_id}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Ranked {len(popularity.ranked[None])} products in {len(popularity.ranked) - 1} categories '
+            f'in {elapsed:.2f}s.'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.orders import release_expired_orders
+
+
+class Command(BaseCommand):
+    help = 'Expire pending orders whose stock reservation has run out and put their stock back. Run it from cron.'
+
+    def handle(self, *args, **options):
+        released = release_expired_orders()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired orders.'))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.recommender import build_model, load_model, save_model, update_model
+
+
+class Command(BaseCommand):
+    help = 'Train the product recommendation model and write it to RECOMMENDER_MODEL_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Apply only interactions created since the last run to the saved model.',
+        )
+        parser.add_argument(
+            '--watch', type=float, metavar='SECONDS',
+            help='Keep running, applying new interactions every SECONDS (implies --incremental).',
+        )
+
+    def handle(self, *args, **options):
+        if options['watch']:
+            while True:
+                self.train(incremental=True)
+                time.sleep(options['watch'])
+        self.train(incremental=options['incremental'])
+
+    def train(self, incremental):
+        artifact = load_model() if incremental else None
+        if artifact is not None:
+            applied = update_model(artifact)
+            if not applied:
+                return
+            path = save_model(artifact)
+            self.stdout.write(f"Applied {applied} new interactions -> model {artifact['version']} ({path})")
+            return
+
+        artifact = build_model()
+        if artifact is None:
+            self.stdout.write(self.style.WARNING('No interactions recorded yet; nothing to train.'))
+            return
+        path = save_model(artifact)
+        users, products = artifact['matrix'].shape
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained model {artifact['version']} ({users} users x {products} products) -> {path}"
+        ))
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_wishlist'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userproductinteraction',
+            name='interaction_type',
+            field=models.CharField(choices=[('view', 'View'), ('cart', 'Add to cart'), ('purchase', 'Purchase')], max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='userproductinteraction',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from store.search import ensure_index
+    ensure_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    from store.search import drop_index
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_product_sku'),
+    ]
+
+    operations = [
+        # SQLite only; a no-op elsewhere (see store/search.py)
+        migrations.RunPython(create_index, drop_index),
+    ]
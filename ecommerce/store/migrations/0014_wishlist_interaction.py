@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userproductinteraction',
+            name='interaction_type',
+            field=models.CharField(choices=[('view', 'View'), ('cart', 'Add to cart'), ('purchase', 'Purchase'), ('wishlist', 'Add to wishlist')], max_length=50),
+        ),
+    ]
@@ -1,5 +1,7 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 
@@ -13,26 +15,60 @@ class Category(models.Model):
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="products")
     name = models.CharField(max_length=200)
+    # Natural key for catalog imports (see store/catalog_import.py)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     description = models.TextField()
     price = models.DecimalField(decimal_places=2, max_digits=10)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized copies of `image`, filled in off the request thread (see store/images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Review aggregates, maintained on review writes (see store/ratings.py)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    # Lets catalog exports pick up only what changed (see store/export.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Category listings filtered or sorted by price (see store/filters.py)
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['stock'], name='product_stock_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    @property
+    def rating_histogram(self):
+        """[(stars, count), ...] from 5 stars down to 1."""
+        return [(stars, getattr(self, f'rating_{stars}_count')) for stars in range(5, 0, -1)]
     
 
 class UserProductInteraction(models.Model):
     INTERACTION_CHOICES = (
         ('view', 'View'),
+        ('cart', 'Add to cart'),
         ('purchase', 'Purchase'),
-        # You can add more types like 'cart', 'like', etc.
+        ('wishlist', 'Add to wishlist'),
     )
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     interaction_type = models.CharField(max_length=50, choices=INTERACTION_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by the tracker when the event happens, not when its batch is written
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'product', 'timestamp'], name='interaction_user_product_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.interaction_type})"
@@ -40,7 +76,7 @@ class UserProductInteraction(models.Model):
 class Review(models.Model):
     product = models.ForeignKey('Product', related_name='reviews', on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name='reviews', on_delete=models.CASCADE)
-    rating = models.PositiveSmallIntegerField(default=5)  # you may restrict between 1-5
+    rating = models.PositiveSmallIntegerField(default=5, validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -53,4 +89,78 @@ class Wishlist(models.Model):
     products = models.ManyToManyField('Product', blank=True, related_name='wishlisted_by')
 
     def __str__(self):
-        return f"Wishlist of {self.user.username}"
\ No newline at end of file
+        return f"Wishlist of {self.user.username}"
+
+
+class Cart(models.Model):
+    # Anonymous carts have no user until they are merged in at login
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart', null=True, blank=True)
+    # Running sum of quantity * unit_price over the items, maintained by store/cart.py
+    total = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        owner = self.user.username if self.user_id else 'anonymous'
+        return f"Cart {self.pk} ({owner})"
+
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    # Price when the product was first added, so cart updates never read the catalog
+    unit_price = models.DecimalField(decimal_places=2, max_digits=10)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name}"
+
+
+class Order(models.Model):
+    PENDING = 'pending'
+    PAID = 'paid'
+    CANCELLED = 'cancelled'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = (
+        (PENDING, 'Awaiting payment'),
+        (PAID, 'Paid'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='orders', null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    total = models.DecimalField(decimal_places=2, max_digits=12)
+    created_at = models.DateTimeField(auto_now_add=True)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    # Stock for a pending order is held until then (see store/orders.py)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='order_status_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.pk} ({self.get_status_display()})"
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='order_lines')
+    # Copied from the cart so the order reads the same after catalog changes
+    product_name = models.CharField(max_length=200)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(decimal_places=2, max_digits=10)
+
+    @property
+    def total(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name}"
@@ -0,0 +1,177 @@
+"""
+Checkout: turning a cart into an Order without overselling.
+
+`place_order` reserves stock for every cart line with a conditional
+``UPDATE store_product SET stock = stock - qty WHERE id = ... AND stock >=
+qty`` and creates the order in the same transaction, so two shoppers racing
+for the last unit can never both get it and a failed line leaves nothing
+behind. Lines are charged the products' current prices: if a price moved
+since the item was added, the cart is repriced and PriceChanged raised
+instead, so the shopper sees the new total before ordering. The order
+then waits in PENDING for `confirm_order`, which only staff (or a
+payment integration) may call;
+orders not confirmed within ORDER_RESERVATION_TTL seconds are expired by
+`release_expired_orders` (``manage.py release_expired_orders``, run from
+cron), which puts their stock back.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from . import api_cache
+from .cart import get_cart_id, recalculate_total
+from .models import Cart, CartItem, Order, OrderLine, Product, UserProductInteraction
+
+# Seconds a pending order holds its stock
+DEFAULT_RESERVATION_TTL = 15 * 60
+
+
+class CheckoutError(Exception):
+    def __init__(self, products):
+        super().__init__(', '.join(product.name for product in products))
+        self.products = products
+
+
+class OutOfStock(CheckoutError):
+    pass
+
+
+class PriceChanged(CheckoutError):
+    pass
+
+
+def _reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'ORDER_RESERVATION_TTL', DEFAULT_RESERVATION_TTL))
+
+
+def _stock_changed(product_ids):
+    transaction.on_commit(lambda: api_cache.products_changed(product_ids))
+
+
+def place_order(request):
+    """
+    Reserve stock for the visitor's cart and turn it into a pending Order.
+    Returns the Order, or None if the cart is empty. Raises OutOfStock,
+    leaving the cart and stock untouched, if any line can't be filled, and
+    PriceChanged, after repricing the cart, if any product's price moved.
+    """
+    cart_id = get_cart_id(request)
+    if cart_id is None:
+        return None
+    now = timezone.now()
+    with transaction.atomic():
+        # Writing the cart first takes its row lock (and SQLite's write lock)
+        # before the lines are read, so a double-submitted checkout waits
+        # here and then finds the cart empty.
+        if not Cart.objects.filter(pk=cart_id).update(updated_at=now):
+            return None
+        items = list(
+            CartItem.objects.filter(cart_id=cart_id).select_related('product')
+            .only('product_id', 'quantity', 'unit_price', 'product__name', 'product__price')
+            .order_by('product_id')  # a fixed lock order, so concurrent checkouts can't deadlock
+        )
+        if not items:
+            return None
+
+        repriced = [item for item in items if item.unit_price != item.product.price]
+        if repriced:
+            for item in repriced:
+                CartItem.objects.filter(pk=item.pk).update(unit_price=item.product.price)
+            recalculate_total(cart_id)
+        else:
+            order = _create_order(request, cart_id, items, now)
+    if repriced:
+        # Outside the transaction, so that the repriced cart is kept
+        raise PriceChanged([item.product for item in repriced])
+    return order
+
+
+def _create_order(request, cart_id, items, now):
+    # Runs in place_order's transaction; OutOfStock rolls it all back
+    short = []
+    for item in items:
+        reserved = Product.objects.filter(pk=item.product_id, stock__gte=item.quantity).update(
+            stock=F('stock') - item.quantity, updated_at=Now()
+        )
+        if not reserved:
+            short.append(item.product)
+    if short:
+        raise OutOfStock(short)
+
+    order = Order.objects.create(
+        user=request.user if request.user.is_authenticated else None,
+        total=sum(item.product.price * item.quantity for item in items),
+        expires_at=now + _reservation_ttl(),
+    )
+    OrderLine.objects.bulk_create([
+        OrderLine(order=order, product_id=item.product_id, product_name=item.product.name,
+                  quantity=item.quantity, unit_price=item.product.price)
+        for item in items
+    ])
+    CartItem.objects.filter(cart_id=cart_id).delete()
+    Cart.objects.filter(pk=cart_id).update(total=0)
+    _stock_changed([item.product_id for item in items])
+    return order
+
+
+def confirm_order(order_id):
+    """
+    Mark a pending, unexpired order as paid and record its purchases.
+    Returns False if the order is no longer pending or its reservation
+    has run out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        paid = Order.objects.filter(pk=order_id, status=Order.PENDING, expires_at__gt=now).update(
+            status=Order.PAID, paid_at=now
+        )
+        if not paid:
+            return False
+        user_id = Order.objects.filter(pk=order_id).values_list('user_id', flat=True).get()
+        if user_id is not None:
+            UserProductInteraction.objects.bulk_create([
+                UserProductInteraction(user_id=user_id, product_id=product_id,
+                                       interaction_type='purchase', timestamp=now)
+                for product_id in OrderLine.objects.filter(order_id=order_id, product__isnull=False)
+                .values_list('product_id', flat=True)
+            ])
+    return True
+
+
+def _release(order_id, status):
+    # The status check makes sure stock is only ever given back once
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order_id, status=Order.PENDING).update(status=status):
+            return False
+        quantities = list(
+            OrderLine.objects.filter(order_id=order_id, product__isnull=False)
+            .values_list('product_id').annotate(quantity=Sum('quantity')).order_by('product_id')
+        )
+        for product_id, quantity in quantities:
+            Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity, updated_at=Now())
+        _stock_changed([product_id for product_id, _ in quantities])
+    return True
+
+
+def cancel_order(order_id):
+    """Cancel a pending order and return its stock. Returns False if it wasn't pending."""
+    return _release(order_id, Order.CANCELLED)
+
+
+def release_expired_orders(now=None, batch_size=500):
+    """Expire pending orders whose reservation has run out. Returns how many were released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        expired = list(
+            Order.objects.filter(status=Order.PENDING, expires_at__lte=now)
+            .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        for order_id in expired:
+            released += _release(order_id, Order.EXPIRED)
+        if len(expired) < batch_size:
+            return released
@@ -0,0 +1,44 @@
+"""
+Keyset (seek) pagination for storefront listings.
+
+Pages are addressed by the last id already shown (``?after=``) or the
+first id of the page after the one wanted (``?before=``) rather than a page
+number, so the database seeks straight to the page instead of counting
+past an OFFSET, and deep pages cost the same as the first.
+"""
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next and bool(object_list)
+        self.has_previous = has_previous and bool(object_list)
+
+    @property
+    def next_after(self):
+        return self.object_list[-1].id if self.has_next else None
+
+    @property
+    def previous_before(self):
+        return self.object_list[0].id if self.has_previous else None
+
+
+def parse_cursor(value):
+    """Return `value` as a positive id, or None if it is missing or malformed."""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def keyset_paginate(queryset, page_size, after=None, before=None):
+    """Return the KeysetPage of `queryset`, in ascending id order, after or before the given id."""
+    if before is not None:
+        rows = list(queryset.filter(id__lt=before).order_by('-id')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        return KeysetPage(rows[:page_size][::-1], has_next=True, has_previous=has_previous)
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    rows = list(queryset.order_by('id')[:page_size + 1])
+    return KeysetPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=after is not None)
@@ -0,0 +1,210 @@
+"""
+Trending products for anonymous visitors and cold-start recommendations.
+
+Interactions from the last WINDOW_DAYS are weighted like the recommender
+weights them and decayed with a half-life of HALF_LIFE_HOURS, so a view
+from this morning counts for more than a purchase from three weeks ago.
+One GROUP BY query over the window sums the weights per product, and the
+top LIMIT product ids are kept overall and per category. With no
+interactions in the window (a new or quiet site) the newest products
+stand in.
+
+The ranking is held in process memory for TTL seconds, and published to
+the CACHE cache so that other workers pick it up instead of recomputing
+it. While one request recomputes an expired ranking, the others keep
+serving the old one. Running ``manage.py refresh_popularity`` from cron
+more often than TTL keeps the recomputation out of requests altogether,
+but only when CACHE is shared between processes (Redis, Memcached, the
+database cache): with the default local-memory cache the command
+publishes into its own memory and the web workers never see it.
+Configure it with the POPULARITY setting.
+"""
+import heapq
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.db.models import Case, FloatField, Sum, Value, When
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, UserProductInteraction
+from .recommender import INTERACTION_WEIGHTS
+
+CACHE_KEY = 'popularity:ranking'
+# Ages are rounded to steps of this, so that SQL only compares timestamps
+DECAY_STEP = timedelta(hours=6)
+
+DEFAULTS = {
+    # Only interactions this recent count.
+    'WINDOW_DAYS': 30,
+    # An interaction's weight halves every HALF_LIFE_HOURS.
+    'HALF_LIFE_HOURS': 72,
+    # Product ids kept overall and per category.
+    'LIMIT': 100,
+    # Seconds a ranking is served before it is recomputed. 0 recomputes it
+    # on every lookup and skips the shared cache (used by the test runner).
+    'TTL': 300,
+    # Cache the ranking is shared through.
+    'CACHE': 'default',
+}
+
+
+def _options():
+    return {**DEFAULTS, **getattr(settings, 'POPULARITY', {})}
+
+
+class Popularity:
+    def __init__(self, ranked, computed_at):
+        # None -> overall ranking; category id -> that category's ranking.
+        # Each is a list of product ids, most popular first.
+        self.ranked = ranked
+        self.computed_at = computed_at
+
+    def top(self, n, category_id=None, exclude=()):
+        """Return up to `n` product ids, most popular first, skipping `exclude`."""
+        ranked = self.ranked.get(category_id, [])
+        if not exclude:
+            return ranked[:n]
+        exclude = set(exclude)
+        return [product_id for product_id in ranked if product_id not in exclude][:n]
+
+
+def _decay(now, window, half_life):
+    """CASE expression for an interaction's decay factor, its age rounded to the middle of a DECAY_STEP."""
+    whens, age = [], timedelta(0)
+    while age < window:
+        age += DECAY_STEP
+        middle = min(age, window) - DECAY_STEP / 2
+        whens.append(When(timestamp__gt=now - age, then=Value(0.5 ** (max(middle, timedelta(0)) / half_life))))
+    return Case(*whens, default=Value(0.0), output_field=FloatField())
+
+
+def compute_popularity(now=None, window_days=None, half_life_hours=None, limit=None):
+    """Rank products by their time-decayed, weighted interactions. Returns a Popularity."""
+    options = _options()
+    now = now or timezone.now()
+    window = timedelta(days=options['WINDOW_DAYS'] if window_days is None else window_days)
+    half_life = timedelta(hours=options['HALF_LIFE_HOURS'] if half_life_hours is None else half_life_hours)
+    limit = options['LIMIT'] if limit is None else limit
+
+    weight = Case(
+        *[When(interaction_type=kind, then=Value(value)) for kind, value in INTERACTION_WEIGHTS.items()],
+        default=Value(1.0), output_field=FloatField(),
+    )
+    rows = (
+        UserProductInteraction.objects
+        .filter(timestamp__gt=now - window, timestamp__lte=now)
+        .values_list('product_id', 'product__category_id')
+        .annotate(score=Sum(weight * _decay(now, window, half_life)))
+        .order_by()
+    )
+    scores, categories = {}, {}
+    for product_id, category_id, score in rows.iterator():
+        scores[product_id] = score
+        categories[product_id] = category_id
+
+    # Ties go to the newer product
+    def rank(product_ids):
+        return heapq.nlargest(limit, product_ids, key=lambda product_id: (scores[product_id], product_id))
+
+    by_category = {}
+    for product_id, category_id in categories.items():
+        by_category.setdefault(category_id, []).append(product_id)
+    ranked = {category_id: rank(product_ids) for category_id, product_ids in by_category.items()}
+    ranked[None] = rank(scores)
+    return Popularity(ranked, now)
+
+
+_current = None
+_expires = 0.0
+_refresh_lock = threading.Lock()
+
+
+def _serve(popularity, seconds):
+    global _current, _expires
+    _current, _expires = popularity, time.monotonic() + seconds
+
+
+def publish(popularity):
+    """Serve `popularity` from this process and share it with the other workers."""
+    options = _options()
+    if options['TTL']:
+        caches[options['CACHE']].set(CACHE_KEY, popularity, timeout=options['TTL'])
+    _serve(popularity, options['TTL'])
+
+
+def cache_is_shared():
+    """Whether a ranking published here reaches the other processes."""
+    return not isinstance(caches[_options()['CACHE']], (DummyCache, LocMemCache))
+
+
+def get_popularity():
+    """Return the current ranking, recomputing it if it is older than TTL."""
+    current = _current
+    if current is not None and time.monotonic() < _expires:
+        return current
+    # Only one thread refreshes; the others keep serving the stale ranking
+    if not _refresh_lock.acquire(blocking=current is None):
+        return current
+    try:
+        if _current is not current and time.monotonic() < _expires:
+            return _current  # Another thread refreshed it while we waited
+        options = _options()
+        if options['TTL']:
+            shared = caches[options['CACHE']].get(CACHE_KEY)
+            if shared is not None:
+                left = options['TTL'] - (timezone.now() - shared.computed_at).total_seconds()
+                if left > 0:
+                    _serve(shared, left)
+                    return shared
+        popularity = compute_popularity()
+        publish(popularity)
+        return popularity
+    finally:
+        _refresh_lock.release()
+
+
+def _newest(n, category_id=None, exclude=()):
+    products = Product.objects.exclude(id__in=exclude).order_by('-id')
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    return products[:n]
+
+
+def popular_products(n, category_id=None, exclude=()):
+    """
+    The `n` most popular products, overall or in one category, skipping the
+    ids in `exclude`. Only the Product fetch touches the database while the
+    ranking is fresh. Without any recent interactions to rank (a new or
+    quiet site) the newest products are returned instead.
+    """
+    ranked_ids = get_popularity().top(n, category_id, exclude)
+    if not ranked_ids:
+        return list(_newest(n, category_id, exclude))
+    products = Product.objects.in_bulk(ranked_ids)
+    return [products[product_id] for product_id in ranked_ids if product_id in products]
+
+
+async def apopular_products(n, category_id=None, exclude=()):
+    """Async `popular_products`. A stale ranking is recomputed in a worker thread."""
+    popularity, expires = _current, _expires
+    if popularity is None or time.monotonic() >= expires:
+        popularity = await sync_to_async(get_popularity)()
+    ranked_ids = popularity.top(n, category_id, exclude)
+    if not ranked_ids:
+        return [product async for product in _newest(n, category_id, exclude)]
+    products = await Product.objects.ain_bulk(ranked_ids)
+    return [products[product_id] for product_id in ranked_ids if product_id in products]
+
+
+@receiver(setting_changed)
+def reset_ranking(setting, **kwargs):
+    if setting == 'POPULARITY':
+        _serve(None, 0)
@@ -0,0 +1,62 @@
+"""
+Denormalized review aggregates on Product.
+
+Each Product carries rating_count, rating_sum, rating_average and a
+rating_N_count histogram so listings can show and sort by rating without
+aggregating reviews. They are adjusted in place with F() expressions when a
+review is written, edited or deleted, and `rebuild_ratings` recomputes them
+from scratch (``manage.py rebuild_ratings``). Forms and the admin can't
+edit them.
+"""
+from django.db.models import Count, F, FloatField, Q, Sum
+from django.db.models.functions import Cast, Greatest, Now
+from django.utils import timezone
+
+from . import api_cache
+from .models import Product, Review
+
+STARS = range(1, 6)
+
+
+def apply_rating(product_id, rating, delta=1):
+    """Add (delta=1) or remove (delta=-1) one `rating` from a product's aggregates."""
+    count = F('rating_count') + delta
+    total = F('rating_sum') + rating * delta
+    histogram = {f'rating_{rating}_count': F(f'rating_{rating}_count') + delta} if rating in STARS else {}
+    Product.objects.filter(pk=product_id).update(
+        rating_count=count,
+        rating_sum=total,
+        # The right-hand side sees the pre-update column values
+        rating_average=Cast(total, FloatField()) / Greatest(count, 1),
+        **histogram,
+        updated_at=Now(),
+    )
+
+
+def rebuild_ratings(batch_size=1000):
+    """Recompute every product's aggregates from its reviews. Returns the number of products that changed."""
+    fields = ['rating_count', 'rating_sum', 'rating_average'] + [f'rating_{stars}_count' for stars in STARS]
+    now = timezone.now()
+    aggregates = {
+        row['product_id']: row
+        for row in Review.objects.values('product_id').annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            **{f'rating_{stars}_count': Count('id', filter=Q(rating=stars)) for stars in STARS},
+        )
+    }
+    changed = []
+    for product in Product.objects.only('id', *fields).iterator(chunk_size=batch_size):
+        row = aggregates.get(product.id, {})
+        old = [getattr(product, field) for field in fields]
+        for field in fields:
+            setattr(product, field, row.get(field, 0))
+        product.rating_average = product.rating_sum / product.rating_count if product.rating_count else 0
+        if [getattr(product, field) for field in fields] != old:
+            product.updated_at = now
+            changed.append(product)
+    Product.objects.bulk_update(changed, fields + ['updated_at'], batch_size=batch_size)
+    if changed:
+        # bulk_update sends no post_save, so drop the cached API responses and fragments here
+        api_cache.products_changed([product.id for product in changed])
+    return len(changed)
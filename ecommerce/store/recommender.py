@@ -1,100 +1,698 @@
 # store/recommender.py
+import asyncio
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
 import numpy as np
-import pandas as pd
-from sklearn.neighbors import NearestNeighbors
+import scipy.sparse as sp
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db.models import Count, Max
+from django.dispatch import receiver
+from .instrumentation import timed
 from .models import UserProductInteraction, Product
 
-def get_user_item_matrix():
+# Bump whenever the layout of the pickled artifact changes so that workers
+# never try to serve a model written by an incompatible version.
+MODEL_FORMAT = 3
+
+# How much each kind of interaction counts towards a user-item cell.
+INTERACTION_WEIGHTS = {
+    'view': 1.0,
+    'cart': 2.0,
+    'purchase': 5.0,
+    # Interest, but weaker than putting it in the cart
+    'wishlist': 1.5,
+}
+
+# Number of similar products kept per product in the item-item index.
+ITEM_NEIGHBORS = 20
+
+# Users per matrix-times-matrix product in batch recommendations.
+BATCH_CHUNK_SIZE = 1024
+
+# Threads scoring recommendations for async views (RECOMMENDER_SCORING_WORKERS).
+DEFAULT_SCORING_WORKERS = 2
+
+# Per-worker cache of loaded artifacts: path -> (mtime, artifact).
+_loaded = {}
+
+
+class UserItemMatrix:
     """
-    Construct a user-item matrix where rows are users, columns are products,
-    and cell values represent the count of interactions.
+    Sparse (CSR) user-item matrix. Row i belongs to ``user_ids[i]`` and
+    column j to ``product_ids[j]``; both id arrays are sorted so ids map back
+    to rows/columns with a binary search instead of a per-id dict.
     """
-    interactions = UserProductInteraction.objects.all().values('user_id', 'product_id')
-    df = pd.DataFrame(list(interactions))
-    if df.empty:
+
+    def __init__(self, matrix, user_ids, product_ids):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.product_ids = product_ids
+
+    @classmethod
+    def from_pairs(cls, user_ids, product_ids, weights=None):
+        """Build the matrix from parallel arrays of interaction user/product ids."""
+        unique_users, rows = np.unique(user_ids, return_inverse=True)
+        unique_products, cols = np.unique(product_ids, return_inverse=True)
+        if weights is None:
+            weights = np.ones(len(rows), dtype=np.float32)
+        # Duplicate (user, product) pairs are summed into a single cell.
+        matrix = sp.csr_matrix(
+            (weights, (rows, cols)), shape=(len(unique_users), len(unique_products)), dtype=np.float32
+        )
+        matrix.sum_duplicates()
+        return cls(matrix, unique_users, unique_products)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def merge(self, delta):
+        """
+        Return ``(merged, old_rows, delta_rows)``: a new matrix with the cells
+        of `delta` added to this one, and where this matrix's rows and
+        `delta`'s rows ended up in it. New users and products are slotted
+        into the sorted id arrays.
+        """
+        user_ids = np.union1d(self.user_ids, delta.user_ids)
+        product_ids = np.union1d(self.product_ids, delta.product_ids)
+
+        def remap(source):
+            rows = np.searchsorted(user_ids, source.user_ids)
+            cols = np.searchsorted(product_ids, source.product_ids)
+            coo = source.matrix.tocoo()
+            matrix = sp.csr_matrix(
+                (coo.data, (rows[coo.row], cols[coo.col])), shape=(len(user_ids), len(product_ids))
+            )
+            return matrix, rows
+
+        if len(user_ids) == len(self.user_ids) and len(product_ids) == len(self.product_ids):
+            matrix, old_rows = self.matrix, np.arange(len(user_ids))
+        else:
+            matrix, old_rows = remap(self)
+        delta_matrix, delta_rows = remap(delta)
+        return UserItemMatrix((matrix + delta_matrix).tocsr(), user_ids, product_ids), old_rows, delta_rows
+
+    def row_for_user(self, user_id):
+        """Return the row index of `user_id`, or None if the user has no interactions."""
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return row
         return None
-    # Create a pivot table: rows are user_ids, columns are product_ids
-    user_item_matrix = df.groupby(['user_id', 'product_id']).size().unstack(fill_value=0)
-    return user_item_matrix
 
-def train_recommendation_model(user_item_matrix):
+
+def _top_k(keys, scores, k):
     """
-    Train a NearestNeighbors model on the user-item matrix.
+    Return ``(scores, keys)`` for the `k` highest scores, best first, with
+    ties broken on key so results are deterministic.
     """
-    model = NearestNeighbors(metric='cosine', algorithm='brute')
-    model.fit(user_item_matrix.values)
-    return model
+    if len(keys) > k:
+        # Keep everything tied with the k-th score, so the key decides among them
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        top = scores >= kth
+        keys, scores = keys[top], scores[top]
+    order = np.lexsort((keys, -scores))[:k]
+    return scores[order], keys[order]
 
-# store/recommender.py
-import numpy as np
-import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-from .models import UserProductInteraction, Product
 
-def get_user_item_matrix():
+class CosineNeighbors:
     """
-    Construct a user-item matrix where rows are users, columns are products,
-    and cell values represent the count of interactions.
+    Brute-force cosine nearest neighbours over the rows of a sparse matrix.
+    Only sparse dot products of the query rows are computed, so the matrix
+    is never densified.
     """
-    interactions = UserProductInteraction.objects.all().values('user_id', 'product_id')
-    df = pd.DataFrame(list(interactions))
-    if df.empty:
+
+    def fit(self, matrix):
+        self.matrix = matrix
+        self.norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        return self
+
+    def update(self, matrix, old_rows, changed_rows):
+        """
+        Move the model onto `matrix` (see `UserItemMatrix.merge`), recomputing
+        norms only for `changed_rows`.
+        """
+        norms = np.zeros(matrix.shape[0], dtype=self.norms.dtype)
+        norms[old_rows] = self.norms
+        changed = matrix[changed_rows]
+        norms[changed_rows] = np.sqrt(np.asarray(changed.multiply(changed).sum(axis=1)).ravel())
+        self.matrix, self.norms = matrix, norms
+        return self
+
+    def _neighbors_from_dots(self, row, rows, dots, n_neighbors):
+        similarities = dots / (self.norms[rows] * self.norms[row])
+        keep = (rows != row) & (similarities > 0)
+        return _top_k(rows[keep], similarities[keep], n_neighbors)
+
+    def kneighbors(self, row, n_neighbors):
+        """
+        Return ``(similarities, rows)`` for the `n_neighbors` rows most similar
+        to `row`, best first. The row itself and rows sharing no items with it
+        are never returned.
+        """
+        dots = (self.matrix @ self.matrix[row].T).tocoo()
+        return self._neighbors_from_dots(row, dots.row, dots.data, n_neighbors)
+
+    def kneighbors_batch(self, rows, n_neighbors, chunk_size=1024):
+        """
+        Neighbours for many rows at once, computed one matrix-times-matrix
+        product per chunk. Returns ``(similarities, neighbours)`` arrays of
+        shape ``(len(rows), n_neighbors)``; rows with fewer neighbours are
+        padded with similarity 0 and neighbour -1.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        similarities = np.zeros((len(rows), n_neighbors), dtype=np.float32)
+        neighbors = np.full((len(rows), n_neighbors), -1, dtype=np.int64)
+        transposed = self.matrix.T.tocsc()
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            dots = (self.matrix[chunk] @ transposed).tocsr()
+            for offset, row in enumerate(chunk):
+                span = slice(dots.indptr[offset], dots.indptr[offset + 1])
+                found_similarities, found = self._neighbors_from_dots(
+                    row, dots.indices[span], dots.data[span], n_neighbors
+                )
+                similarities[start + offset, :len(found)] = found_similarities
+                neighbors[start + offset, :len(found)] = found
+        return similarities, neighbors
+
+
+def get_user_item_matrix(interactions=None):
+    """
+    Construct a sparse user-item matrix where rows are users, columns are
+    products, and cell values are interaction counts weighted by
+    INTERACTION_WEIGHTS. Built from all interactions unless a queryset of
+    `interactions` is given.
+    """
+    if interactions is None:
+        interactions = UserProductInteraction.objects.all()
+    rows = interactions.values_list('user_id', 'product_id', 'interaction_type')
+    flat = np.fromiter(
+        (
+            value
+            for user_id, product_id, interaction_type in rows.iterator(chunk_size=10000)
+            for value in (user_id, product_id, INTERACTION_WEIGHTS.get(interaction_type, 1.0))
+        ),
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    if not len(flat):
         return None
-    # Create a pivot table: rows are user_ids, columns are product_ids
-    user_item_matrix = df.groupby(['user_id', 'product_id']).size().unstack(fill_value=0)
-    return user_item_matrix
+    return UserItemMatrix.from_pairs(
+        flat[:, 0].astype(np.int64), flat[:, 1].astype(np.int64), flat[:, 2].astype(np.float32)
+    )
 
 def train_recommendation_model(user_item_matrix):
     """
-    Train a NearestNeighbors model on the user-item matrix.
+    Fit the cosine neighbour model on the user-item matrix.
     """
-    model = NearestNeighbors(metric='cosine', algorithm='brute')
-    model.fit(user_item_matrix.values)
-    return model
+    return CosineNeighbors().fit(user_item_matrix.matrix)
+
+
+# Offline training / persistence
 
-def get_user_recommendations(user_id, n_recommendations=5):
+def get_model_path():
+    return Path(settings.RECOMMENDER_MODEL_DIR) / 'user_model.pkl'
+
+def build_model():
     """
-    Recommend products for a given user using a collaborative filtering approach.
+    Build the user-item matrix and fit the neighbour model from scratch.
+
+    Returns the artifact dict that `save_model` persists, or None when there
+    are no interactions to learn from yet.
     """
-    user_item_matrix = get_user_item_matrix()
-    if user_item_matrix is None or user_item_matrix.empty:
-        return Product.objects.none()  # Return empty if no interactions exist
+    last_interaction_id = UserProductInteraction.objects.aggregate(last=Max('id'))['last']
+    if last_interaction_id is None:
+        return None
+    user_item_matrix = get_user_item_matrix(
+        UserProductInteraction.objects.filter(id__lte=last_interaction_id)
+    )
+    return {
+        'format': MODEL_FORMAT,
+        'version': time.strftime('%Y%m%d%H%M%S'),
+        'last_interaction_id': last_interaction_id,
+        'matrix': user_item_matrix,
+        'model': train_recommendation_model(user_item_matrix),
+    }
 
-    # Ensure user_id is in the index
-    if user_id not in user_item_matrix.index:
-        return Product.objects.order_by('-id')[:n_recommendations]  # Fallback to latest products
+def update_model(artifact):
+    """
+    Fold interactions created since the artifact's high-water mark into its
+    matrix and user norms in place, without re-reading older interactions.
 
-    model = train_recommendation_model(user_item_matrix)
-    
+    Returns the number of interactions applied. Interactions that are
+    deleted are only dropped by a full `build_model`, so run one
+    periodically to correct drift.
+    """
+    new_interactions = UserProductInteraction.objects.filter(id__gt=artifact['last_interaction_id'])
+    pending = new_interactions.aggregate(last=Max('id'), count=Count('id'))
+    if not pending['count']:
+        return 0
+    delta = get_user_item_matrix(new_interactions.filter(id__lte=pending['last']))
+    merged, old_rows, delta_rows = artifact['matrix'].merge(delta)
+    artifact['model'].update(merged.matrix, old_rows, delta_rows)
+    artifact['matrix'] = merged
+    artifact['last_interaction_id'] = pending['last']
+    artifact['version'] = time.strftime('%Y%m%d%H%M%S')
+    return pending['count']
+
+def _atomic_write(path, write):
+    """
+    Write `path` through a temporary file and rename it into place, so that
+    serving workers never read a half-written artifact.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
     try:
-        user_index = list(user_item_matrix.index).index(user_id)
-    except ValueError:
-        return Product.objects.order_by('-id')[:n_recommendations]  # Fallback
+        with os.fdopen(fd, 'wb') as fh:
+            write(fh)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+def _load_cached(path, read):
+    """
+    Return ``read(path)``, calling it only when the file changed since this
+    worker last loaded it. Returns None if the file does not exist.
+    """
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _loaded.get(str(path))
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as fh:
+            cached = (mtime, read(fh))
+        _loaded[str(path)] = cached
+    return cached[1]
+
+def save_model(artifact, path=None):
+    """
+    Atomically write a trained artifact.
+    """
+    return _atomic_write(
+        path or get_model_path(),
+        lambda fh: pickle.dump(artifact, fh, protocol=pickle.HIGHEST_PROTOCOL),
+    )
+
+def _read_model(fh):
+    artifact = pickle.load(fh)
+    return artifact if artifact.get('format') == MODEL_FORMAT else None
+
+def load_model():
+    """
+    Return the trained artifact, or None if no usable model has been
+    trained yet. The file is only re-read after it changes.
+    """
+    return _load_cached(get_model_path(), _read_model)
+
+
+# Item-item similarity
 
-    # Ensure `n_neighbors` does not exceed available users
-    available_users = len(user_item_matrix)
-    n_neighbors = min(n_recommendations + 1, available_users)
+class ItemSimilarityIndex:
+    """
+    The `k` most similar products for every product, stored as two dense
+    ``(n_products, k)`` arrays of neighbour ids and scores (padded with -1
+    and 0). `last_interaction_id` is the newest interaction folded in, so the
+    next rebuild only has to revisit products touched after it.
+    """
+
+    def __init__(self, product_ids, neighbors, scores, last_interaction_id):
+        self.product_ids = product_ids
+        self.neighbors = neighbors
+        self.scores = scores
+        self.last_interaction_id = last_interaction_id
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    def row_for_product(self, product_id):
+        row = int(np.searchsorted(self.product_ids, product_id))
+        if row < len(self.product_ids) and self.product_ids[row] == product_id:
+            return row
+        return None
+
+    def similar_to(self, product_id, n):
+        """Ids of the (at most `n`) products most similar to `product_id`, best first."""
+        row = self.row_for_product(product_id)
+        if row is None:
+            return []
+        neighbors = self.neighbors[row, :n]
+        return neighbors[neighbors >= 0].tolist()
+
+    def save(self, path=None):
+        return _atomic_write(path or get_item_index_path(), lambda fh: np.savez(
+            fh,
+            product_ids=self.product_ids,
+            neighbors=self.neighbors,
+            scores=self.scores,
+            last_interaction_id=self.last_interaction_id,
+        ))
+
+    @classmethod
+    def read(cls, fh):
+        with np.load(fh) as data:
+            return cls(
+                data['product_ids'], data['neighbors'], data['scores'], int(data['last_interaction_id'])
+            )
+
+
+def get_item_index_path():
+    return Path(settings.RECOMMENDER_MODEL_DIR) / 'item_similarity.npz'
+
+def load_item_index():
+    return _load_cached(get_item_index_path(), ItemSimilarityIndex.read)
+
+def build_item_index(previous=None, k=ITEM_NEIGHBORS):
+    """
+    Build the item-item similarity index from all interactions.
+
+    When `previous` is given, only products whose similarities can have
+    changed since it was built are recomputed: products with new
+    interactions, plus every product sharing a user with one of them. All
+    other rows are copied across. Returns None if there are no interactions.
+    """
+    last_interaction_id = UserProductInteraction.objects.aggregate(last=Max('id'))['last']
+    user_item_matrix = get_user_item_matrix()
+    if user_item_matrix is None:
+        return None
+    item_users = user_item_matrix.matrix.T.tocsr()
+    product_ids = user_item_matrix.product_ids
+
+    if previous is None or previous.k != k or not len(previous.product_ids):
+        rows = np.arange(len(product_ids))
+        neighbors = np.full((len(product_ids), k), -1, dtype=np.int64)
+        scores = np.zeros((len(product_ids), k), dtype=np.float32)
+    else:
+        touched = UserProductInteraction.objects.filter(
+            id__gt=previous.last_interaction_id
+        ).values_list('product_id', flat=True).distinct()
+        touched_ids = np.intersect1d(np.fromiter(touched, dtype=np.int64), product_ids)
+        touched_rows = np.searchsorted(product_ids, touched_ids)
+        touched_users = np.unique(item_users[touched_rows].indices)
+        affected = np.union1d(touched_rows, user_item_matrix.matrix[touched_users].indices)
+        # Rows for products already in the previous index start from their old values
+        old_rows = np.searchsorted(previous.product_ids, product_ids).clip(max=len(previous.product_ids) - 1)
+        known = previous.product_ids[old_rows] == product_ids
+        neighbors = np.where(known[:, None], previous.neighbors[old_rows], -1)
+        scores = np.where(known[:, None], previous.scores[old_rows], 0).astype(np.float32)
+        rows = np.union1d(affected, np.flatnonzero(~known))
+
+    if len(rows):
+        new_scores, new_neighbors = CosineNeighbors().fit(item_users).kneighbors_batch(rows, k)
+        neighbors[rows] = np.where(new_neighbors >= 0, product_ids[new_neighbors], -1)
+        scores[rows] = new_scores
+    return ItemSimilarityIndex(product_ids, neighbors, scores, last_interaction_id)
+
+def _similar_ids(product_id, n):
+    index = load_item_index()
+    return index.similar_to(product_id, n) if index is not None else []
+
+
+@timed('recommender')
+def get_similar_products(product_id, n=4):
+    """
+    "Customers also viewed": products most similar to `product_id`, best
+    first, looked up from the precomputed item-item index.
+    """
+    ranked_ids = _similar_ids(product_id, n)
+    if not ranked_ids:
+        return []
+    products = Product.objects.in_bulk(ranked_ids)
+    return [products[similar_id] for similar_id in ranked_ids if similar_id in products]
+
+
+@timed('recommender')
+async def aget_similar_products(product_id, n=4):
+    """Async `get_similar_products`; the index lookup runs on the scoring executor."""
+    ranked_ids = await _score(_similar_ids, product_id, n)
+    if not ranked_ids:
+        return []
+    products = await Product.objects.ain_bulk(ranked_ids)
+    return [products[similar_id] for similar_id in ranked_ids if similar_id in products]
+
+
+# Imported in the functions below because store/popularity.py imports
+# INTERACTION_WEIGHTS from this module
+
+def _popular(n, exclude=()):
+    from .popularity import popular_products
+    return popular_products(n, exclude=exclude)
+
+
+async def _apopular(n, exclude=()):
+    from .popularity import apopular_products
+    return await apopular_products(n, exclude=exclude)
+
+
+def _rank_for_user(artifact, user_id, n_recommendations, n_neighbors):
+    """
+    The CPU-bound part of a recommendation, with no database access. Returns
+    ``(product_ids, seen_ids)``; `product_ids` is None if the model has
+    nothing to offer and trending products not in `seen_ids` should be
+    served instead.
+    """
+    user_item_matrix = artifact['matrix']
+    model = artifact['model']
+
+    user_index = user_item_matrix.row_for_user(user_id)
+    if user_index is None:
+        return None, []  # Not in the model yet
+
+    matrix = user_item_matrix.matrix
+    # Columns of the products the user already interacted with
+    seen = matrix[user_index].indices
 
     # Get nearest neighbors
-    distances, indices = model.kneighbors([user_item_matrix.iloc[user_index].values], n_neighbors=n_neighbors)
-    similar_user_indices = indices.flatten()[1:]  # Exclude the first (current user)
+    similarities, similar_user_indices = model.kneighbors(user_index, n_neighbors=n_neighbors)
 
     if not len(similar_user_indices):
-        return Product.objects.order_by('-id')[:n_recommendations]  # Return popular products if no similar users
+        # No similar users
+        return None, user_item_matrix.product_ids[seen].tolist()
+
+    # score[p] = sum over neighbours of similarity * weighted interactions with p
+    scores = (sp.csr_matrix(similarities) @ matrix[similar_user_indices]).tocoo()
+    columns, scores = scores.col, scores.data
+    # Mask out products the user already interacted with
+    keep = ~np.isin(columns, seen, assume_unique=True)
+    columns, scores = columns[keep], scores[keep]
+
+    if not len(columns):
+        # The neighbours have nothing the user hasn't seen
+        return None, user_item_matrix.product_ids[seen].tolist()
+
+    scores, columns = _top_k(columns, scores, n_recommendations)
+    return user_item_matrix.product_ids[columns].tolist(), []
+
+
+@timed('recommender')
+def get_user_recommendations(user_id, n_recommendations=5, n_neighbors=20):
+    """
+    Recommend products for a given user using a collaborative filtering approach.
+
+    Only the neighbour query runs here; the model itself is trained offline
+    by the `train_recommender` management command. Each candidate product is
+    scored by the similarity-weighted interactions of the user's neighbours,
+    and the top `n_recommendations` are returned best first. Users the model
+    can't help (new ones, those without useful neighbours, or everyone until
+    a model has been trained) get trending products instead; see
+    store/popularity.py.
+    """
+    artifact = load_model()
+    if artifact is None:
+        return _popular(n_recommendations)
+
+    ranked_ids, seen_ids = _rank_for_user(artifact, user_id, n_recommendations, n_neighbors)
+    if ranked_ids is None:
+        return _popular(n_recommendations, exclude=seen_ids)
+    products = Product.objects.in_bulk(ranked_ids)
+    return [products[product_id] for product_id in ranked_ids if product_id in products]
 
-    similar_user_ids = user_item_matrix.index[similar_user_indices]
 
-    # Get products interacted with by similar users but not by the given user
-    user_product_ids = set(UserProductInteraction.objects.filter(user_id=user_id)
-                                                   .values_list('product_id', flat=True))
+def _load_and_rank(user_id, n_recommendations, n_neighbors):
+    artifact = load_model()
+    if artifact is None:
+        return None
+    return _rank_for_user(artifact, user_id, n_recommendations, n_neighbors)
+
+
+@timed('recommender')
+async def aget_user_recommendations(user_id, n_recommendations=5, n_neighbors=20):
+    """
+    Async `get_user_recommendations` for ASGI views: the neighbour search and
+    scoring run on the bounded scoring executor instead of the event loop,
+    and products are fetched with the async ORM.
+    """
+    ranked = await _score(_load_and_rank, user_id, n_recommendations, n_neighbors)
+    if ranked is None:
+        return await _apopular(n_recommendations)
+    ranked_ids, seen_ids = ranked
+    if ranked_ids is None:
+        return await _apopular(n_recommendations, exclude=seen_ids)
+    products = await Product.objects.ain_bulk(ranked_ids)
+    return [products[product_id] for product_id in ranked_ids if product_id in products]
+
+
+_scoring_executor = None
+_scoring_executor_lock = threading.Lock()
+
+
+def _get_scoring_executor():
+    global _scoring_executor
+    with _scoring_executor_lock:
+        if _scoring_executor is None:
+            _scoring_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'RECOMMENDER_SCORING_WORKERS', DEFAULT_SCORING_WORKERS),
+                thread_name_prefix='recommender-scoring',
+            )
+        return _scoring_executor
+
+
+async def _score(fn, *args):
+    # numpy and scipy release the GIL in their kernels, so a few threads keep
+    # the event loop free without letting a burst of requests start more
+    # scoring work than there are cores
+    return await asyncio.get_running_loop().run_in_executor(_get_scoring_executor(), partial(fn, *args))
+
+
+@receiver(setting_changed)
+def reset_scoring_executor(setting, **kwargs):
+    global _scoring_executor
+    if setting == 'RECOMMENDER_SCORING_WORKERS' and _scoring_executor is not None:
+        _scoring_executor.shutdown(wait=True)
+        _scoring_executor = None
+
+
+def _recommend_rows(artifact, user_ids, n_recommendations, n_neighbors):
+    """
+    Model recommendations for a chunk of users: a list of ``(user_id,
+    product_ids, seen_ids)``, where `product_ids` is None if the model has
+    nothing to offer and the user should get trending products instead
+    (skipping `seen_ids`, as `get_user_recommendations` does).
+    """
+    user_item_matrix, model = artifact['matrix'], artifact['model']
+    matrix, product_ids = user_item_matrix.matrix, user_item_matrix.product_ids
+    rows = [user_item_matrix.row_for_user(user_id) for user_id in user_ids]
+    known = [offset for offset, row in enumerate(rows) if row is not None]
+    results = [(user_id, None, []) for user_id in user_ids]
+    if not known:
+        return results
 
-    recommended_product_ids = set(UserProductInteraction.objects.filter(user_id__in=similar_user_ids)
-                                                          .exclude(product_id__in=user_product_ids)
-                                                          .values_list('product_id', flat=True))
+    known_rows = np.array([rows[offset] for offset in known], dtype=np.int64)
+    similarities, neighbors = model.kneighbors_batch(known_rows, n_neighbors, chunk_size=len(known_rows))
+    # One (users x users) @ (users x products) product scores the whole chunk;
+    # neighbours stay in rank order within each row, as in the single-user path
+    found = neighbors >= 0
+    weights = sp.csr_matrix(
+        (similarities[found], neighbors[found], np.concatenate([[0], np.cumsum(found.sum(axis=1))])),
+        shape=(len(known_rows), matrix.shape[0]),
+    )
+    scores = (weights @ matrix).tocsr()
 
-    if not recommended_product_ids:
-        return Product.objects.order_by('-id')[:n_recommendations]  # Return popular products as fallback
+    for position, offset in enumerate(known):
+        seen = matrix[known_rows[position]].indices
+        seen_ids = product_ids[seen].tolist()
+        span = slice(scores.indptr[position], scores.indptr[position + 1])
+        columns, row_scores = scores.indices[span], scores.data[span]
+        keep = ~np.isin(columns, seen, assume_unique=True)
+        columns, row_scores = columns[keep], row_scores[keep]
+        if not len(columns):
+            results[offset] = (user_ids[offset], None, seen_ids)
+            continue
+        _, columns = _top_k(columns, row_scores, n_recommendations)
+        results[offset] = (user_ids[offset], product_ids[columns].tolist(), seen_ids)
+    return results
 
-    recommended_products = Product.objects.filter(id__in=recommended_product_ids)[:n_recommendations]
 
-    return recommended_products
+# The artifact used by batch worker processes; see `recommend_batch`
+_worker_artifact = None
+
+
+def _init_batch_worker():
+    global _worker_artifact
+    _worker_artifact = load_model()
+
+
+def _recommend_rows_in_worker(user_ids, n_recommendations, n_neighbors):
+    return _recommend_rows(_worker_artifact, user_ids, n_recommendations, n_neighbors)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _map_bounded(pool, fn, iterable, in_flight):
+    # Like pool.map, but only `in_flight` chunks are queued ahead of the
+    # consumer, so memory stays flat however many users there are
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def active_user_ids():
+    return User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True).iterator(chunk_size=10000)
+
+
+def recommend_batch(user_ids, n_recommendations=5, n_neighbors=20, chunk_size=BATCH_CHUNK_SIZE, workers=1):
+    """
+    Yield ``(user_id, product_ids)`` for every id in `user_ids`, in order,
+    with the same products `get_user_recommendations` would return for each.
+    Neighbours are searched `chunk_size` users at a time; with `workers` > 1
+    the chunks are spread over a pool of processes, each loading the model
+    once. `user_ids` may be any iterable, e.g. `active_user_ids()`.
+    """
+    from .popularity import get_popularity
+
+    artifact = load_model()
+    if artifact is None:
+        # Everyone gets trending products until a model has been trained
+        trending = [product.id for product in _popular(n_recommendations)]
+        for user_id in user_ids:
+            yield user_id, trending
+        return
+
+    chunks = _chunks(user_ids, chunk_size)
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker)
+        results = _map_bounded(
+            pool, partial(_recommend_rows_in_worker, n_recommendations=n_recommendations, n_neighbors=n_neighbors),
+            chunks, workers * 2,
+        )
+    else:
+        results = (_recommend_rows(artifact, chunk, n_recommendations, n_neighbors) for chunk in chunks)
+    try:
+        popularity = get_popularity()
+        for rows in results:
+            rows = [
+                (user_id, product_ids if product_ids is not None else popularity.top(n_recommendations, exclude=seen))
+                for user_id, product_ids, seen in rows
+            ]
+            # Drop products deleted since the model was trained, like the single-user in_bulk does
+            existing = set(Product.objects.filter(
+                id__in={product_id for _, product_ids in rows for product_id in product_ids}
+            ).values_list('id', flat=True))
+            for user_id, product_ids in rows:
+                yield user_id, [product_id for product_id in product_ids if product_id in existing]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
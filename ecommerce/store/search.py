@@ -0,0 +1,299 @@
+"""
+Customer-facing product search.
+
+On SQLite, product names and descriptions are indexed in an FTS5 table
+(store_product_fts) kept in sync by triggers on store_product, so every
+write path, bulk imports included, is covered without signals. Queries are
+ranked by BM25 with name matches weighted above description matches, the
+last word of a query matches as a prefix (the index stores 2 and 3
+character prefixes, so that stays an index lookup), and each search
+returns category and price-range facet counts for the matched products.
+
+Other database backends fall back to an icontains scan with the same
+interface and results in id order.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import Count, Q
+
+from .models import Category, Product
+
+FTS_TABLE = 'store_product_fts'
+# BM25 column weights: a hit in the name counts ten times one in the description
+NAME_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 1.0
+MAX_QUERY_TERMS = 8
+
+# (label, min, max) with min inclusive and max exclusive
+PRICE_RANGES = [
+    ('Under 25', None, Decimal(25)),
+    ('25 to 50', Decimal(25), Decimal(50)),
+    ('50 to 100', Decimal(50), Decimal(100)),
+    ('100 to 250', Decimal(100), Decimal(250)),
+    ('250 and above', Decimal(250), None),
+]
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='store_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF name, description ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+TRIGGERS = [f'{FTS_TABLE}_insert', f'{FTS_TABLE}_delete', f'{FTS_TABLE}_update']
+
+
+def ensure_index(conn=connection):
+    """
+    Create the FTS index and its triggers if any of them are missing, then
+    rebuild the index from store_product. Needed after migrations that make
+    SQLite rebuild store_product, since that drops the table's triggers.
+    Returns True if anything had to be created.
+    """
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)" % ', '.join(['%s'] * (len(TRIGGERS) + 1)),
+            [FTS_TABLE, *TRIGGERS],
+        )
+        if len(cursor.fetchall()) == len(TRIGGERS) + 1:
+            return False
+        for sql in CREATE_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def drop_index(conn=connection):
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for trigger in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def query_terms(query):
+    """Split a user's query into at most MAX_QUERY_TERMS lowercase words."""
+    return re.findall(r'\w+', query.lower())[:MAX_QUERY_TERMS]
+
+
+def match_expression(terms, column=None):
+    """
+    Build an FTS5 MATCH expression requiring every term, the last one as a
+    prefix. Terms are quoted, so FTS5 operators typed by users are plain text.
+    """
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += '*'
+    expression = ' AND '.join(phrases)
+    return f'{column} : ({expression})' if column else expression
+
+
+class SearchResult:
+    def __init__(self, products, total, categories, prices):
+        self.products = products  # Products on the requested page, best match first
+        self.total = total
+        # [{'id', 'name', 'count'}, ...], ignoring the category filter
+        self.categories = categories
+        # [{'label', 'min', 'max', 'count'}, ...], ignoring the price filter
+        self.prices = prices
+
+
+def parse_filters(params):
+    """
+    Read ``category`` (repeatable), ``min_price`` and ``max_price`` from a
+    QueryDict into `search_products` keyword arguments. Malformed values are
+    ignored.
+    """
+    category_ids = sorted({int(value) for value in params.getlist('category') if value.isdigit()})
+    filters = {'category_ids': category_ids or None}
+    for key in ('min_price', 'max_price'):
+        try:
+            value = Decimal(params.get(key, ''))
+        except InvalidOperation:
+            value = None
+        filters[key] = value if value is not None and value.is_finite() and value >= 0 else None
+    return filters
+
+
+def _price_sql(column, min_price, max_price):
+    clauses, params = [], []
+    if min_price is not None:
+        clauses.append(f'{column} >= %s')
+        params.append(str(min_price))
+    if max_price is not None:
+        clauses.append(f'{column} <= %s')
+        params.append(str(max_price))
+    return clauses, params
+
+
+def _category_sql(column, category_ids):
+    if not category_ids:
+        return [], []
+    return [f'{column} IN ({", ".join(["%s"] * len(category_ids))})'], list(category_ids)
+
+
+def _bucket_sql(column):
+    cases, params = [], []
+    for index, (_, low, high) in enumerate(PRICE_RANGES):
+        clauses, bounds = [], []
+        if low is not None:
+            clauses.append(f'{column} >= %s')
+            bounds.append(str(low))
+        if high is not None:
+            clauses.append(f'{column} < %s')
+            bounds.append(str(high))
+        cases.append(f'WHEN {" AND ".join(clauses)} THEN {index}')
+        params.extend(bounds)
+    return f'CASE {" ".join(cases)} END', params
+
+
+def _facets(category_counts, bucket_counts):
+    names = dict(Category.objects.filter(id__in=category_counts).values_list('id', 'name'))
+    categories = sorted(
+        ({'id': category_id, 'name': names.get(category_id, ''), 'count': count}
+         for category_id, count in category_counts.items()),
+        key=lambda facet: (-facet['count'], facet['name']),
+    )
+    prices = [
+        {'label': label, 'min': low, 'max': high, 'count': bucket_counts.get(index, 0)}
+        for index, (label, low, high) in enumerate(PRICE_RANGES)
+    ]
+    return categories, prices
+
+
+def _ordered_products(ids):
+    products = Product.objects.select_related('category').in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def search_products(query, category_ids=None, min_price=None, max_price=None, limit=20, offset=0):
+    """
+    Search the catalog. `category_ids` keeps products in any of the given
+    categories; price bounds are inclusive. Returns a SearchResult.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return SearchResult([], 0, [], _facets({}, {})[1])
+    if not fts_available():
+        return _search_fallback(terms, category_ids, min_price, max_price, limit, offset)
+
+    match = match_expression(terms)
+    category_clauses, category_params = _category_sql('p.category_id', category_ids)
+    price_clauses, price_params = _price_sql('p.price', min_price, max_price)
+    bucket, bucket_params = _bucket_sql('p.price')
+    where = f'AND {" AND ".join(category_clauses + price_clauses)} ' if category_clauses or price_clauses else ''
+    in_price = f'({" AND ".join(price_clauses)})' if price_clauses else '1'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT p.id FROM {FTS_TABLE} f JOIN store_product p ON p.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s {where}'
+            f'ORDER BY bm25({FTS_TABLE}, %s, %s), p.id LIMIT %s OFFSET %s',
+            [match, *category_params, *price_params, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        # Both facets come from one unranked pass over the matches, grouped
+        # finely enough to apply every filter except the facet's own: picking
+        # a category still shows how many matches the other categories have.
+        cursor.execute(
+            f'SELECT p.category_id, {bucket}, {in_price}, COUNT(*) '
+            f'FROM {FTS_TABLE} f JOIN store_product p ON p.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s GROUP BY 1, 2, 3',
+            [*bucket_params, *price_params, match],
+        )
+        groups = cursor.fetchall()
+
+    selected = set(category_ids or ())
+    category_counts, bucket_counts = {}, {}
+    for category_id, bucket_index, price_matches, count in groups:
+        if price_matches:
+            category_counts[category_id] = category_counts.get(category_id, 0) + count
+        if not selected or category_id in selected:
+            bucket_counts[bucket_index] = bucket_counts.get(bucket_index, 0) + count
+    return SearchResult(
+        _ordered_products(ids), _total(category_counts, category_ids), *_facets(category_counts, bucket_counts)
+    )
+
+
+def _total(category_counts, category_ids):
+    # The category facet has every other filter applied, so it adds up to the total
+    if not category_ids:
+        return sum(category_counts.values())
+    return sum(category_counts.get(category_id, 0) for category_id in set(category_ids))
+
+
+def _search_fallback(terms, category_ids, min_price, max_price, limit, offset):
+    matched = Product.objects.all()
+    for term in terms:
+        matched = matched.filter(Q(name__icontains=term) | Q(description__icontains=term))
+    in_categories = Q(category_id__in=category_ids) if category_ids else Q()
+    in_price = Q()
+    if min_price is not None:
+        in_price &= Q(price__gte=min_price)
+    if max_price is not None:
+        in_price &= Q(price__lte=max_price)
+
+    results = matched.filter(in_categories, in_price).order_by('id')
+    ids = list(results.values_list('id', flat=True)[offset:offset + limit])
+    category_counts = dict(
+        matched.filter(in_price).order_by().values_list('category_id').annotate(count=Count('id'))
+    )
+    buckets = {}
+    for index, (_, low, high) in enumerate(PRICE_RANGES):
+        bounds = Q()
+        if low is not None:
+            bounds &= Q(price__gte=low)
+        if high is not None:
+            bounds &= Q(price__lt=high)
+        buckets[f'bucket_{index}'] = Count('id', filter=bounds)
+    counts = matched.filter(in_categories).aggregate(**buckets)
+    bucket_counts = {index: counts[f'bucket_{index}'] for index in range(len(PRICE_RANGES))}
+    return SearchResult(
+        _ordered_products(ids), _total(category_counts, category_ids), *_facets(category_counts, bucket_counts)
+    )
+
+
+def autocomplete(prefix, limit=8):
+    """Return up to `limit` ``(id, name)`` pairs whose name matches what has been typed so far."""
+    terms = query_terms(prefix)
+    if not terms:
+        return []
+    if not fts_available():
+        products = Product.objects.all()
+        for term in terms:
+            products = products.filter(name__icontains=term)
+        return list(products.order_by('name', 'id').values_list('id', 'name')[:limit])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT p.id, p.name FROM {FTS_TABLE} JOIN store_product p ON p.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}, 1.0, 0.0), p.id LIMIT %s',
+            [match_expression(terms, column='name'), limit],
+        )
+        return cursor.fetchall()
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .images import FORMATS, srcset
 from .models import Category, Product
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -6,9 +7,83 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = '__all__'
 
+
+def image_srcset(variants, request=None):
+    """The `image_srcset` value for a product's image_variants: a srcset per format, or None."""
+    if not variants or not variants.get('source'):
+        return None
+    build_url = request.build_absolute_uri if request is not None else None
+    return {key: srcset(variants, key, build_url) for key in FORMATS}
+
+
 class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['image_variants']
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image_variants, self.context.get('request'))
+
+
+class ProductRowSerializer:
+    """
+    Read-only fast path that produces exactly what ProductSerializer(many=True)
+    does, but from `.values()` rows joined to their category instead of model
+    instances. Each field's conversion is worked out once from
+    ProductSerializer's own fields; plain ints and strings are copied
+    through as-is, and image URLs are built without touching storage.
+    """
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.plan = []
+        for name, field in ProductSerializer().fields.items():
+            if isinstance(field, CategorySerializer):
+                columns = [f'category__{sub}' for sub in field.fields]
+                self.plan.append((name, 'nested', (list(field.fields), columns)))
+            elif name == 'image_srcset':
+                self.plan.append((name, 'srcset', None))
+            elif isinstance(field, serializers.FileField):
+                self.plan.append((name, 'file', Product._meta.get_field(name).storage))
+            elif isinstance(field, (serializers.IntegerField, serializers.CharField)):
+                self.plan.append((name, 'copy', None))
+            else:
+                self.plan.append((name, 'convert', field.to_representation))
+
+    def get_value_fields(self):
+        """The arguments to pass to `.values()` for the rows given to `to_representation`."""
+        fields = []
+        for name, kind, extra in self.plan:
+            if kind == 'nested':
+                fields.extend(extra[1])
+            else:
+                fields.append('image_variants' if kind == 'srcset' else name)
+        return fields
+
+    def to_representation(self, rows):
+        request = self.context.get('request')
+        data = []
+        for row in rows:
+            item = {}
+            for name, kind, extra in self.plan:
+                if kind == 'srcset':
+                    item[name] = image_srcset(row['image_variants'], request)
+                    continue
+                value = row[name] if kind != 'nested' else None
+                if kind == 'copy' or (value is None and kind != 'nested'):
+                    item[name] = value
+                elif kind == 'convert':
+                    item[name] = extra(value)
+                elif kind == 'file':
+                    if not value:
+                        item[name] = None
+                    else:
+                        url = extra.url(value)
+                        item[name] = request.build_absolute_uri(url) if request is not None else url
+                else:
+                    item[name] = {key: row[column] for key, column in zip(*extra)}
+            data.append(item)
+        return data
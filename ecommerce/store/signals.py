@@ -0,0 +1,96 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.db import connections
+from django.dispatch import receiver
+
+from . import api_cache, images, search, wishlist
+from .cart import merge_carts
+from .models import Cart, CartItem, Category, Product, Review, Wishlist
+from .ratings import apply_rating
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    merge_carts(request, user)
+
+
+@receiver(pre_delete, sender=Product)
+def remove_product_from_carts(sender, instance, **kwargs):
+    # The cascade deletes the cart lines; take their value off the cart totals first.
+    for cart_id, quantity, unit_price in CartItem.objects.filter(product=instance).values_list(
+        'cart_id', 'quantity', 'unit_price'
+    ):
+        Cart.objects.filter(pk=cart_id).update(total=F('total') - quantity * unit_price)
+
+
+@receiver(pre_save, sender=Review)
+def change_review_rating(sender, instance, **kwargs):
+    # An edited review (e.g. in the admin) moves its rating in the aggregates
+    if instance._state.adding or instance.pk is None:
+        return
+    old = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+    if old is None or old == (instance.product_id, instance.rating):
+        return
+    apply_rating(old[0], old[1], delta=-1)
+    apply_rating(instance.product_id, instance.rating)
+    api_cache.products_changed({old[0], instance.product_id})
+
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    if created:
+        apply_rating(instance.product_id, instance.rating)
+        api_cache.product_changed(instance.product_id)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    apply_rating(instance.product_id, instance.rating, delta=-1)
+    api_cache.product_changed(instance.product_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_api_cache(sender, instance, **kwargs):
+    api_cache.product_changed(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def render_image_variants(sender, instance, **kwargs):
+    # Covers ProductForm and the admin; bulk writes are handled by generate_image_variants
+    if images.needs_variants(instance):
+        images.schedule_variants(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_api_cache(sender, instance, **kwargs):
+    # Product payloads embed their category
+    api_cache.products_changed(Product.objects.filter(category_id=instance.pk).values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Wishlist.products.through)
+def forget_cached_wishlist(sender, instance, action, reverse, pk_set, **kwargs):
+    # Edits through the related managers (e.g. the admin); store/wishlist.py
+    # writes the through table directly and drops the cache itself
+    if not reverse:
+        wishlist.forget(instance.user_id)
+        return
+    # product.wishlisted_by: `pk_set` holds wishlist ids, except on clear,
+    # whose wishlists are looked up before they are unlinked
+    if action == 'pre_clear':
+        user_ids = Wishlist.objects.filter(products=instance).values_list('user_id', flat=True)
+    elif action in ('post_add', 'post_remove'):
+        user_ids = Wishlist.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+    else:
+        return
+    for user_id in user_ids:
+        wishlist.forget(user_id)
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    # A migration that makes SQLite rebuild store_product drops the index triggers
+    if sender.name == 'store':
+        search.ensure_index(connections[using])
@@ -0,0 +1,30 @@
+from django import template
+
+from store.images import srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag('store/_product_picture.html')
+def product_picture(product, sizes='100vw', css_class='', style='', placeholder='images/placeholder.jpg'):
+    """
+    Render a product's image as a <picture> offering its WebP and JPEG
+    derivatives, falling back to the original upload until they exist.
+    """
+    variants = product.image_variants if product.image else None
+    jpeg = (variants or {}).get('jpeg', {})
+    # Browsers without srcset support get a mid-sized derivative rather than the upload
+    if jpeg:
+        src = product.image.storage.url(jpeg.get('320') or jpeg[min(jpeg, key=int)])
+    else:
+        src = product.image.url if product.image else None
+    return {
+        'product': product,
+        'src': src,
+        'webp_srcset': srcset(variants, 'webp'),
+        'jpeg_srcset': srcset(variants, 'jpeg'),
+        'sizes': sizes,
+        'css_class': css_class,
+        'style': style,
+        'placeholder': placeholder,
+    }
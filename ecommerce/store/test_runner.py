@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class StoreTestRunner(DiscoverRunner):
+    """
+    Test runner that writes tracked interactions and renders image variants
+    inline as they happen, and recomputes trending products on every
+    lookup, so no background thread touches the test database and no
+    buffered or cached work leaks from one test into the next. Views going
+    over their query budget fail the test that requested them.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.INTERACTION_TRACKING = {
+            **getattr(settings, 'INTERACTION_TRACKING', {}),
+            'BACKGROUND': False,
+            'BATCH_SIZE': 1,
+        }
+        settings.IMAGE_VARIANTS = {**getattr(settings, 'IMAGE_VARIANTS', {}), 'BACKGROUND': False}
+        settings.POPULARITY = {**getattr(settings, 'POPULARITY', {}), 'TTL': 0}
+        settings.PERFORMANCE = {**getattr(settings, 'PERFORMANCE', {}), 'STRICT': True}
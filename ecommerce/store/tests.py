@@ -1,3 +1,1557 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from PIL import Image
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from .models import Cart, CartItem, Category, Order, Product, Review, UserProductInteraction, Wishlist
+from . import export, fragments, images, recommender, wishlist
+from .benchmarks import SCENARIOS, compare_results, run_benchmarks, seed_dataset
+from .api_cache import get_cache
+from .forms import ProductForm
+from .images import render_variants
+from .instrumentation import PerformanceMiddleware, QueryBudgetExceeded
+from .orders import OutOfStock, place_order, release_expired_orders
+from .popularity import apopular_products, compute_popularity, popular_products, publish, reset_ranking
+from .search import autocomplete, ensure_index, search_products
+from .serializers import ProductRowSerializer, ProductSerializer
+from .tracking import InteractionTracker
+from .recommender import (
+    _top_k, aget_user_recommendations, build_item_index, build_model, get_similar_products, get_user_item_matrix,
+    get_user_recommendations, recommend_batch, train_recommendation_model, update_model,
+)
+
+
+class RecommenderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.products = [
+            Product.objects.create(category=category, name=f'Product {i}', description='', price=10 + i)
+            for i in range(6)
+        ]
+        cls.users = [User.objects.create_user(username=f'user{i}', password='pw') for i in range(4)]
+        # user0 and user1 share tastes; user1 also looked at products 3 and 4
+        interactions = {
+            0: [0, 1, 2],
+            1: [0, 1, 2, 3, 4],
+            2: [5],
+            3: [1, 5],
+        }
+        for user_index, product_indexes in interactions.items():
+            for product_index in product_indexes:
+                UserProductInteraction.objects.create(
+                    user=cls.users[user_index], product=cls.products[product_index], interaction_type='view'
+                )
+        UserProductInteraction.objects.create(user=cls.users[1], product=cls.products[4], interaction_type='purchase')
+
+    def setUp(self):
+        model_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(model_dir.cleanup)
+        settings_override = override_settings(RECOMMENDER_MODEL_DIR=model_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    async def test_untrained_model_serves_trending_products(self):
+        await sync_to_async(publish)(await sync_to_async(compute_popularity)())
+        trending = await sync_to_async(popular_products)(5)
+        self.assertTrue(trending)
+        self.assertEqual(await sync_to_async(get_user_recommendations)(self.users[0].id), trending)
+        self.assertEqual(await aget_user_recommendations(self.users[0].id), trending)
+        batch = await sync_to_async(lambda: list(recommend_batch([self.users[0].id], n_recommendations=5)))()
+        self.assertEqual(batch, [(self.users[0].id, [product.id for product in trending])])
+
+    def test_recommendations_served_from_trained_artifact(self):
+        call_command('train_recommender', stdout=StringIO())
+        # Only the final Product fetch should hit the database.
+        with self.assertNumQueries(1):
+            recommended = get_user_recommendations(self.users[0].id, n_recommendations=2)
+        self.assertEqual(recommended, [self.products[4], self.products[5]])
+
+    def test_recommendations_ranked_by_weighted_neighbour_score(self):
+        call_command('train_recommender', stdout=StringIO())
+        # Product 4 was purchased by a neighbour, so it outranks products that
+        # were only viewed. user3 is closer to user0 than user1 is, so user3's
+        # product 5 beats user1's product 3. Products user0 already has are
+        # never suggested.
+        recommended = get_user_recommendations(self.users[0].id)
+        self.assertEqual(recommended, [self.products[4], self.products[5], self.products[3]])
+
+    def test_sparse_neighbours_match_dense_cosine(self):
+        user_item_matrix = get_user_item_matrix()
+        dense = user_item_matrix.matrix.toarray()
+        unit = dense / np.linalg.norm(dense, axis=1, keepdims=True)
+        expected = unit @ unit.T
+        model = train_recommendation_model(user_item_matrix)
+        for row in range(len(dense)):
+            similarities, rows = model.kneighbors(row, n_neighbors=len(dense))
+            np.testing.assert_allclose(similarities, expected[row, rows], rtol=1e-6)
+            others = [r for r in range(len(dense)) if r != row and expected[row, r] > 0]
+            self.assertEqual(sorted(rows.tolist()), others)
+
+    def test_similar_products_from_item_index(self):
+        call_command('build_item_similarity', stdout=StringIO())
+        with self.assertNumQueries(1):
+            similar = get_similar_products(self.products[3].id)
+        # Products 3 and 4 were only ever seen together
+        self.assertEqual(similar[0], self.products[4])
+        self.assertNotIn(self.products[3], similar)
+        self.assertNotIn(self.products[5], similar)
+
+    def test_incremental_item_index_matches_full_rebuild(self):
+        previous = build_item_index(k=3)
+        new_product = Product.objects.create(category=self.products[0].category, name='New', description='', price=1)
+        # Only user2 (who has product 5) touches the new product, so rows for
+        # products 0-4 are carried over from the previous index.
+        UserProductInteraction.objects.create(user=self.users[2], product=new_product, interaction_type='purchase')
+
+        incremental = build_item_index(previous=previous, k=3)
+        full = build_item_index(k=3)
+        np.testing.assert_array_equal(incremental.product_ids, full.product_ids)
+        np.testing.assert_array_equal(incremental.neighbors, full.neighbors)
+        np.testing.assert_allclose(incremental.scores, full.scores)
+        self.assertEqual(incremental.last_interaction_id, full.last_interaction_id)
+
+    def test_incremental_model_update_matches_full_build(self):
+        artifact = build_model()
+        new_user = User.objects.create_user(username='newcomer', password='pw')
+        new_product = Product.objects.create(category=self.products[0].category, name='New', description='', price=1)
+        for user, product, interaction_type in [
+            (self.users[0], self.products[5], 'view'),
+            (self.users[2], new_product, 'purchase'),
+            (new_user, self.products[0], 'view'),
+            (new_user, new_product, 'view'),
+        ]:
+            UserProductInteraction.objects.create(user=user, product=product, interaction_type=interaction_type)
+
+        self.assertEqual(update_model(artifact), 4)
+        self.assertEqual(update_model(artifact), 0)
+        full = build_model()
+        incremental_matrix, full_matrix = artifact['matrix'], full['matrix']
+        np.testing.assert_array_equal(incremental_matrix.user_ids, full_matrix.user_ids)
+        np.testing.assert_array_equal(incremental_matrix.product_ids, full_matrix.product_ids)
+        self.assertEqual((incremental_matrix.matrix != full_matrix.matrix).nnz, 0)
+        np.testing.assert_allclose(artifact['model'].norms, full['model'].norms)
+        self.assertEqual(artifact['last_interaction_id'], full['last_interaction_id'])
+        for user in self.users + [new_user]:
+            row = full_matrix.row_for_user(user.id)
+            incremental_similarities, incremental_rows = artifact['model'].kneighbors(row, 5)
+            full_similarities, full_rows = full['model'].kneighbors(row, 5)
+            np.testing.assert_array_equal(incremental_rows, full_rows)
+            np.testing.assert_allclose(incremental_similarities, full_similarities)
+
+    def test_top_k_breaks_ties_on_key(self):
+        keys = np.array([9, 4, 7, 1, 8, 3, 6, 2, 5])
+        scores = np.array([1, 2, 1, 1, 1, 1, 1, 1, 1], dtype=np.float32)
+        np.testing.assert_array_equal(_top_k(keys, scores, 3)[1], [4, 1, 2])
+
+    def test_batch_recommendations_match_single_user(self):
+        # Lots of small random histories over six products, so scores tie a lot
+        rng = np.random.default_rng(0)
+        shoppers = User.objects.bulk_create([User(username=f'shopper{i}') for i in range(40)])
+        UserProductInteraction.objects.bulk_create([
+            UserProductInteraction(user=user, product=self.products[index], interaction_type=kind)
+            for user in shoppers
+            for index, kind in zip(rng.choice(6, size=rng.integers(1, 4), replace=False),
+                                   rng.choice(['view', 'cart', 'purchase'], size=3))
+        ])
+        call_command('train_recommender', stdout=StringIO())
+        newcomer = User.objects.create_user(username='newcomer')
+        user_ids = [user.id for user in self.users + shoppers] + [newcomer.id]
+
+        expected = [(user_id, [product.id for product in get_user_recommendations(user_id, 3)]) for user_id in user_ids]
+        self.assertEqual(list(recommend_batch(user_ids, n_recommendations=3, chunk_size=7)), expected)
+        self.assertEqual(list(recommend_batch(user_ids, n_recommendations=3, chunk_size=7, workers=2)), expected)
+        # Nothing the user already has, and newcomers get trending products
+        self.assertFalse({product.id for product in self.products[:3]} & set(expected[0][1]))
+        self.assertTrue(expected[-1][1])
+
+    async def test_async_recommendations_scored_off_the_event_loop(self):
+        await sync_to_async(call_command)('train_recommender', stdout=StringIO())
+        threads = []
+        rank_for_user = recommender._rank_for_user
+
+        def spy(*args):
+            threads.append(threading.current_thread().name)
+            return rank_for_user(*args)
+
+        with mock.patch('store.recommender._rank_for_user', spy):
+            recommended = await aget_user_recommendations(self.users[0].id)
+        self.assertEqual(recommended, [self.products[4], self.products[5], self.products[3]])
+        self.assertTrue(threads[0].startswith('recommender-scoring'))
+
+        response = await self.async_client.get(reverse('api:product-recommendations', args=[self.users[0].id]))
+        self.assertEqual([product['id'] for product in response.json()], [product.id for product in recommended])
+        # A user the model doesn't know gets trending products
+        newcomer = await User.objects.acreate(username='newcomer')
+        self.assertEqual(await aget_user_recommendations(newcomer.id, 1), [self.products[4]])
+
+        # The batch endpoint streams to an ASGI server without buffering
+        await self.async_client.aforce_login(await User.objects.acreate(username='staff', is_staff=True))
+        response = await self.async_client.post(
+            reverse('api:product-recommendations-batch'), {'user_ids': [newcomer.id], 'n': 1},
+            content_type='application/json',
+        )
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines], [{'user_id': newcomer.id, 'product_ids': [self.products[4].id]}]
+        )
+
+    def test_batch_recommendations_endpoint(self):
+        call_command('train_recommender', stdout=StringIO())
+        url = reverse('api:product-recommendations-batch')
+        body = {'user_ids': [self.users[0].id, self.users[2].id], 'n': 2}
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 403)
+
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        response = self.client.post(url, body, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(lines, [
+            {'user_id': user.id, 'product_ids': [product.id for product in get_user_recommendations(user.id, 2)]}
+            for user in (self.users[0], self.users[2])
+        ])
+
+        response = self.client.post(url, {'all_active': True}, content_type='application/json')
+        user_ids = [json.loads(line)['user_id'] for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(user_ids, list(User.objects.order_by('id').values_list('id', flat=True)))
+        for bad in ({'user_ids': '1,2'}, {'user_ids': [1], 'n': 0}, {}):
+            self.assertEqual(self.client.post(url, bad, content_type='application/json').status_code, 400)
+
+    def test_batch_recommendations_command(self):
+        call_command('train_recommender', stdout=StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/users.txt', 'w') as f:
+                f.write(f'{self.users[0].id}\n\n{self.users[1].id}\n')
+            call_command('batch_recommendations', input=f'{tmp}/users.txt', n=2, output=f'{tmp}/out.ndjson',
+                         stderr=StringIO())
+            with open(f'{tmp}/out.ndjson') as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, [
+            {'user_id': self.users[0].id, 'product_ids': [self.products[4].id, self.products[5].id]},
+            {'user_id': self.users[1].id, 'product_ids': [
+                product.id for product in get_user_recommendations(self.users[1].id, 2)
+            ]},
+        ])
+
+    def test_batch_recommendations_command_without_model(self):
+        out, err = StringIO(), StringIO()
+        call_command('batch_recommendations', self.users[0].id, self.users[2].id, n=2, stdout=out, stderr=err)
+        self.assertIn('No trained model', err.getvalue())
+        trending = [product.id for product in get_user_recommendations(self.users[0].id, 2)]
+        self.assertTrue(trending)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], [
+            {'user_id': self.users[0].id, 'product_ids': trending},
+            {'user_id': self.users[2].id, 'product_ids': trending},
+        ])
+
+
+class PopularityTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        gadgets = Category.objects.create(name='Gadgets')
+        books = Category.objects.create(name='Books')
+        cls.old_hit, cls.new_hit, cls.bought, cls.novel, cls.unseen = [
+            Product.objects.create(category=category, name=name, description='', price=10)
+            for category, name in [
+                (gadgets, 'Old hit'), (gadgets, 'New hit'), (gadgets, 'Bought'), (books, 'Novel'), (books, 'Unseen'),
+            ]
+        ]
+        cls.users = [User.objects.create_user(username=f'user{i}') for i in range(4)]
+        now = timezone.now()
+        events = [
+            # Four views five days ago are worth less than three views today
+            *[(user, cls.old_hit, 'view', now - timedelta(days=5)) for user in cls.users],
+            *[(user, cls.new_hit, 'view', now) for user in cls.users[:3]],
+            # One purchase yesterday outweighs the old views too
+            (cls.users[0], cls.bought, 'purchase', now - timedelta(days=1)),
+            (cls.users[1], cls.novel, 'view', now),
+            # Outside the window
+            *[(user, cls.unseen, 'purchase', now - timedelta(days=40)) for user in cls.users],
+        ]
+        UserProductInteraction.objects.bulk_create([
+            UserProductInteraction(user=user, product=product, interaction_type=kind, timestamp=timestamp)
+            for user, product, kind, timestamp in events
+        ])
+
+    def test_recent_weighted_interactions_rank_first(self):
+        self.assertEqual(popular_products(10), [self.bought, self.new_hit, self.old_hit, self.novel])
+        self.assertEqual(popular_products(2, exclude=[self.bought.id]), [self.new_hit, self.old_hit])
+
+    async def test_newest_products_without_recent_interactions(self):
+        await UserProductInteraction.objects.all().adelete()
+        self.assertEqual(await sync_to_async(popular_products)(2), [self.unseen, self.novel])
+        self.assertEqual(await apopular_products(2), [self.unseen, self.novel])
+        self.assertEqual(await apopular_products(5, self.old_hit.category_id, exclude=[self.bought.id]),
+                         [self.new_hit, self.old_hit])
+
+    def test_ranked_per_category(self):
+        popularity = compute_popularity()
+        self.assertEqual(popularity.top(5, self.novel.category_id), [self.novel.id])
+        self.assertEqual(popularity.top(5, self.old_hit.category_id),
+                         [self.bought.id, self.new_hit.id, self.old_hit.id])
+        self.assertNotIn(self.unseen.id, popularity.top(10))
+        self.assertIn(self.unseen.id, compute_popularity(window_days=60).top(10))
+
+    @override_settings(POPULARITY={'TTL': 60})
+    def test_ranking_cached_between_lookups_and_shared(self):
+        popular_products(1)
+        with self.assertNumQueries(1):  # just the Product fetch
+            self.assertEqual(popular_products(1), [self.bought])
+        # Another worker finds the ranking in the shared cache
+        reset_ranking(setting='POPULARITY')
+        with self.assertNumQueries(1):
+            popular_products(1)
+
+    def test_anonymous_home_shows_trending(self):
+        response = self.client.get(reverse('store:home'))
+        self.assertContains(response, 'Trending Now')
+        self.assertEqual(list(response.context['recommendations']), [self.bought, self.new_hit, self.old_hit, self.novel])
+        response = self.client.get(reverse('store:home'), {'category': self.novel.category_id})
+        self.assertEqual(list(response.context['recommendations']), [self.novel])
+
+    async def test_concurrent_async_storefront_requests(self):
+        with tempfile.TemporaryDirectory() as model_dir, override_settings(RECOMMENDER_MODEL_DIR=model_dir):
+            await sync_to_async(call_command)('build_item_similarity', stdout=StringIO())
+            responses = await asyncio.gather(
+                *[self.async_client.get(reverse('store:home')) for _ in range(5)],
+                self.async_client.get(reverse('store:product_detail', args=[self.old_hit.id])),
+            )
+        for response in responses[:5]:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context['recommendations']),
+                             [self.bought, self.new_hit, self.old_hit, self.novel])
+        detail = responses[-1]
+        self.assertContains(detail, 'Old hit')
+        self.assertIn(self.new_hit, detail.context['similar_products'])
+
+    def test_cold_start_user_gets_trending(self):
+        with tempfile.TemporaryDirectory() as model_dir, override_settings(RECOMMENDER_MODEL_DIR=model_dir):
+            call_command('train_recommender', stdout=StringIO())
+            newcomer = User.objects.create_user(username='newcomer')
+            self.assertEqual(get_user_recommendations(newcomer.id, n_recommendations=2), [self.bought, self.new_hit])
+
+    def test_refresh_command(self):
+        out, err = StringIO(), StringIO()
+        call_command('refresh_popularity', show=2, stdout=out, stderr=err)
+        self.assertIn('per-process cache', err.getvalue())  # the default cache is local memory
+        self.assertIn('1. Bought', out.getvalue())
+        self.assertIn('Ranked 4 products in 2 categories', out.getvalue())
+
+
+class InteractionTrackingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.product = Product.objects.create(category=category, name='Phone', description='', price=100, stock=5)
+        cls.user = User.objects.create_user(username='shopper', password='pw')
+
+    def test_events_written_in_batches(self):
+        tracker = InteractionTracker(batch_size=3, flush_interval=60, max_pending=4, background=False)
+        with self.assertNumQueries(0):
+            tracker.track(self.user.id, self.product.id, 'view')
+            tracker.track(self.user.id, self.product.id, 'view')
+        with self.assertNumQueries(1):
+            tracker.track(self.user.id, self.product.id, 'cart')
+        self.assertEqual(UserProductInteraction.objects.count(), 3)
+        self.assertEqual(tracker.pending, 0)
+
+    def test_full_buffer_drops_instead_of_blocking(self):
+        tracker = InteractionTracker(batch_size=10, flush_interval=60, max_pending=2, background=False)
+        with self.assertLogs('store.tracking', 'WARNING'):
+            results = [tracker.track(self.user.id, self.product.id, 'view') for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(tracker.dropped, 1)
+        self.assertEqual(tracker.flush(), 2)
+
+    def test_views_track_interactions(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('store:product_detail', args=[self.product.id]))
+        self.client.get(reverse('store:add_to_cart', args=[self.product.id]))
+        # Viewing (and reloading) the checkout page buys nothing
+        self.client.get(reverse('store:checkout'))
+        self.client.get(reverse('store:checkout'))
+        self.assertFalse(UserProductInteraction.objects.filter(interaction_type='purchase').exists())
+        self.client.post(reverse('store:checkout'))
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        self.client.post(reverse('store:confirm_order', args=[Order.objects.get().id]))
+        self.assertEqual(
+            list(UserProductInteraction.objects.order_by('id').values_list('interaction_type', flat=True)),
+            ['view', 'cart', 'purchase'],
+        )
+
+
+class InteractionFlushTestCase(TransactionTestCase):
+    # SQLite checks foreign keys at commit, so this needs real transactions
+    def test_events_of_deleted_products_dont_drop_the_batch(self):
+        category = Category.objects.create(name='Gadgets')
+        kept, deleted = (
+            Product.objects.create(category=category, name=name, description='', price=10) for name in 'AB'
+        )
+        user = User.objects.create_user(username='shopper', password='pw')
+        tracker = InteractionTracker(batch_size=10, flush_interval=60, max_pending=10, background=False)
+        tracker.track(user.id, kept.id, 'view')
+        tracker.track(user.id, deleted.id, 'view')
+        tracker.track(user.id, kept.id, 'cart')
+        deleted.delete()
+        with self.assertLogs('store.tracking', 'WARNING'):
+            self.assertEqual(tracker.flush(), 2)
+        self.assertEqual(tracker.dropped, 1)
+        self.assertEqual(
+            list(UserProductInteraction.objects.order_by('id').values_list('product_id', 'interaction_type')),
+            [(kept.id, 'view'), (kept.id, 'cart')],
+        )
+
+
+class CartTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.products = [
+            Product.objects.create(category=category, name=f'Product {i}', description='', price=10 * (i + 1))
+            for i in range(5)
+        ]
+
+    def update_cart(self, product, action):
+        payload = json.dumps({'product_id': product.id, 'action': action})
+        return self.client.post(reverse('store:update_cart'), payload, content_type='application/json').json()
+
+    def test_cart_page_query_count_independent_of_cart_size(self):
+        for product in self.products:
+            self.client.get(reverse('store:add_to_cart', args=[product.id]))
+            # session lookup + one cart item fetch, whatever the cart size
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('store:cart'))
+        self.assertEqual(len(response.context['cart_items']), len(self.products))
+        self.assertEqual(response.context['grand_total'], sum(p.price for p in self.products))
+
+    def test_concurrent_first_adds_of_a_product_merge(self):
+        self.update_cart(self.products[1], 'increment')  # start the cart
+        cart = Cart.objects.get()
+        product = self.products[0]
+        # Another request adds the same product after our lookup found no line
+        CartItem.objects.create(cart=cart, product=product, quantity=1, unit_price=product.price)
+        Cart.objects.filter(pk=cart.pk).update(total=F('total') + product.price)
+        select_for_update = CartItem.objects.select_for_update
+        lookups = []
+
+        def lookup_before_the_race():
+            lookups.append(1)
+            return select_for_update().none() if len(lookups) == 1 else select_for_update()
+
+        with mock.patch.object(CartItem.objects, 'select_for_update', side_effect=lookup_before_the_race):
+            data = self.update_cart(product, 'increment')
+        self.assertEqual(data['new_quantity'], 2)
+        self.assertEqual(CartItem.objects.get(product=product).quantity, 2)
+        self.assertEqual(Cart.objects.get().total, 2 * product.price + self.products[1].price)
+
+    def test_quantity_changes_maintain_total_without_catalog_reads(self):
+        self.client.get(reverse('store:add_to_cart', args=[self.products[0].id]))
+        self.client.get(reverse('store:add_to_cart', args=[self.products[1].id]))
+        with CaptureQueriesContext(connection) as queries:
+            data = self.update_cart(self.products[0], 'increment')
+        self.assertFalse([q for q in queries if 'store_product' in q['sql']])
+        self.assertEqual(data['new_quantity'], 2)
+        self.assertEqual(data['new_total'], '20.00')
+        self.assertEqual(data['grand_total'], '40.00')
+
+        data = self.update_cart(self.products[1], 'decrement')
+        self.assertEqual((data['action'], data['new_quantity'], data['grand_total']), ('remove', 0, '20.00'))
+        self.assertEqual(self.update_cart(self.products[0], 'remove')['grand_total'], '0.00')
+
+    def test_unit_price_snapshot_and_deleted_products(self):
+        self.client.get(reverse('store:add_to_cart', args=[self.products[0].id]))
+        Product.objects.filter(pk=self.products[0].pk).update(price=999)
+        self.assertEqual(self.update_cart(self.products[0], 'increment')['new_total'], '20.00')
+
+        gone = Product.objects.create(category=self.products[0].category, name='Gone', description='', price=5)
+        self.client.get(reverse('store:add_to_cart', args=[gone.id]))
+        gone.delete()
+        response = self.client.get(reverse('store:cart'))
+        self.assertEqual(response.context['grand_total'], 20)
+        self.assertEqual(Cart.objects.get().total, 20)
+
+        response = self.client.post(
+            reverse('store:update_cart'), json.dumps({'product_id': 999999, 'action': 'increment'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'success': False, 'error': 'Product not found.'})
+
+    def test_anonymous_cart_merged_at_login(self):
+        user = User.objects.create_user(username='shopper', password='pw')
+        Cart.objects.create(user=user)
+        CartItem.objects.create(cart=user.cart, product=self.products[0], quantity=1, unit_price=10)
+        Cart.objects.filter(user=user).update(total=10)
+
+        self.client.get(reverse('store:add_to_cart', args=[self.products[0].id]))
+        self.client.get(reverse('store:add_to_cart', args=[self.products[1].id]))
+        self.client.post(reverse('login'), {'username': 'shopper', 'password': 'pw'})
+
+        response = self.client.get(reverse('store:cart'))
+        self.assertEqual(
+            [(item['product'], item['quantity']) for item in response.context['cart_items']],
+            [(self.products[0], 2), (self.products[1], 1)],
+        )
+        self.assertEqual(Cart.objects.get().total, 40)
+
+
+class ProductListingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gadgets = Category.objects.create(name='Gadgets')
+        cls.books = Category.objects.create(name='Books')
+        cls.products = [
+            Product.objects.create(
+                category=cls.gadgets if i % 2 else cls.books, name=f'Product {i}', description='', price=10
+            )
+            for i in range(10)
+        ]
+        reviewer = User.objects.create_user(username='reviewer', password='pw')
+        for product in cls.products:
+            Review.objects.create(product=product, user=reviewer, rating=4)
+        UserProductInteraction.objects.create(user=reviewer, product=cls.products[1], interaction_type='view')
+
+    def setUp(self):
+        fragments.get_cache().clear()
+
+    def get_page(self, **params):
+        response = self.client.get(reverse('store:home'), params)
+        return response, [p.name for p in response.context['products']]
+
+    async def test_fragments_rendered_off_the_event_loop(self):
+        calls = []
+
+        def on_loop():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        def spy(original):
+            def wrapper(*args, **kwargs):
+                calls.append(on_loop())
+                return original(*args, **kwargs)
+            return wrapper
+
+        with mock.patch('store.fragments.get_cache', spy(fragments.get_cache)), \
+                mock.patch('store.fragments.render_cards', spy(fragments.render_cards)):
+            await self.async_client.get(reverse('store:home'))
+            await self.async_client.get(reverse('store:home'))  # the cached grid
+            await self.async_client.get(reverse('store:product_detail', args=[self.products[0].id]))
+        self.assertTrue(calls)
+        self.assertNotIn(True, calls)
+
+    def test_keyset_pages_walk_catalog(self):
+        with mock.patch('store.views.PRODUCTS_PER_PAGE', 4):
+            response, names = self.get_page()
+            self.assertEqual(names, [f'Product {i}' for i in range(4)])
+            page = response.context['page']
+            self.assertFalse(page.has_previous)
+
+            response, names = self.get_page(after=page.next_after)
+            self.assertEqual(names, [f'Product {i}' for i in range(4, 8)])
+            response, names = self.get_page(after=response.context['page'].next_after)
+            self.assertEqual(names, ['Product 8', 'Product 9'])
+            self.assertFalse(response.context['page'].has_next)
+
+            response, names = self.get_page(before=response.context['page'].previous_before)
+            self.assertEqual(names, [f'Product {i}' for i in range(4, 8)])
+
+            _, names = self.get_page(category=self.gadgets.id)
+            self.assertEqual(names, ['Product 1', 'Product 3', 'Product 5', 'Product 7'])
+
+    @override_settings(POPULARITY={'TTL': 60})
+    def test_query_count_independent_of_page_size(self):
+        publish(compute_popularity())  # rank trending products once; then only their fetch is a query
+        for page_size in (2, 10):
+            fragments.get_cache().clear()  # time the uncached grid
+            with mock.patch('store.views.PRODUCTS_PER_PAGE', page_size):
+                # products page (with category and review aggregates) + trending products + category filter list
+                with self.assertNumQueries(3):
+                    response = self.client.get(reverse('store:home'), {'after': self.products[0].id})
+        self.assertContains(response, '4.0/5 (1 review)')
+
+    @override_settings(POPULARITY={'TTL': 60})
+    def test_anonymous_grid_cached_until_catalog_changes(self):
+        publish(compute_popularity())
+        url = reverse('store:home')
+        first = self.client.get(url, {'category': self.gadgets.id})
+        # The grid comes from the cache: only trending products and the category list are queried
+        with self.assertNumQueries(2):
+            cached = self.client.get(url, {'category': self.gadgets.id})
+        self.assertEqual(cached.content, first.content)
+        self.assertNotIn('products', cached.context)
+
+        product = self.products[1]
+        product.name = 'Renamed'
+        product.save()
+        self.assertContains(self.client.get(url, {'category': self.gadgets.id}), 'Renamed')
+        # A logged-in visitor's grid is built from the cached cards
+        self.client.force_login(User.objects.get(username='reviewer'))
+        response = self.client.get(url, {'category': self.gadgets.id})
+        self.assertEqual([p.name for p in response.context['products']][:2], ['Renamed', 'Product 3'])
+
+    def test_product_cards_rendered_once_per_version(self):
+        products = list(Product.objects.select_related('category').order_by('id')[:3])
+        with mock.patch('store.fragments.render_to_string', wraps=fragments.render_to_string) as rendered:
+            first = fragments.render_cards(products)
+            self.assertEqual(rendered.call_count, 3)
+            self.assertEqual(fragments.render_cards(products), first)
+            self.assertEqual(rendered.call_count, 3)
+
+            Review.objects.create(product=products[0], user=User.objects.get(username='reviewer'), rating=1)
+            products[0].refresh_from_db()
+            cards = fragments.render_cards(products)
+            self.assertEqual(rendered.call_count, 4)
+        self.assertIn('2.5/5 (2 reviews)', cards[0])
+        self.assertEqual(cards[1:], first[1:])
+        self.assertIn('Product 0', fragments.render_cards(products, compact=True)[0])
+
+
+class ProductRatingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.product = Product.objects.create(category=category, name='Phone', description='', price=100)
+        cls.users = [User.objects.create_user(username=f'user{i}', password='pw') for i in range(12)]
+
+    def assertRatings(self, count, total, average, histogram):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.rating_count, product.rating_sum), (count, total))
+        self.assertAlmostEqual(product.rating_average, average)
+        self.assertEqual(product.rating_histogram, histogram)
+
+    def test_aggregates_maintained_on_review_writes(self):
+        self.client.force_login(self.users[0])
+        self.client.post(reverse('store:add_review', args=[self.product.id]), {'rating': 5, 'comment': 'Great'})
+        review = Review.objects.create(product=self.product, user=self.users[1], rating=2)
+        self.assertRatings(2, 7, 3.5, [(5, 1), (4, 0), (3, 0), (2, 1), (1, 0)])
+
+        review.delete()
+        self.assertRatings(1, 5, 5.0, [(5, 1), (4, 0), (3, 0), (2, 0), (1, 0)])
+
+    def test_aggregates_follow_edited_reviews(self):
+        review = Review.objects.create(product=self.product, user=self.users[0], rating=2)
+        Review.objects.create(product=self.product, user=self.users[1], rating=4)
+        review.rating = 5
+        review.save()
+        self.assertRatings(2, 9, 4.5, [(5, 1), (4, 1), (3, 0), (2, 0), (1, 0)])
+
+        review.comment = 'Still great'
+        review.save()
+        self.assertRatings(2, 9, 4.5, [(5, 1), (4, 1), (3, 0), (2, 0), (1, 0)])
+
+    def test_aggregates_not_editable_in_admin(self):
+        admin = User.objects.create_superuser(username='admin', password='pw')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:store_product_change', args=[self.product.id]))
+        self.assertNotIn('rating_count', response.context['adminform'].form.fields)
+
+    def test_rebuild_ratings_command(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=4)
+        Review.objects.create(product=self.product, user=self.users[1], rating=3)
+        Product.objects.filter(pk=self.product.pk).update(rating_count=0, rating_sum=0, rating_4_count=9)
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertRatings(2, 7, 3.5, [(5, 0), (4, 1), (3, 1), (2, 0), (1, 0)])
+
+    def test_detail_page_reviews_paginated_without_per_review_queries(self):
+        url = reverse('store:product_detail', args=[self.product.id])
+        Review.objects.create(product=self.product, user=self.users[0], rating=4)
+        # product, review count, one page of reviews with their users
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        for user in self.users[1:]:
+            Review.objects.create(product=self.product, user=user, rating=4)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['reviews']), 10)
+        response = self.client.get(url, {'reviews_page': 2})
+        self.assertEqual([r.user.username for r in response.context['reviews']], ['user1', 'user0'])
+
+
+class ProductAPICacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Gadgets')
+        cls.products = [
+            Product.objects.create(category=cls.category, name=f'Product {i}', description='', price=10)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_list_served_from_cache_until_catalog_changes(self):
+        url = reverse('api:product-list')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.json(), second.json())
+
+        Product.objects.filter(pk=self.products[0].pk).first().save()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries)
+        filtered = self.client.get(url, {'category': self.category.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, {'category': self.category.id}).json(), filtered.json())
+
+    def test_rebuilt_ratings_invalidate_cached_responses(self):
+        url = reverse('api:product-list')
+        primed = self.client.get(url)
+        self.assertEqual(primed.json()['results'][0]['rating_count'], 0)
+        # Reviews written around the signals, as by a bulk import
+        user = User.objects.create_user(username='reviewer')
+        Review.objects.bulk_create([Review(product=self.products[0], user=user, rating=4)])
+        call_command('rebuild_ratings', stdout=StringIO())
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=primed['ETag'])
+        self.assertEqual(response.status_code, 200)
+        row = next(row for row in response.json()['results'] if row['id'] == self.products[0].id)
+        self.assertEqual((row['rating_count'], row['rating_average']), (1, 4.0))
+
+    def test_detail_invalidated_by_its_product_and_category_only(self):
+        detail = reverse('api:product-detail', args=[self.products[0].id])
+        other = reverse('api:product-detail', args=[self.products[1].id])
+        self.client.get(detail)
+        self.client.get(other)
+
+        self.products[1].name = 'Renamed'
+        self.products[1].save()
+        with self.assertNumQueries(0):
+            self.client.get(detail)
+        self.assertEqual(self.client.get(other).json()['name'], 'Renamed')
+
+        self.category.name = 'Devices'
+        self.category.save()
+        self.assertEqual(self.client.get(detail).json()['category']['name'], 'Devices')
+
+    def test_conditional_requests_get_304_without_queries(self):
+        url = reverse('api:product-detail', args=[self.products[0].id])
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        Review.objects.create(product=self.products[0], user=User.objects.create_user('u', password='pw'), rating=3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rating_count'], 1)
+
+
+class ProductRowSerializerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        gadgets = Category.objects.create(name='Gadgets', description='Things with batteries')
+        books = Category.objects.create(name='Books')
+        Product.objects.create(category=gadgets, name='Phone', description='Smart', price='199.9', stock=3,
+                               image='products/phone.jpg')
+        Product.objects.create(category=books, name='Novel', description='', price=12, rating_average=4.5)
+
+    def test_output_byte_identical_to_product_serializer(self):
+        context = {'request': APIRequestFactory().get('/api/products/')}
+        products = Product.objects.select_related('category').order_by('id')
+        expected = JSONRenderer().render(ProductSerializer(products, many=True, context=context).data)
+        rows = ProductRowSerializer(context=context)
+        actual = JSONRenderer().render(rows.to_representation(products.values(*rows.get_value_fields())))
+        self.assertEqual(actual, expected)
+
+    def test_list_endpoint_uses_two_queries(self):
+        get_cache().clear()
+        with self.assertNumQueries(2):  # count + one joined page query
+            response = self.client.get(reverse('api:product-list'))
+        self.assertEqual(response.json()['results'][0]['image'], 'http://testserver/media/products/phone.jpg')
+
+
+class CatalogExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        gadgets = Category.objects.create(name='Gadgets')
+        cls.products = [
+            Product.objects.create(category=gadgets, name=f'Product {i}', description='Line one\nline "two"',
+                                   price=f'{i}.50', stock=i, image='products/p.jpg' if i == 0 else None)
+            for i in range(5)
+        ]
+
+    def export(self, **params):
+        response = self.client.get(reverse('api:product-export'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_streams_every_product_in_id_order(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [p.id for p in self.products])
+        self.assertEqual(rows[0]['image'], 'http://testserver/media/products/p.jpg')
+        self.assertEqual(rows[1]['price'], '1.50')
+        self.assertEqual(rows[1]['category_name'], 'Gadgets')
+
+    def test_csv_export(self):
+        response, body = self.export(format='csv')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[2]['description'], 'Line one\nline "two"')
+        self.assertEqual(rows[2]['image'], '')
+
+    def test_resume_after_and_updated_since(self):
+        _, body = self.export(after=self.products[2].id)
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [p.id for p in self.products[3:]])
+
+        since = timezone.now()
+        Product.objects.filter(pk=self.products[1].pk).update(updated_at=since + timedelta(seconds=1))
+        _, body = self.export(updated_since=since.isoformat())
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [self.products[1].id])
+
+    async def test_streamed_without_buffering_under_asgi(self):
+        _, expected = await sync_to_async(self.export)()
+        response = await self.async_client.get(reverse('api:product-export'))
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]).decode(), expected)
+
+        read = []
+
+        def lines():
+            for i in range(5):
+                read.append(i)
+                yield f'{i}\n'
+
+        chunks = export.aiter_text(lines(), batch_size=2)
+        self.assertEqual(await anext(chunks), '0\n1\n')
+        self.assertEqual(read, [0, 1])
+        self.assertEqual([chunk async for chunk in chunks], ['2\n3\n', '4\n'])
+
+    def test_invalid_parameters_rejected(self):
+        for params in ({'format': 'xml'}, {'after': 'x'}, {'updated_since': 'yesterday'}):
+            self.assertEqual(self.client.get(reverse('api:product-export'), params).status_code, 400)
+
+    def test_command_to_stdout(self):
+        out = StringIO()
+        call_command('export_catalog', '--chunk-size', '2', '--after', self.products[0].id, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/products.csv'
+            call_command('export_catalog', '--format', 'csv', '--output', path,
+                         '--base-url', 'https://shop.example.com/', stderr=StringIO())
+            with open(path, encoding='utf-8') as f:
+                content = f.read()
+        self.assertIn('https://shop.example.com/media/products/p.jpg', content)
+        self.assertTrue(content.startswith('id,sku,name,description'))
+
+
+class CatalogImportTestCase(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content):
+        path = f'{self.tmp.name}/{name}'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_products_upserted_by_sku(self):
+        books = Category.objects.create(name='Books')
+        existing = Product.objects.create(category=books, sku='B-1', name='Old name', description='Kept',
+                                          price=5, stock=1)
+        path = self.write('products.csv', (
+            'sku,name,price,stock,category\n'
+            'B-1,New name,7.5,,Books\n'
+            'G-1,Phone,199,3,Gadgets\n'
+            'G-2,,10,1,Gadgets\n'
+            'G-3,Broken,-1,1,Gadgets\n'
+        ))
+        out, err = self.run_import(path, '--kind', 'products')
+        self.assertIn('1 created, 1 updated, 0 unchanged, 2 skipped', out)
+        self.assertIn('line 4: new product G-2 needs name', err)
+        self.assertIn("line 5: invalid price '-1'", err)
+
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.description, existing.price, existing.stock),
+                         ('New name', 'Kept', Decimal('7.50'), 1))
+        phone = Product.objects.get(sku='G-1')
+        self.assertEqual(phone.category.name, 'Gadgets')
+        self.assertEqual(Category.objects.filter(name='Gadgets').count(), 1)
+
+        # A stock-only file touches nothing else
+        path = self.write('stock.ndjson', '{"sku": "G-1", "stock": 0}\n\n{"sku": "B-1", "stock": 9}\n')
+        self.run_import(path, '--kind', 'products')
+        self.assertEqual(dict(Product.objects.values_list('sku', 'stock')), {'B-1': 9, 'G-1': 0})
+        self.assertEqual(Product.objects.get(sku='G-1').name, 'Phone')
+
+    def test_batches_use_constant_queries(self):
+        rows = ''.join(f'{{"sku": "S-{i}", "name": "P{i}", "price": "1", "category": "C{i % 3}"}}\n'
+                       for i in range(50))
+        path = self.write('products.ndjson', rows)
+        with CaptureQueriesContext(connection) as queries:
+            self.run_import(path, '--kind', 'products', '--batch-size', '25')
+        self.assertEqual(Product.objects.count(), 50)
+        with CaptureQueriesContext(connection) as update_queries:
+            out, _ = self.run_import(path, '--kind', 'products', '--batch-size', '25')
+        self.assertIn('0 updated, 50 unchanged', out)
+        # Neither run issues a query per row
+        self.assertLess(len(queries), 20)
+        self.assertLess(len(update_queries), 20)
+
+    def test_interactions_resolve_natural_keys(self):
+        gadgets = Category.objects.create(name='Gadgets')
+        Product.objects.create(category=gadgets, sku='G-1', name='Phone', price=1)
+        User.objects.create_user('alice')
+        path = self.write('interactions.ndjson', (
+            '{"user": "alice", "product": "G-1", "interaction_type": "purchase", "timestamp": "2026-01-02T03:04:05Z"}\n'
+            '{"user": "bob", "product": "G-1", "interaction_type": "view"}\n'
+            '{"user": "alice", "product": "nope", "interaction_type": "view"}\n'
+            '{"user": "alice", "product": "G-1", "interaction_type": "like"}\n'
+            'not json\n'
+        ))
+        out, err = self.run_import(path, '--kind', 'interactions')
+        self.assertIn('1 created, 0 updated, 0 unchanged, 4 skipped', out)
+        self.assertIn("unknown user 'bob'", err)
+        self.assertIn('line 5: not a JSON object', err)
+        interaction = UserProductInteraction.objects.get()
+        self.assertEqual(interaction.timestamp.year, 2026)
+
+        out, _ = self.run_import(path, '--kind', 'interactions', '--create-users')
+        self.assertIn('2 created', out)
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+
+    def test_export_round_trips_through_import(self):
+        gadgets = Category.objects.create(name='Gadgets')
+        Product.objects.create(category=gadgets, sku='G-1', name='Phone', description='Line\nbreak', price='9.99',
+                               stock=4, image='products/phone.jpg')
+        path = f'{self.tmp.name}/export.csv'
+        call_command('export_catalog', '--format', 'csv', '--output', path, stderr=StringIO())
+        Product.objects.update(name='Changed', stock=0)
+        self.run_import(path, '--kind', 'products')
+        product = Product.objects.get()
+        self.assertEqual((product.name, product.description, product.stock, product.image.name),
+                         ('Phone', 'Line\nbreak', 4, 'products/phone.jpg'))
+
+    def test_synthetic_dataset(self):
+        out, _ = self.run_import('--synthetic', '--categories', '3', '--products', '40', '--users', '5',
+                                 '--interactions-per-user', '4')
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(UserProductInteraction.objects.count(), 20)
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.audio = Category.objects.create(name='Audio')
+        cls.books = Category.objects.create(name='Books')
+        cls.headphones = Product.objects.create(category=cls.audio, name='Wireless Headphones',
+                                                description='Noise cancelling', price=120)
+        cls.speaker = Product.objects.create(category=cls.audio, name='Speaker',
+                                             description='Pairs with wireless headphones', price=40)
+        cls.book = Product.objects.create(category=cls.books, name='Headphone Repair Manual',
+                                          description='Fix your own', price=15)
+        Product.objects.create(category=cls.books, name='Novel', description='A story', price=10)
+
+    def ids(self, result):
+        return [product.id for product in result.products]
+
+    def test_bm25_ranks_name_matches_first(self):
+        result = search_products('wireless headphones')
+        self.assertEqual(self.ids(result), [self.headphones.id, self.speaker.id])
+        self.assertEqual(result.total, 2)
+
+    def test_last_term_matches_as_prefix(self):
+        self.assertEqual(set(self.ids(search_products('headph'))),
+                         {self.headphones.id, self.speaker.id, self.book.id})
+        self.assertEqual(autocomplete('wire'), [(self.headphones.id, 'Wireless Headphones')])
+        self.assertEqual(search_products('"AND OR*').total, 0)  # FTS syntax is treated as text
+
+    def test_facets_ignore_their_own_filter(self):
+        result = search_products('headph', category_ids=[self.books.id], max_price=Decimal('100'))
+        self.assertEqual(self.ids(result), [self.book.id])
+        self.assertEqual(result.total, 1)
+        counts = {facet['name']: facet['count'] for facet in result.categories}
+        self.assertEqual(counts, {'Audio': 1, 'Books': 1})  # price filter applied, category not
+        prices = {facet['label']: facet['count'] for facet in result.prices}
+        self.assertEqual(prices['Under 25'], 1)
+        self.assertEqual(prices['100 to 250'], 0)
+
+    def test_index_follows_bulk_writes(self):
+        Product.objects.filter(pk=self.book.pk).update(name='Cookbook')
+        Product.objects.bulk_create([Product(category=self.books, name='Headphone Stand', description='', price=9)])
+        self.speaker.delete()
+        names = {product.name for product in search_products('headphone').products}
+        self.assertEqual(names, {'Wireless Headphones', 'Headphone Stand'})
+
+    def test_index_repaired_after_table_rebuild(self):
+        # SQLite drops a table's triggers when a migration rebuilds it
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER store_product_fts_update')
+        Product.objects.filter(name='Novel').update(name='Paperback')
+        self.assertEqual(search_products('paperback').total, 0)
+        self.assertTrue(ensure_index())
+        self.assertFalse(ensure_index())
+        self.assertEqual(search_products('paperback').total, 1)
+        self.assertEqual(search_products('novel').total, 0)
+
+    def test_fallback_without_fts(self):
+        with mock.patch('store.search.fts_available', return_value=False):
+            result = search_products('headph', category_ids=[self.books.id], max_price=Decimal('100'))
+            self.assertEqual(self.ids(result), [self.book.id])
+            self.assertEqual({facet['name']: facet['count'] for facet in result.categories}, {'Audio': 1, 'Books': 1})
+            self.assertEqual(autocomplete('wire'), [(self.headphones.id, 'Wireless Headphones')])
+
+    def test_search_api_and_page(self):
+        response = self.client.get(reverse('api:product-search'), {'q': 'headph', 'category': self.audio.id})
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([item['id'] for item in data['results']], [self.headphones.id, self.speaker.id])
+        self.assertEqual(data['facets']['categories'][0]['count'], 2)
+
+        response = self.client.get(reverse('api:product-autocomplete'), {'q': 'spea'})
+        self.assertEqual(response.json(), [{'id': self.speaker.id, 'name': 'Speaker'}])
+
+        response = self.client.get(reverse('store:search'), {'q': 'headph', 'min_price': '20'})
+        self.assertContains(response, 'Wireless Headphones')
+        self.assertNotContains(response, 'Repair Manual')
+        self.assertEqual(response.context['result'].total, 2)
+
+
+class ProductFilterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.audio = Category.objects.create(name='Audio')
+        cls.books = Category.objects.create(name='Books')
+        cls.toys = Category.objects.create(name='Toys')
+        cls.cheap = Product.objects.create(category=cls.books, name='Cheap', description='', price=10, stock=0,
+                                           rating_average=4.5)
+        cls.mid = Product.objects.create(category=cls.audio, name='Mid', description='', price=60, stock=5,
+                                         rating_average=3.0)
+        cls.dear = Product.objects.create(category=cls.audio, name='Dear', description='', price=300, stock=1,
+                                          rating_average=4.5)
+        cls.toy = Product.objects.create(category=cls.toys, name='Toy', description='', price=60, stock=2)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def names(self, **params):
+        response = self.client.get(reverse('api:product-list'), params)
+        return [item['name'] for item in response.json()['results']]
+
+    def test_range_category_stock_and_rating_filters(self):
+        self.assertEqual(self.names(min_price='50', max_price='100'), ['Mid', 'Toy'])
+        self.assertEqual(self.names(categories=f'{self.books.id},{self.toys.id}'), ['Cheap', 'Toy'])
+        self.assertEqual(self.names(in_stock='true'), ['Mid', 'Dear', 'Toy'])
+        self.assertEqual(self.names(in_stock='false'), ['Cheap'])
+        self.assertEqual(self.names(min_rating='4'), ['Cheap', 'Dear'])
+        self.assertEqual(self.names(category=self.audio.id, price='60'), ['Mid'])
+
+    def test_ordering_breaks_ties_on_id(self):
+        self.assertEqual(self.names(ordering='-price'), ['Dear', 'Mid', 'Toy', 'Cheap'])
+        self.assertEqual(self.names(ordering='-rating_average,price'), ['Cheap', 'Dear', 'Mid', 'Toy'])
+
+    def test_facets_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('api:product-list'), {'facets': 'true', 'max_price': '100'}).json()
+        self.assertEqual(len(queries), 3)  # count, page, facets
+        facets = data['facets']
+        self.assertEqual([(f['name'], f['count']) for f in facets['categories']], [('Audio', 1), ('Books', 1), ('Toys', 1)])
+        self.assertEqual([f['count'] for f in facets['price']], [1, 0, 2, 0, 0])
+        self.assertEqual(facets['in_stock'], 2)
+        self.assertNotIn('facets', self.client.get(reverse('api:product-list')).json())
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index}', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output checked is SQLite-specific')
+    def test_filters_use_indexes(self):
+        self.assertUsesIndex(
+            Product.objects.filter(category=self.audio, price__gte=50, price__lte=100), 'product_category_price_idx'
+        )
+        self.assertUsesIndex(
+            Product.objects.filter(category=self.audio).order_by('price'), 'product_category_price_idx'
+        )
+        self.assertUsesIndex(Product.objects.filter(stock__gt=0), 'product_stock_idx')
+        self.assertUsesIndex(
+            UserProductInteraction.objects.filter(user_id=1, product_id=self.mid.id).order_by('-timestamp'),
+            'interaction_user_product_idx',
+        )
+
+
+def image_upload(name='photo.jpg', size=(1200, 800), fmt='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+
+class ImageVariantsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Gadgets')
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        get_cache().clear()
+
+    def create_product(self, **kwargs):
+        form = ProductForm(
+            {'name': 'Phone', 'description': 'Smart', 'price': '10', 'stock': 1, 'category': self.category.id},
+            {'image': image_upload(**kwargs)},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = form.save()
+        product.refresh_from_db()
+        return product
+
+    def test_variants_rendered_after_form_save(self):
+        product = self.create_product()
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual(sorted(variants['webp'], key=int), ['160', '320', '640', '1024'])
+        storage = product.image.storage
+        with storage.open(variants['jpeg']['320']) as f:
+            self.assertEqual(Image.open(f).size, (320, 213))
+        with storage.open(variants['webp']['1024']) as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
+        # Content-hashed names: rendering again reuses the same files
+        self.assertEqual(render_variants(product.image.name, storage), variants)
+
+    def test_small_images_not_upscaled(self):
+        product = self.create_product(size=(100, 50), fmt='PNG', name='icon.png')
+        self.assertEqual(list(product.image_variants['jpeg']), ['100'])
+
+    def test_saves_without_a_new_image_render_nothing(self):
+        product = self.create_product()
+        with mock.patch('store.images.render_variants') as render:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.name = 'Renamed'
+                product.save()
+        render.assert_not_called()
+
+    @override_settings(IMAGE_VARIANTS={'BACKGROUND': True})
+    def test_rendering_happens_off_the_request_thread(self):
+        with mock.patch('store.images._get_executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                product = Product.objects.create(category=self.category, name='P', description='', price=1,
+                                                 image='products/p.jpg')
+        executor.return_value.submit.assert_called_once_with(images._run, product.id)
+
+    def test_srcset_in_templates_and_api(self):
+        product = self.create_product()
+        response = self.client.get(reverse('store:home'))
+        self.assertContains(response, '<source type="image/webp" srcset="/media/products/variants/photo.')
+        self.assertContains(response, f'src="/media/{product.image_variants["jpeg"]["320"]}"')
+
+        data = self.client.get(reverse('api:product-detail', args=[product.id])).json()
+        self.assertTrue(data['image_srcset']['webp'].startswith('http://testserver/media/products/variants/'))
+        self.assertTrue(data['image_srcset']['jpeg'].endswith(' 1024w'))
+        listed = self.client.get(reverse('api:product-list')).json()['results'][0]
+        self.assertEqual(listed['image_srcset'], data['image_srcset'])
+
+    def test_backfill_command(self):
+        storage = Product._meta.get_field('image').storage
+        name = storage.save('products/legacy.jpg', image_upload())
+        Product.objects.bulk_create([Product(category=self.category, name='Legacy', description='', price=1, image=name)])
+        out = StringIO()
+        call_command('generate_image_variants', '--workers', '1', stdout=out)
+        self.assertIn('updated image variants of 1', out.getvalue())
+        self.assertEqual(Product.objects.get().image_variants['source'], name)
+        out = StringIO()
+        call_command('generate_image_variants', '--workers', '1', stdout=out)
+        self.assertIn('Checked 0 products', out.getvalue())
+
+
+class OrderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.phone = Product.objects.create(category=category, name='Phone', description='', price=100, stock=3)
+        cls.case = Product.objects.create(category=category, name='Case', description='', price=5, stock=10)
+        cls.user = User.objects.create_user(username='shopper', password='pw')
+        cls.staff = User.objects.create_user(username='staff', password='pw', is_staff=True)
+
+    def setUp(self):
+        get_cache().clear()
+        self.client.force_login(self.user)
+
+    def add(self, product, times=1):
+        for _ in range(times):
+            self.client.get(reverse('store:add_to_cart', args=[product.id]))
+
+    def stock(self):
+        return dict(Product.objects.values_list('name', 'stock'))
+
+    def test_checkout_reserves_stock_and_empties_cart(self):
+        self.add(self.phone, 2)
+        self.add(self.case)
+        response = self.client.post(reverse('store:checkout'))
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('store:order_detail', args=[order.id]))
+        self.assertEqual(self.stock(), {'Phone': 1, 'Case': 9})
+        self.assertEqual((order.status, order.total, order.user), (Order.PENDING, Decimal('205.00'), self.user))
+        self.assertEqual(sorted(order.lines.values_list('product_name', 'quantity')), [('Case', 1), ('Phone', 2)])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(Cart.objects.get().total, 0)
+        self.assertContains(self.client.get(reverse('store:order_detail', args=[order.id])), 'Awaiting payment')
+
+        # A second submit finds the cart empty
+        self.client.post(reverse('store:checkout'))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_out_of_stock_line_rolls_back_whole_order(self):
+        self.add(self.case, 2)
+        self.add(self.phone, 4)
+        response = self.client.post(reverse('store:checkout'))
+        self.assertContains(response, 'Not enough stock left for: Phone.')
+        self.assertEqual(self.stock(), {'Phone': 3, 'Case': 10})
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_confirm_records_purchases_in_one_insert(self):
+        self.add(self.phone)
+        self.add(self.case)
+        self.client.post(reverse('store:checkout'))
+        order = Order.objects.get()
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('store:confirm_order', args=[order.id]))
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "store_userproductinteraction"')]
+        self.assertEqual(len(inserts), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.PAID)
+        self.assertEqual(UserProductInteraction.objects.filter(interaction_type='purchase').count(), 2)
+        self.assertEqual(self.stock(), {'Phone': 2, 'Case': 9})
+
+    def test_expired_and_cancelled_orders_release_stock_once(self):
+        self.add(self.phone, 2)
+        self.client.post(reverse('store:checkout'))
+        self.add(self.case, 3)
+        self.client.post(reverse('store:checkout'))
+        first, second = Order.objects.order_by('id')
+
+        self.client.post(reverse('store:cancel_order', args=[second.id]))
+        Order.objects.filter(pk=first.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired_orders(), 1)
+        self.assertEqual(release_expired_orders(), 0)
+        self.assertEqual(self.stock(), {'Phone': 3, 'Case': 10})
+        self.assertEqual(dict(Order.objects.values_list('id', 'status')),
+                         {first.id: Order.EXPIRED, second.id: Order.CANCELLED})
+
+        # Too late to pay for it now
+        self.client.force_login(self.staff)
+        self.client.post(reverse('store:confirm_order', args=[first.id]))
+        self.assertEqual(Order.objects.get(pk=first.pk).status, Order.EXPIRED)
+
+    def test_checkout_charges_current_prices(self):
+        self.add(self.phone)
+        self.add(self.case, 2)
+        Product.objects.filter(pk=self.phone.pk).update(price=150)
+        response = self.client.post(reverse('store:checkout'))
+        self.assertContains(response, 'The price of Phone has changed')
+        self.assertContains(response, 'Grand Total: ₹160.00')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), {'Phone': 3, 'Case': 10})
+        self.assertEqual(Cart.objects.get().total, Decimal('160.00'))
+
+        # Submitting again, now at the price shown, places the order
+        self.client.post(reverse('store:checkout'))
+        order = Order.objects.get()
+        self.assertEqual(order.total, Decimal('160.00'))
+        self.assertEqual(order.lines.get(product=self.phone).unit_price, Decimal('150.00'))
+
+    def test_only_staff_confirm_orders(self):
+        self.add(self.phone)
+        self.client.post(reverse('store:checkout'))
+        order = Order.objects.get()
+        url = reverse('store:confirm_order', args=[order.id])
+        self.assertNotContains(self.client.get(reverse('store:order_detail', args=[order.id])), url)
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.assertEqual(Order.objects.get().status, Order.PENDING)
+        self.assertFalse(UserProductInteraction.objects.filter(interaction_type='purchase').exists())
+
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(reverse('store:order_detail', args=[order.id])), url)
+        self.assertRedirects(self.client.post(url), reverse('store:order_detail', args=[order.id]))
+        self.assertEqual(Order.objects.get().status, Order.PAID)
+
+    def test_orders_private_to_their_owner(self):
+        self.add(self.phone)
+        self.client.post(reverse('store:checkout'))
+        order = Order.objects.get()
+        self.client.force_login(User.objects.create_user(username='other'))
+        self.assertEqual(self.client.get(reverse('store:order_detail', args=[order.id])).status_code, 404)
+
+    def test_stock_changes_invalidate_product_api(self):
+        url = reverse('api:product-detail', args=[self.phone.id])
+        self.assertEqual(self.client.get(url).json()['stock'], 3)
+        self.add(self.phone)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('store:checkout'))
+        self.assertEqual(self.client.get(url).json()['stock'], 2)
+
+
+class OrderConcurrencyTestCase(TransactionTestCase):
+    def test_concurrent_checkouts_never_oversell(self):
+        category = Category.objects.create(name='Gadgets')
+        product = Product.objects.create(category=category, name='Last units', description='', price=10, stock=5)
+        shoppers = 20
+        requests = []
+        for _ in range(shoppers):
+            cart = Cart.objects.create(total=10)
+            CartItem.objects.create(cart=cart, product=product, quantity=1, unit_price=10)
+            requests.append(SimpleNamespace(session={'cart_id': cart.id}, user=AnonymousUser()))
+
+        barrier = threading.Barrier(shoppers)
+
+        def checkout(request):
+            barrier.wait()
+            try:
+                # SQLite's shared in-memory test database reports lock
+                # contention as an error instead of waiting; retry like a
+                # shopper pressing the button again.
+                for _ in range(500):
+                    try:
+                        return place_order(request) is not None
+                    except OutOfStock:
+                        return False
+                    except OperationalError:
+                        time.sleep(0.005)
+                raise AssertionError('checkout never got the database lock')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=shoppers) as pool:
+            placed = list(pool.map(checkout, requests))
+
+        product.refresh_from_db()
+        self.assertEqual(placed.count(True), 5)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(sum(Order.objects.values_list('lines__quantity', flat=True)), 5)
+        self.assertEqual(CartItem.objects.count(), shoppers - 5)
+
+
+@override_settings(PERFORMANCE={'STRICT': True})
+class PerformanceInstrumentationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.products = [
+            Product.objects.create(category=category, name=f'Gadget {i}', description='', price=10) for i in range(6)
+        ]
+        cls.staff = User.objects.create_user(username='staff', password='pw', is_staff=True)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('store:home'))
+        self.assertRegex(
+            response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="[1-9]\d* queries, \d+ duplicates"$'
+        )
+
+    async def test_recommender_time_is_reported(self):
+        response = await self.async_client.get(reverse('api:product-recommendations', args=[self.staff.id]))
+        self.assertRegex(response['Server-Timing'], r'recommender;dur=[\d.]+')
+
+    def test_query_budget_fails_strict_runs(self):
+        with override_settings(PERFORMANCE={'QUERY_BUDGETS': {'store:product_detail': 1}, 'STRICT': True}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'store:product_detail made'):
+                self.client.get(reverse('store:product_detail', args=[self.products[0].id]))
+        with override_settings(PERFORMANCE={'QUERY_BUDGETS': {'store:product_detail': 1}}):
+            with self.assertLogs('store.instrumentation', 'WARNING'):
+                response = self.client.get(reverse('store:product_detail', args=[self.products[0].id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_repeated_queries_are_flagged(self):
+        def n_plus_one(request):
+            for product in Product.objects.all():
+                Category.objects.get(pk=product.category_id)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with self.assertLogs('store.instrumentation', 'WARNING') as logs:
+            response = PerformanceMiddleware(n_plus_one)(request)
+        self.assertIn('ran the same query 6 times', logs.output[0])
+        self.assertIn('7 queries, 5 duplicates', response['Server-Timing'])
+
+    def test_percentiles_endpoint(self):
+        for _ in range(3):
+            self.client.get(reverse('store:home'))
+        self.client.get(reverse('api:product-list'))
+        self.assertEqual(self.client.get(reverse('api:performance')).status_code, 403)
+
+        self.client.login(username='staff', password='pw')
+        stats = self.client.get(reverse('api:performance')).json()
+        self.assertEqual(stats['store:home']['count'], 3)
+        self.assertEqual(stats['api:product-list']['count'], 1)
+        home = stats['store:home']
+        self.assertTrue(0 < home['p50_ms'] <= home['p95_ms'] <= home['p99_ms'] <= home['max_ms'])
+        self.assertGreater(home['queries_max'], 0)
+
+
+class BenchmarkTestCase(TestCase):
+    def test_benchmarks_run_on_a_seeded_dataset(self):
+        dataset = seed_dataset(users=5, products=30, categories=3, interactions_per_user=5, reviews_per_product=2)
+        self.assertEqual(dataset['reviews'], 60)
+        self.assertEqual(Product.objects.filter(rating_count=2).count(), 30)
+
+        results = run_benchmarks(iterations=3, cart_lines=4)
+        self.assertEqual(set(results['scenarios']), set(SCENARIOS))
+        for name, result in results['scenarios'].items():
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'], name)
+            self.assertGreaterEqual(result['peak_mib'], 0, name)
+        self.assertEqual(results['scenarios']['user_item_matrix']['queries'], 1)
+        self.assertEqual(results['scenarios']['train_recommender']['queries'], 0)
+        self.assertGreater(results['scenarios']['home_user']['queries'], 0)
+        self.assertEqual(CartItem.objects.count(), 8)  # the cart and update_cart scenarios' carts
+
+    def test_compare_flags_regressions(self):
+        def run(p50, queries, peak):
+            result = {'p50_ms': p50, 'p95_ms': p50 * 2, 'queries': queries, 'peak_mib': peak}
+            return {'scenarios': {'home_user': result}}
+
+        baseline = run(10.0, 5, 1.0)
+        self.assertEqual(compare_results(baseline, run(14.0, 5, 1.2)), [])
+        self.assertEqual(compare_results(baseline, run(10.0, 5, 1.0), threshold=0), [])
+        self.assertEqual(compare_results(run(0.2, 1, 0.0), run(0.6, 1, 0.0)), [])  # under min_ms
+        self.assertEqual(compare_results(baseline, run(16.0, 6, 2.0)), [
+            ('home_user', 'p50_ms', 10.0, 16.0),
+            ('home_user', 'p95_ms', 20.0, 32.0),
+            ('home_user', 'queries', 5, 6),
+            ('home_user', 'peak_mib', 1.0, 2.0),
+        ])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, results in [('baseline', baseline), ('faster', run(8.0, 4, 1.0)), ('slower', run(10.0, 7, 1.0))]:
+                with open(f'{tmp}/{name}.json', 'w') as f:
+                    json.dump(results, f)
+            out = StringIO()
+            call_command('benchmark', input=f'{tmp}/faster.json', compare=f'{tmp}/baseline.json', stdout=out)
+            self.assertIn('No regressions', out.getvalue())
+            with self.assertRaisesMessage(CommandError, '1 regressions'):
+                call_command('benchmark', input=f'{tmp}/slower.json', compare=f'{tmp}/baseline.json', stdout=out)
+
+
+@override_settings(POPULARITY={'TTL': 60})
+class WishlistTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Gadgets')
+        cls.phone, cls.laptop = [
+            Product.objects.create(category=category, name=name, description='', price=10)
+            for name in ('Phone', 'Laptop')
+        ]
+        cls.user = User.objects.create_user(username='shopper', password='pw')
+
+    def setUp(self):
+        wishlist.get_cache().clear()
+        fragments.get_cache().clear()
+        # Logged-in visitors get trending products until a model is trained;
+        # serve a ranking computed up front, as in production
+        publish(compute_popularity())
+        self.client.force_login(self.user)
+
+    def test_add_and_remove_by_id(self):
+        response = self.client.get(reverse('store:wishlist'))
+        self.assertEqual(list(response.context['wishlist_products']), [])
+        self.assertFalse(Wishlist.objects.exists())  # viewing doesn't create one
+
+        self.assertRedirects(self.client.get(reverse('store:add_to_wishlist', args=[self.phone.id])),
+                             reverse('store:wishlist'))
+        self.client.get(reverse('store:add_to_wishlist', args=[self.phone.id]))
+        self.client.get(reverse('store:add_to_wishlist', args=[self.laptop.id]))
+        self.assertEqual(list(Wishlist.objects.get(user=self.user).products.all()), [self.phone, self.laptop])
+        self.assertEqual(self.client.get(reverse('store:add_to_wishlist', args=[999])).status_code, 404)
+
+        self.client.get(reverse('store:remove_from_wishlist', args=[self.phone.id]))
+        self.client.get(reverse('store:remove_from_wishlist', args=[self.phone.id]))
+        response = self.client.get(reverse('store:wishlist'))
+        self.assertEqual(list(response.context['wishlist_products']), [self.laptop])
+
+    def test_adds_are_recorded_as_interactions(self):
+        wishlist.add(self.user, self.phone.id)
+        wishlist.add(self.user, self.phone.id)  # already there: not counted again
+        interactions = UserProductInteraction.objects.values_list('user', 'product', 'interaction_type')
+        self.assertEqual(list(interactions), [(self.user.id, self.phone.id, 'wishlist')])
+        matrix = get_user_item_matrix()
+        self.assertEqual(matrix.matrix[matrix.row_for_user(self.user.id)].data.tolist(), [1.5])
+
+    def test_wishlisted_ids_cached_until_changed(self):
+        wishlist.add(self.user, self.phone.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(wishlist.wishlisted_ids(self.user), {self.phone.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(wishlist.wishlisted_ids(self.user), {self.phone.id})
+        self.assertEqual(wishlist.wishlisted_ids(AnonymousUser()), set())
+
+        wishlist.remove(self.user, self.phone.id)
+        self.assertEqual(wishlist.wishlisted_ids(self.user), set())
+        # Changes made through the model, e.g. in the admin, drop the cache too
+        Wishlist.objects.get(user=self.user).products.add(self.laptop)
+        self.assertEqual(wishlist.wishlisted_ids(self.user), {self.laptop.id})
+        # ... from the product's side as well
+        self.phone.wishlisted_by.add(Wishlist.objects.get(user=self.user))
+        self.assertEqual(wishlist.wishlisted_ids(self.user), {self.phone.id, self.laptop.id})
+        self.laptop.wishlisted_by.remove(Wishlist.objects.get(user=self.user))
+        self.assertEqual(wishlist.wishlisted_ids(self.user), {self.phone.id})
+        self.phone.wishlisted_by.clear()
+        self.assertEqual(wishlist.wishlisted_ids(self.user), set())
+
+    def test_writes_ignore_a_stale_cache(self):
+        # Another worker's change, which this worker's cache hasn't seen
+        wishlist.add(self.user, self.phone.id)
+        self.assertEqual(wishlist.wishlisted_ids(self.user), {self.phone.id})
+        Wishlist.products.through.objects.filter(product=self.phone).delete()
+        self.assertTrue(wishlist.add(self.user, self.phone.id))
+        self.assertTrue(Wishlist.objects.filter(user=self.user, products=self.phone).exists())
+
+        Wishlist.products.through.objects.create(wishlist=Wishlist.objects.get(user=self.user), product=self.laptop)
+        self.assertTrue(wishlist.remove(self.user, self.laptop.id))
+        self.assertEqual(wishlist.wishlisted_ids(self.user), {self.phone.id})
+
+    def test_listings_mark_wishlisted_products(self):
+        wishlist.add(self.user, self.phone.id)
+        response = self.client.get(reverse('store:home'))
+        self.assertContains(response, reverse('store:remove_from_wishlist', args=[self.phone.id]))
+        self.assertContains(response, reverse('store:add_to_wishlist', args=[self.laptop.id]))
+        response = self.client.get(reverse('store:product_detail', args=[self.phone.id]))
+        self.assertContains(response, 'Remove from Wishlist')
+
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('store:home')), 'wishlist/')
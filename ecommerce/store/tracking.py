@@ -0,0 +1,189 @@
+"""
+Buffered recording of UserProductInteraction events.
+
+Views call `track_interaction`, which only appends the event to an
+in-memory buffer. A background thread writes the buffer with `bulk_create`
+whenever it holds BATCH_SIZE events or FLUSH_INTERVAL seconds have passed,
+so page views never wait on an INSERT. If a batch is rejected because
+some of its users or products have since been deleted, those events are
+dropped and the rest written again. Configure it with the
+INTERACTION_TRACKING setting.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, UserProductInteraction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Events per bulk INSERT; reaching it wakes the flusher early.
+    'BATCH_SIZE': 500,
+    # Longest an event waits in the buffer, in seconds.
+    'FLUSH_INTERVAL': 2.0,
+    # Events held before new ones are dropped rather than slowing requests.
+    'MAX_PENDING': 50_000,
+    # Flush from a background thread. When False, the request that fills a
+    # batch writes it inline (used by the test runner).
+    'BACKGROUND': True,
+}
+
+
+class InteractionTracker:
+    def __init__(self, batch_size, flush_interval, max_pending, background=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.background = background
+        self.dropped = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+    def track(self, user_id, product_id, interaction_type):
+        """
+        Buffer one event. Returns False if it was dropped because the buffer
+        is full (the database is not keeping up).
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning('Interaction buffer full; %d events dropped so far.', self.dropped)
+                self._wakeup.set()
+                return False
+            self._pending.append((user_id, product_id, interaction_type, timezone.now()))
+            full_batch = len(self._pending) >= self.batch_size
+
+        if not self.background:
+            if full_batch:
+                self.flush()
+        else:
+            self._ensure_thread()
+            if full_batch:
+                self._wakeup.set()
+        return True
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write every buffered event to the database. Returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, deque()
+            if not batch:
+                return 0
+            try:
+                try:
+                    self._write(batch)
+                except IntegrityError:
+                    # Events of since-deleted users or products fail the whole
+                    # INSERT; write the others
+                    valid = self._without_deleted(batch)
+                    if len(valid) < len(batch):
+                        logger.warning('Dropping %d interactions of deleted users or products.',
+                                       len(batch) - len(valid))
+                        self.dropped += len(batch) - len(valid)
+                    batch = valid
+                    self._write(batch)
+            except DatabaseError:
+                logger.exception('Failed to write %d interactions; dropping them.', len(batch))
+                self.dropped += len(batch)
+                return 0
+            return len(batch)
+
+    def _write(self, batch):
+        UserProductInteraction.objects.bulk_create(
+            [
+                UserProductInteraction(
+                    user_id=user_id, product_id=product_id,
+                    interaction_type=interaction_type, timestamp=timestamp,
+                )
+                for user_id, product_id, interaction_type, timestamp in batch
+            ],
+            batch_size=self.batch_size,
+        )
+
+    @staticmethod
+    def _without_deleted(batch):
+        user_ids = set(User.objects.filter(pk__in={event[0] for event in batch}).values_list('pk', flat=True))
+        product_ids = set(
+            Product.objects.filter(pk__in={event[1] for event in batch}).values_list('pk', flat=True)
+        )
+        return [event for event in batch if event[0] in user_ids and event[1] in product_ids]
+
+    def _ensure_thread(self):
+        # A tracker inherited across fork() has no running thread in the child.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='interaction-tracker', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+    def stop(self, timeout=5.0):
+        """Stop the background thread and drain whatever is still buffered."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+
+_tracker = None
+
+
+def get_tracker():
+    global _tracker
+    if _tracker is None:
+        options = {**DEFAULTS, **getattr(settings, 'INTERACTION_TRACKING', {})}
+        _tracker = InteractionTracker(
+            batch_size=options['BATCH_SIZE'],
+            flush_interval=options['FLUSH_INTERVAL'],
+            max_pending=options['MAX_PENDING'],
+            background=options['BACKGROUND'],
+        )
+    return _tracker
+
+
+def track_interaction(user, product_id, interaction_type):
+    """
+    Record that `user` interacted with a product, without blocking the
+    request. Anonymous users are not tracked.
+    """
+    if user.is_authenticated:
+        get_tracker().track(user.id, product_id, interaction_type)
+
+
+@receiver(setting_changed)
+def reset_tracker(setting, **kwargs):
+    global _tracker
+    if setting == 'INTERACTION_TRACKING' and _tracker is not None:
+        _tracker.stop()
+        _tracker = None
@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('signup/', views.signup, name='signup'),
     path('products/', views.home, name='products'),
+    path('search/', views.search, name='search'),
     path('products/<int:product_id>/', views.product_detail, name='product_detail'),
     path('cart/', views.cart, name='cart'),
     path('profile/', views.profile, name='profile'),
@@ -23,4 +24,7 @@ urlpatterns = [
 
     # Add the checkout URL pattern
     path('checkout/', views.checkout, name='checkout'),
+    path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
+    path('orders/<int:order_id>/confirm/', views.confirm_order, name='confirm_order'),
+    path('orders/<int:order_id>/cancel/', views.cancel_order, name='cancel_order'),
 ]
@@ -1,11 +1,29 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from .models import Product, Review, UserProductInteraction, Wishlist
-from .serializers import ProductSerializer
-from .recommender import get_user_recommendations
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.core.paginator import Paginator
+from django.db import transaction
+from .models import Category, Order, Product, Review, UserProductInteraction
+from .pagination import keyset_paginate, parse_cursor
+from .api_cache import CachedDetailMixin, CachedListMixin
+from . import export, fragments, instrumentation
+from .search import autocomplete, parse_filters, search_products
+from .serializers import ProductRowSerializer, ProductSerializer
+from .popularity import apopular_products
+from .recommender import active_user_ids, aget_similar_products, aget_user_recommendations, recommend_batch
+from .tracking import track_interaction
+from . import cart as carts
+from . import orders
+from . import wishlist as wishlists
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics
+from rest_framework.permissions import IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
+from .filters import ProductFilter, facet_counts
 from .forms import ProductForm, ReviewForm  # We'll create this in step 3
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
@@ -23,16 +41,65 @@ def signup(request):
     return render(request, 'store/signup.html', {'form': form})
 # Frontend Views
 
-def home(request):
-    products = Product.objects.all()
-    recommendations = None
-    if request.user.is_authenticated:
-        recommendations = get_user_recommendations(request.user.id)
+PRODUCTS_PER_PAGE = 12
+RECOMMENDATIONS_COUNT = 5  # as many as get_user_recommendations returns
+
+async def home(request):
+    # Async: the product grid, category list and recommendations are fetched
+    # concurrently, and recommendation scoring runs off the event loop, as do
+    # the fragment cache lookups and template rendering. The grid is the same
+    # for every anonymous visitor and is cached whole; see store/fragments.py
+    category_id = parse_cursor(request.GET.get('category'))
+    after, before = parse_cursor(request.GET.get('after')), parse_cursor(request.GET.get('before'))
+    user = await request.auser()
+    if user.is_authenticated:
+        recommendations = aget_user_recommendations(user.id)
+    else:
+        recommendations = apopular_products(RECOMMENDATIONS_COUNT, category_id=category_id)
+    categories, recommendations, grid = await asyncio.gather(
+        _alist(Category.objects.only('id', 'name').order_by('name')),
+        recommendations,
+        sync_to_async(_cached_product_grid)(category_id, after, before, user),
+    )
     context = {
-        'products': products,
+        'grid': grid,
+        'categories': categories,
+        'category_id': category_id,
         'recommendations': recommendations,
+        'recommendation_cards': await sync_to_async(fragments.render_cards)(recommendations, compact=True),
     }
-    return render(request, 'store/index.html', context)
+    return await sync_to_async(render)(request, 'store/index.html', context)
+
+
+def _cached_product_grid(category_id, after, before, user):
+    if user.is_authenticated:
+        return _product_grid(category_id, after, before, user)
+    key = fragments.grid_key(category_id, after, before)
+    grid = fragments.get_cache().get(key)
+    if grid is None:
+        grid = _product_grid(category_id, after, before, user)
+        fragments.get_cache().set(key, grid)
+    return grid
+
+
+def _product_grid(category_id, after, before, user):
+    products = (
+        Product.objects.select_related('category')
+        .only(
+            'id', 'name', 'description', 'price', 'image', 'image_variants', 'rating_count', 'rating_average',
+            'category__name',
+        )
+    )
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    page = keyset_paginate(products, PRODUCTS_PER_PAGE, after=after, before=before)
+    # Logged-in visitors get wishlist buttons, outside the cached cards
+    wishlisted = wishlists.wishlisted_ids(user) if user.is_authenticated else None
+    return fragments.render_grid(page, category_id, wishlisted)
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
 
 
 
@@ -43,131 +110,145 @@ def profile(request):
     return render(request, 'store/profile.html')
 
 
-def product_detail(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
-    return render(request, 'store/product_detail.html', {'product': product})
+REVIEWS_PER_PAGE = 10
 
-# Wishlist section
+def _reviews_page(product, number):
+    reviews = Paginator(product.reviews.select_related('user').order_by('-created_at', '-id'), REVIEWS_PER_PAGE)
+    page = reviews.get_page(number)
+    page.object_list = list(page.object_list)
+    return page
 
-def get_user_wishlist(user):
-    # Returns the wishlist for a user, creating it if necessary
-    wishlist, created = Wishlist.objects.get_or_create(user=user)
-    return wishlist
+async def product_detail(request, product_id):
+    product = await aget_object_or_404(Product, pk=product_id)
+    user = await request.auser()
+    await sync_to_async(track_interaction)(user, product.id, 'view')
+    reviews, similar_products, wishlisted = await asyncio.gather(
+        sync_to_async(_reviews_page)(product, request.GET.get('reviews_page')),
+        aget_similar_products(product.id),
+        sync_to_async(wishlists.wishlisted_ids)(user),
+    )
+    context = {
+        'product': product,
+        'reviews': reviews,
+        'wishlisted': product.id in wishlisted,
+        'similar_products': similar_products,
+        'similar_cards': await sync_to_async(fragments.render_cards)(similar_products, compact=True),
+    }
+    return await sync_to_async(render)(request, 'store/product_detail.html', context)
+
+SEARCH_PAGE_SIZE = 20
+
+def _search_url(query, category_ids=None, min_price=None, max_price=None, page=None):
+    params = [('q', query)] + [('category', category_id) for category_id in category_ids or ()]
+    params += [(key, value) for key, value in (('min_price', min_price), ('max_price', max_price), ('page', page))
+               if value is not None]
+    return f"{reverse('store:search')}?{urlencode(params)}"
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    filters = parse_filters(request.GET)
+    page = parse_cursor(request.GET.get('page')) or 1
+    result = search_products(query, **filters, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE)
+
+    # Facet links toggle a category, or select/clear a price range
+    selected = set(filters['category_ids'] or ())
+    for facet in result.categories:
+        facet['selected'] = facet['id'] in selected
+        facet['url'] = _search_url(
+            query, sorted(selected ^ {facet['id']}), filters['min_price'], filters['max_price']
+        )
+    for facet in result.prices:
+        facet['selected'] = (facet['min'], facet['max']) == (filters['min_price'], filters['max_price'])
+        bounds = (None, None) if facet['selected'] else (facet['min'], facet['max'])
+        facet['url'] = _search_url(query, filters['category_ids'], *bounds)
+
+    def page_url(number):
+        return _search_url(query, filters['category_ids'], filters['min_price'], filters['max_price'], number)
 
-# from django.contrib.auth.decorators import login_required
+    context = {
+        'query': query,
+        'result': result,
+        'previous_url': page_url(page - 1) if page > 1 else None,
+        'next_url': page_url(page + 1) if page * SEARCH_PAGE_SIZE < result.total else None,
+    }
+    return render(request, 'store/search.html', context)
+
+# Wishlist section
 
 @login_required
 def wishlist_view(request):
-    wishlist = get_user_wishlist(request.user)
     context = {
-        'wishlist_products': wishlist.products.all()
+        'wishlist_products': Product.objects.filter(wishlisted_by__user=request.user).order_by('id'),
     }
     return render(request, 'store/wishlist.html', context)
 
 @login_required
 def add_to_wishlist(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    wishlist = get_user_wishlist(request.user)
-    wishlist.products.add(product)
+    if not wishlists.add(request.user, product_id):
+        raise Http404('No Product matches the given query.')
     return redirect('store:wishlist')
 
 @login_required
 def remove_from_wishlist(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    wishlist = get_user_wishlist(request.user)
-    wishlist.products.remove(product)
+    wishlists.remove(request.user, product_id)
     return redirect('store:wishlist')
 
 
-
-
-
 def cart(request):
-    # Retrieve the cart from session; the cart is stored as a dict: {product_id: quantity}
-    cart = request.session.get('cart', {})
-    cart_items = []
-    grand_total = 0
-    for pid, quantity in cart.items():
-        product = get_object_or_404(Product, pk=pid)
-        total = product.price * quantity
-        grand_total += total
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'total': total,
-        })
-    return render(request, 'store/cart.html', {'cart_items': cart_items, 'grand_total': grand_total})
+    # The cart lives in the database; the session only holds its id
+    priced = carts.price_cart(request)
+    return render(request, 'store/cart.html', {'cart_items': priced.items, 'grand_total': priced.grand_total})
 
 def add_to_cart(request, product_id):
-    # Get the product (404 if not found)
-    product = get_object_or_404(Product, pk=product_id)
-    cart = request.session.get('cart', {})
-    # Increase the quantity or add the product
-    cart[str(product_id)] = cart.get(str(product_id), 0) + 1
-    request.session['cart'] = cart  # Save back to session
+    # Increase the quantity or add the product (404 if not found)
+    if carts.change_quantity(request, product_id, 1) is None:
+        raise Http404('No Product matches the given query.')
+    track_interaction(request.user, product_id, 'cart')
     return redirect('store:cart')
 
 def remove_from_cart(request, product_id):
-    cart = request.session.get('cart', {})
-    # Remove the product if it exists in the cart
-    if str(product_id) in cart:
-        del cart[str(product_id)]
-    request.session['cart'] = cart
+    # Remove the product if it is in the cart
+    carts.remove_item(request, product_id)
     return redirect('store:cart')
 
 import json
-from django.http import JsonResponse
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
+def _update_cart_line(request, product_id, action):
+    # The cart helpers run in transactions and read the session, so they stay synchronous
+    if action == 'increment':
+        return carts.change_quantity(request, product_id, 1)
+    if action == 'decrement':
+        return carts.change_quantity(request, product_id, -1)
+    return carts.remove_item(request, product_id)
+
 @csrf_exempt
-def update_cart(request):
+async def update_cart(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         product_id = str(data.get('product_id'))
         action = data.get('action')
-        
-        # Retrieve the cart from session
-        cart = request.session.get('cart', {})
-        # Get the product details (price etc.) from the database
-        from .models import Product
-        try:
-            product = Product.objects.get(id=product_id)
-        except Product.DoesNotExist:
+        if not product_id.isdigit():
             return JsonResponse({'success': False, 'error': 'Product not found.'})
-        
+        product_id = int(product_id)
+        if action not in ('increment', 'decrement', 'remove'):
+            return JsonResponse({'success': False, 'error': 'Unknown action.'})
+
         # Process the action
-        if action == 'increment':
-            cart[product_id] = cart.get(product_id, 0) + 1
-        elif action == 'decrement':
-            # Decrement only if quantity is greater than 1; if it becomes 0, remove it
-            if cart.get(product_id, 0) > 1:
-                cart[product_id] = cart.get(product_id, 0) - 1
-            else:
-                cart.pop(product_id, None)
-                action = 'remove'  # Indicate removal
-        elif action == 'remove':
-            cart.pop(product_id, None)
-        
-        request.session['cart'] = cart  # Save the cart back into the session
-        
-        # Recalculate totals
-        new_quantity = cart.get(product_id, 0)
-        new_total = new_quantity * product.price if new_quantity else 0
-        
-        # Calculate grand total
-        grand_total = 0
-        for pid, qty in cart.items():
-            try:
-                prod = Product.objects.get(id=pid)
-                grand_total += prod.price * qty
-            except Product.DoesNotExist:
-                continue
-        
+        line = await sync_to_async(_update_cart_line)(request, product_id, action)
+        if line is None:
+            return JsonResponse({'success': False, 'error': 'Product not found.'})
+        if action == 'decrement' and not line.quantity:
+            action = 'remove'  # Decrementing the last unit removed the line
+
         return JsonResponse({
             'success': True,
-            'new_quantity': new_quantity,
-            'new_total': new_total,
-            'grand_total': grand_total,
+            'new_quantity': line.quantity,
+            'new_total': line.total,
+            'grand_total': line.grand_total,
             'action': action
         })
     return JsonResponse({'success': False, 'error': 'Invalid request method.'})
@@ -199,15 +280,60 @@ def add_review(request, product_id):
             review = form.save(commit=False)
             review.user = request.user
             review.product = product
-            review.save()
+            with transaction.atomic():
+                review.save()  # also updates the product's rating aggregates
             return redirect('store:product_detail', product_id=product.id)
     else:
         form = ReviewForm()
     return render(request, 'store/add_review.html', {'form': form, 'product': product})
 
+ORDERS_SESSION_KEY = 'order_ids'
+
 def checkout(request):
-    # For now, simply render a checkout page
-    return render(request, 'store/checkout.html')
+    # GET shows the order summary; POST reserves the stock and places the order
+    error = None
+    if request.method == 'POST':
+        try:
+            order = orders.place_order(request)
+        except orders.OutOfStock as e:
+            error = f'Not enough stock left for: {e}.'
+        except orders.PriceChanged as e:
+            error = f'The price of {e} has changed since you added it. Please check your order again.'
+        else:
+            if order is not None:
+                request.session[ORDERS_SESSION_KEY] = request.session.get(ORDERS_SESSION_KEY, []) + [order.id]
+                return redirect('store:order_detail', order_id=order.id)
+    priced = carts.price_cart(request)
+    context = {'cart_items': priced.items, 'grand_total': priced.grand_total, 'error': error}
+    return render(request, 'store/checkout.html', context)
+
+def _get_order(request, order_id):
+    # Orders are visible to their user, the session that placed them, and staff
+    order = get_object_or_404(Order, pk=order_id)
+    owns = order.user_id is not None and order.user_id == request.user.id
+    if not (owns or request.user.is_staff) and order_id not in request.session.get(ORDERS_SESSION_KEY, []):
+        raise Http404('No Order matches the given query.')
+    return order
+
+def order_detail(request, order_id):
+    order = _get_order(request, order_id)
+    return render(request, 'store/order_detail.html', {'order': order, 'lines': order.lines.all()})
+
+def confirm_order(request, order_id):
+    # Marks an order paid, so staff only until there is a payment step;
+    # shoppers can't confirm their own orders
+    if not request.user.is_staff:
+        raise PermissionDenied
+    order = get_object_or_404(Order, pk=order_id)
+    if request.method == 'POST':
+        orders.confirm_order(order.id)
+    return redirect('store:order_detail', order_id=order.id)
+
+def cancel_order(request, order_id):
+    order = _get_order(request, order_id)
+    if request.method == 'POST':
+        orders.cancel_order(order.id)
+    return redirect('store:order_detail', order_id=order.id)
 
 # Authentication
 def signup(request):
@@ -223,21 +349,123 @@ def signup(request):
 
 # API Views
 
-class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.all()
+class ProductListView(CachedListMixin, generics.ListAPIView):
+    queryset = Product.objects.select_related('category').order_by('id')
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['category', 'price']
-
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
+    filterset_class = ProductFilter
+
+    def list(self, request, *args, **kwargs):
+        # Same output as ProductSerializer, built straight from .values() rows
+        rows = ProductRowSerializer(context=self.get_serializer_context())
+        filtered = self.filter_queryset(self.get_queryset())
+        queryset = filtered.values(*rows.get_value_fields())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            response = Response(rows.to_representation(queryset))
+        else:
+            response = self.get_paginated_response(rows.to_representation(page))
+        if request.query_params.get('facets') in ('1', 'true') and isinstance(response.data, dict):
+            response.data['facets'] = facet_counts(filtered)
+        return response
+
+class ProductDetailView(CachedDetailMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
 
-class ProductRecommendationsView(APIView):
-    def get(self, request, user_id):
-        recommended_products = get_user_recommendations(user_id)
-        serializer = ProductSerializer(recommended_products, many=True)
-        return Response(serializer.data)
+async def product_recommendations(request, user_id):
+    # A plain async view rather than a DRF one, since DRF can't run async:
+    # scoring happens on the recommender's executor, not in a request thread
+    recommended_products = await aget_user_recommendations(user_id)
+    data = await sync_to_async(lambda: ProductSerializer(recommended_products, many=True).data)()
+    return JsonResponse(data, safe=False)
+
+def _stream(request, lines, content_type):
+    # Under ASGI Django would read a sync iterator to the end before sending
+    # anything, so the server gets an async one; see store/export.py
+    if isinstance(request, ASGIRequest):
+        lines = export.aiter_text(lines)
+    return StreamingHttpResponse(lines, content_type=content_type)
+
+RECOMMENDATIONS_BATCH_MAX = 50  # products per user
+
+class ProductRecommendationsBatchView(APIView):
+    """
+    Recommendations for many users in one call, for campaign jobs. POST
+    ``{"user_ids": [1, 2, ...]}`` or ``{"all_active": true}``, optionally with
+    ``"n"``; the response streams one ``{"user_id", "product_ids"}`` JSON
+    line per user, in request order, matching /api/recommendations/<id>/.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        n = request.data.get('n', 5)
+        if not isinstance(n, int) or isinstance(n, bool) or not 1 <= n <= RECOMMENDATIONS_BATCH_MAX:
+            return Response({'error': f'n must be an integer from 1 to {RECOMMENDATIONS_BATCH_MAX}.'}, status=400)
+        if request.data.get('all_active') is True:
+            user_ids = active_user_ids()
+        else:
+            user_ids = request.data.get('user_ids')
+            if not isinstance(user_ids, list) or not all(
+                isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids
+            ):
+                return Response({'error': 'Send "user_ids" as a list of integers, or "all_active": true.'}, status=400)
+
+        rows = (
+            {'user_id': user_id, 'product_ids': product_ids}
+            for user_id, product_ids in recommend_batch(user_ids, n_recommendations=n)
+        )
+        return _stream(request._request, export.render_ndjson(rows), export.CONTENT_TYPES['ndjson'])
+
+class ProductSearchView(APIView):
+    def get(self, request):
+        filters = parse_filters(request.query_params)
+        page = parse_cursor(request.query_params.get('page')) or 1
+        result = search_products(
+            request.query_params.get('q', ''), **filters,
+            limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE,
+        )
+        serializer = ProductSerializer(result.products, many=True, context={'request': request})
+        return Response({
+            'count': result.total,
+            'page': page,
+            'results': serializer.data,
+            'facets': {'categories': result.categories, 'price': result.prices},
+        })
+
+class ProductAutocompleteView(APIView):
+    def get(self, request):
+        matches = autocomplete(request.query_params.get('q', ''))
+        return Response([{'id': product_id, 'name': name} for product_id, name in matches])
+
+def export_products(request):
+    # Plain Django view: DRF would claim ?format= for content negotiation
+    output_format = request.GET.get('format', 'ndjson')
+    if output_format not in export.FORMATS:
+        return JsonResponse({'error': f'format must be one of: {", ".join(export.FORMATS)}.'}, status=400)
+    after = request.GET.get('after')
+    if after is not None:
+        after = parse_cursor(after)
+        if after is None:
+            return JsonResponse({'error': 'after must be a product id.'}, status=400)
+    updated_since = request.GET.get('updated_since')
+    if updated_since is not None:
+        try:
+            updated_since = export.parse_updated_since(updated_since)
+        except ValueError:
+            return JsonResponse({'error': 'updated_since must be an ISO 8601 date or datetime.'}, status=400)
+
+    rows = export.export_rows(after=after, updated_since=updated_since, build_url=request.build_absolute_uri)
+    response = _stream(request, export.RENDERERS[output_format](rows), export.CONTENT_TYPES[output_format])
+    response['Content-Disposition'] = f'attachment; filename="products.{output_format}"'
+    return response
+
+def performance_stats(request):
+    # Recent response times and query counts per URL name, from
+    # store/instrumentation.py; this worker's requests only
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+    return JsonResponse(instrumentation.snapshot())
 
 # Product Creation (for adding image to product)
 # from django.shortcuts import render, redirect
@@ -0,0 +1,87 @@
+"""
+Wishlists.
+
+Adding and removing a product writes one row of the Wishlist.products
+through table by id, without loading the Product or the Wishlist. The
+Wishlist row is only created by a user's first add. Each user's
+wishlisted product ids are cached (one query when cold), so listings
+can mark wishlisted products with set lookups. The cache only serves
+reads: writes check the database, since an entry may be stale, and then
+drop it. Adds are recorded as 'wishlist' interactions for the
+recommender.
+
+With the default local-memory cache each worker caches on its own; point
+WISHLIST_CACHE at a shared backend when running several workers, or
+another worker's change shows up only after CACHE_TIMEOUT seconds.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Exists, OuterRef
+
+from .models import Product, Wishlist
+from .tracking import track_interaction
+
+WishlistItem = Wishlist.products.through
+
+# Seconds a user's cached wishlist is trusted without being dropped by a write
+CACHE_TIMEOUT = 300
+
+
+def get_cache():
+    return caches[getattr(settings, 'WISHLIST_CACHE', 'default')]
+
+
+def _cache_key(user_id):
+    return f'wishlist:{user_id}'
+
+
+def _load(user_id):
+    """Return the frozenset of a user's wishlisted product ids."""
+    key = _cache_key(user_id)
+    product_ids = get_cache().get(key)
+    if product_ids is None:
+        product_ids = frozenset(
+            WishlistItem.objects.filter(wishlist__user_id=user_id).values_list('product_id', flat=True)
+        )
+        get_cache().set(key, product_ids, CACHE_TIMEOUT)
+    return product_ids
+
+
+def forget(user_id):
+    get_cache().delete(_cache_key(user_id))
+
+
+def wishlisted_ids(user):
+    """The ids of the products on `user`'s wishlist; empty for anonymous users."""
+    if not user.is_authenticated:
+        return frozenset()
+    return _load(user.id)
+
+
+def add(user, product_id):
+    """Put a product on the user's wishlist. Returns False if there is no such product."""
+    if not Product.objects.filter(pk=product_id).exists():
+        return False
+    # The wishlist's id and whether the product is already on it, in one query
+    row = (
+        Wishlist.objects.filter(user_id=user.id)
+        .annotate(listed=Exists(WishlistItem.objects.filter(wishlist_id=OuterRef('pk'), product_id=product_id)))
+        .values_list('id', 'listed').first()
+    )
+    if row is None:
+        row = (Wishlist.objects.get_or_create(user=user)[0].id, False)
+    wishlist_id, listed = row
+    if not listed:
+        WishlistItem.objects.bulk_create(
+            [WishlistItem(wishlist_id=wishlist_id, product_id=product_id)], ignore_conflicts=True
+        )
+        track_interaction(user, product_id, 'wishlist')
+    forget(user.id)
+    return True
+
+
+def remove(user, product_id):
+    """Take a product off the user's wishlist. Returns False if it wasn't on it."""
+    removed, _ = WishlistItem.objects.filter(wishlist__user_id=user.id, product_id=product_id).delete()
+    forget(user.id)
+    return bool(removed)